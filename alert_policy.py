@@ -0,0 +1,214 @@
+# alert_policy.py - Politica di notifica guidata dai cambiamenti
+# Kriterion Volatility Monitor
+#
+# Invece di inviare il report completo ogni giorno, il job confronta il run
+# corrente con l'ultimo run registrato nello storico segnali e notifica solo
+# quando qualcosa cambia: segnale, regime HMM o un salto di P(High) oltre
+# soglia. I giorni senza cambiamenti confluiscono in un digest settimanale.
+# Ogni destinatario ha la sua politica (vedi ALERT_POLICY_CONFIG), così il
+# numero di messaggi cresce con gli eventi reali e non con giorni × ticker.
+
+import os
+import json
+import tempfile
+from datetime import date, timedelta
+
+import telegram_delivery
+from telegram_delivery import DELIVERED, FAILED, get_subscribers, make_messages
+from notifications import format_change_alert, format_weekly_digest
+from instrumentation import instrumented
+from market_calendar import get_calendar
+from utils import get_secret
+from config import ALERT_POLICY_CONFIG
+
+MODES = ('all', 'changes', 'digest', 'off')
+
+
+def subscriber_policy(chat_id, mode=None):
+    """Politica effettiva del destinatario: default + override da config + modalità dal secret."""
+    policy = {**ALERT_POLICY_CONFIG['default'], **ALERT_POLICY_CONFIG['subscribers'].get(chat_id, {})}
+    if mode:
+        policy['mode'] = mode
+    if policy['mode'] not in MODES:
+        print(f"⚠️ Modalità di notifica '{policy['mode']}' non valida per {chat_id}: uso 'changes'.")
+        policy['mode'] = 'changes'
+    return policy
+
+
+def detect_changes(current, previous, policy):
+    """
+    Cambiamenti rilevanti tra il run precedente e quello corrente.
+
+    Parameters:
+    -----------
+    current, previous : dict
+        Run con almeno signal, regime, p_high (previous None al primo run)
+    policy : dict
+        Politica del destinatario (soglie)
+
+    Returns:
+    --------
+    list of str
+        Descrizione dei cambiamenti (vuota se nulla di rilevante)
+    """
+    if previous is None:
+        return ["Primo segnale registrato"]
+
+    events = []
+    if current['signal'] != previous['signal']:
+        events.append(f"Segnale: {previous['signal']} → <b>{current['signal']}</b>")
+    if policy['notify_regime'] and current['regime'] != previous['regime']:
+        events.append(f"Regime: {previous['regime']} → <b>{current['regime']}</b>")
+
+    delta = current['p_high'] - (previous['p_high'] or 0.0)
+    if abs(delta) >= policy['p_high_jump']:
+        events.append(
+            f"P(High): {previous['p_high']*100:.1f}% → <b>{current['p_high']*100:.1f}%</b> "
+            f"({delta*100:+.1f} pp)"
+        )
+    return events
+
+
+def _iso_week(market_date):
+    year, week, _ = date.fromisoformat(market_date).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def digest_due(market_date, last_digest_week, policy):
+    """
+    Il digest parte dalla prima seduta dal giorno configurato in poi, una volta
+    a settimana; se quel giorno è festivo parte dall'ultima seduta della settimana.
+    """
+    if last_digest_week == _iso_week(market_date):
+        return False
+    day = date.fromisoformat(market_date)
+    if day.weekday() >= policy['digest_weekday']:
+        return True
+    return _iso_week(get_calendar().next_session(day).isoformat()) != _iso_week(market_date)
+
+
+class AlertState:
+    """Stato persistente della politica (ultimo digest inviato per destinatario)."""
+
+    def __init__(self, path=None):
+        self.path = path or ALERT_POLICY_CONFIG['state_path']
+        self.data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as fh:
+                    self.data = json.load(fh)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"⚠️ Stato notifiche illeggibile ({e}): riparto da zero.")
+
+    def last_digest_week(self, chat_id):
+        return self.data.get(chat_id, {}).get('last_digest_week')
+
+    def mark_digest(self, chat_id, market_date):
+        self.data.setdefault(chat_id, {})['last_digest_week'] = _iso_week(market_date)
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(self.data, fh, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def plan_notifications(current, previous, daily_report, week_runs, subscribers, state, ticker):
+    """
+    Decide cosa inviare a ciascun destinatario.
+
+    Parameters:
+    -----------
+    current : dict
+        Run corrente (market_date, signal, regime, p_high)
+    previous : dict or None
+        Ultimo run registrato con data precedente
+    daily_report : str
+        Report giornaliero completo
+    week_runs : callable
+        Ritorna i run della settimana corrente (chiamata solo se serve un digest)
+    subscribers : dict
+        {chat_id: modalità o None}
+    state : AlertState
+    ticker : str
+
+    Returns:
+    --------
+    list of (chat_id, tipo, testo)
+        tipo è 'report' o 'digest'
+    """
+    plan = []
+    digest_text = None
+
+    for chat_id, mode in subscribers.items():
+        policy = subscriber_policy(chat_id, mode)
+        if policy['mode'] == 'off':
+            continue
+
+        events = detect_changes(current, previous, policy)
+        if events and policy['mode'] in ('all', 'changes'):
+            plan.append((chat_id, 'report', format_change_alert(events) + "\n\n" + daily_report))
+        elif policy['mode'] == 'all':
+            plan.append((chat_id, 'report', daily_report))
+
+        if policy['mode'] in ('changes', 'digest') and digest_due(
+                current['market_date'], state.last_digest_week(chat_id), policy):
+            if digest_text is None:
+                digest_text = format_weekly_digest(ticker, week_runs())
+            plan.append((chat_id, 'digest', digest_text))
+
+    return plan
+
+
+@instrumented('dispatch_alerts')
+def dispatch_alerts(current, daily_report, store, ticker):
+    """
+    Applica la politica di notifica al run corrente e invia i messaggi.
+    Il run corrente non deve essere ancora registrato nello storico.
+
+    Returns:
+    --------
+    bool
+        True se è stato inviato almeno un messaggio e tutti sono stati consegnati
+    """
+    subscribers = get_subscribers()
+    if not get_secret('TELEGRAM_BOT_TOKEN') or not subscribers:
+        print("⚠️ Credenziali Telegram mancanti. Messaggio non inviato.")
+        print("   Configura TELEGRAM_BOT_TOKEN e TELEGRAM_CHAT_IDS (o TELEGRAM_CHAT_ID) nei secrets.")
+        return False
+
+    previous = store.previous(ticker, current['market_date'])
+    state = AlertState()
+
+    def week_runs():
+        monday = date.fromisoformat(current['market_date'])
+        monday -= timedelta(days=monday.weekday())
+        runs = {r['market_date']: r for r in store.history(ticker, start=monday.isoformat())}
+        runs[current['market_date']] = current
+        return [runs[d] for d in sorted(runs)]
+
+    plan = plan_notifications(current, previous, daily_report, week_runs, subscribers, state, ticker)
+    if not plan:
+        print("   🔕 Nessun cambiamento rilevante: notifica rimandata al digest settimanale.")
+        telegram_delivery.flush_outbox()
+        return False
+
+    messages = []
+    for chat_id, kind, text in plan:
+        message = make_messages(text, [chat_id])[0]
+        messages.append((kind, message))
+    outcomes = telegram_delivery.send_messages([m for _, m in messages])
+
+    for kind, message in messages:
+        # Un digest in outbox verrà consegnato al prossimo run: non va ripetuto
+        if kind == 'digest' and outcomes.get(message['id']) != FAILED:
+            state.mark_digest(message['chat_id'], current['market_date'])
+    state.save()
+
+    delivered = sum(outcomes.get(m['id']) == DELIVERED for _, m in messages)
+    kinds = sorted({kind for kind, _ in messages})
+    print(f"   📨 Inviati {delivered}/{len(messages)} messaggi ({', '.join(kinds)}) "
+          f"a {len({m['chat_id'] for _, m in messages})} destinatari.")
+    return delivered == len(messages)
@@ -0,0 +1,287 @@
+# api.py - API HTTP in sola lettura su segnale e storico regimi
+# Kriterion Volatility Monitor
+#
+# Serve i risultati già calcolati dal job (registro segnali, storico regimi,
+# ultimo nowcast) senza mai lanciare un modello. Le risposte sono JSON con
+# ETag: un client che ripete la richiesta con If-None-Match riceve 304 senza
+# corpo finché i file sorgente non cambiano. Corpo serializzato, ETag e
+# versione gzip sono messi in cache per URL e invalidati dall'mtime dei file,
+# così il polling ad alta frequenza costa una stat() per richiesta.
+#
+# Endpoint (GET/HEAD):
+#   /v1/latest                          ultimo segnale ufficiale (+ nowcast provvisorio)
+#   /v1/probabilities                   probabilità HMM dell'ultima seduta
+#   /v1/history?start=YYYY-MM-DD&end=   regime e probabilità per seduta
+#   /v1/signals?start=&end=             run registrati nel registro segnali
+#   /health
+#
+# Uso:
+#   python api.py [--host 0.0.0.0] [--port 8080]
+
+import os
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import date
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from signal_store import SignalStore, load_regime_history
+from config import TICKER, API_CONFIG, SIGNAL_STORE_CONFIG, NOWCAST_CONFIG
+
+SOURCES = (
+    SIGNAL_STORE_CONFIG['path'],
+    SIGNAL_STORE_CONFIG['regime_history_path'],
+    NOWCAST_CONFIG['output_path'],
+)
+CACHE_SIZE = 256
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class NotFound(LookupError):
+    pass
+
+
+def _source_signature():
+    """Versione dei dati: mtime e dimensione dei file sorgente."""
+    signature = []
+    for path in SOURCES:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _date_param(query, name):
+    value = query.get(name, [None])[0]
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise BadRequest(f"Parametro '{name}' non valido: atteso YYYY-MM-DD")
+
+
+def _load_nowcast():
+    try:
+        with open(NOWCAST_CONFIG['output_path']) as fh:
+            return json.load(fh)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+# =============================================================================
+# ENDPOINT
+# =============================================================================
+
+def latest(query):
+    run = SignalStore().latest(TICKER)
+    if run is None:
+        raise NotFound("Nessun segnale registrato")
+    run.pop('id', None)
+    run.pop('timings', None)
+
+    nowcast = _load_nowcast()
+    if nowcast and nowcast.get('session', '') <= run['market_date']:
+        nowcast = None      # Nowcast superato dalla chiusura ufficiale
+    return {**run, 'nowcast': nowcast}
+
+
+def probabilities(query):
+    history = load_regime_history()
+    if history is None or history.empty:
+        raise NotFound("Storico regimi non disponibile")
+    last = history.iloc[-1]
+    return {
+        'ticker': TICKER,
+        'date': history.index[-1],
+        'regime': last['Regime'],
+        'p_low': float(last['P_Low']),
+        'p_medium': float(last['P_Medium']),
+        'p_high': float(last['P_High'])
+    }
+
+
+def history(query):
+    start, end = _date_param(query, 'start'), _date_param(query, 'end')
+    regimes = load_regime_history()
+    if regimes is None:
+        raise NotFound("Storico regimi non disponibile")
+    rows = regimes.loc[start:end]
+    return {
+        'ticker': TICKER,
+        'start': rows.index[0] if len(rows) else start,
+        'end': rows.index[-1] if len(rows) else end,
+        'count': len(rows),
+        'rows': rows.reset_index().to_dict(orient='records')
+    }
+
+
+def signals(query):
+    start, end = _date_param(query, 'start'), _date_param(query, 'end')
+    runs = SignalStore().history(TICKER, start, end)
+    for run in runs:
+        run.pop('id', None)
+    return {'ticker': TICKER, 'count': len(runs), 'rows': runs}
+
+
+def health(query):
+    return {'status': 'ok', 'ticker': TICKER,
+            'sources': {path: os.path.exists(path) for path in SOURCES}}
+
+
+ROUTES = {
+    '/v1/latest': latest,
+    '/v1/probabilities': probabilities,
+    '/v1/history': history,
+    '/v1/signals': signals,
+    '/health': health,
+}
+
+
+# =============================================================================
+# CACHE DELLE RISPOSTE
+# =============================================================================
+
+class ResponseCache:
+    """Corpo JSON, ETag e versione gzip per URL, validi finché i file sorgente non cambiano."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, query_string):
+        query = parse_qs(query_string)
+        key = (path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+        signature = _source_signature()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['signature'] == signature:
+                self._entries.move_to_end(key)
+                return entry
+
+        body = json.dumps(ROUTES[path](query), default=str, separators=(',', ':')).encode()
+        entry = {
+            'signature': signature,
+            'body': body,
+            'etag': f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            'gzip': gzip.compress(body, compresslevel=6) if len(body) >= API_CONFIG['min_gzip_bytes'] else None
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    candidates = [t.strip() for t in header.split(',')]
+    return '*' in candidates or any(t.removeprefix('W/') == etag for t in candidates)
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    server_version = 'KriterionAPI/1.0'
+    cache = ResponseCache()
+
+    def _send_json(self, status, payload, head=False):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _serve(self, head=False):
+        url = urlsplit(self.path)
+        if url.path not in ROUTES:
+            return self._send_json(404, {'error': 'endpoint sconosciuto', 'endpoints': sorted(ROUTES)}, head)
+
+        try:
+            entry = self.cache.get(url.path, url.query)
+        except BadRequest as e:
+            return self._send_json(400, {'error': str(e)}, head)
+        except NotFound as e:
+            return self._send_json(404, {'error': str(e)}, head)
+
+        common = [
+            ('ETag', entry['etag']),
+            ('Cache-Control', f"public, max-age={API_CONFIG['max_age']}"),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if _etag_matches(self.headers.get('If-None-Match'), entry['etag']):
+            self.send_response(304)
+            for name, value in common:
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        body = entry['body']
+        use_gzip = entry['gzip'] is not None and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if use_gzip:
+            body = entry['gzip']
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in common:
+            self.send_header(name, value)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._serve()
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def _read_only(self):
+        self.send_response(405)
+        self.send_header('Allow', 'GET, HEAD')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = _read_only
+
+    def log_message(self, format, *args):
+        # Log sintetico: il polling ad alta frequenza non deve riempire i log
+        if not str(args[1] if len(args) > 1 else '').startswith(('2', '3')):
+            super().log_message(format, *args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API HTTP Kriterion (sola lettura)")
+    parser.add_argument('--host', default=API_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=API_CONFIG['port'])
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), APIHandler)
+    print(f"🌐 API Kriterion su http://{args.host}:{args.port} ({', '.join(sorted(ROUTES))})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 API arrestata.")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,10 +9,16 @@ from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
 
 # Import moduli locali
-from data_loader import download_data, calculate_features
-from models import train_hmm, get_hmm_states, train_garch
-from config import TICKER, HMM_PARAMS, REGIME_COLORS, REGIME_LABELS, SIGNAL_CONFIG, THRESHOLDS
+from pipeline import compute_snapshot
+from cache_warmer import SnapshotRefresher
+from instrumentation import instrumented, start_run, load_recent_runs
+from config import (TICKER, HMM_PARAMS, HMM_SELECTION_CONFIG, VOL_MODELS_CONFIG, FORECAST_EVAL_CONFIG,
+                    TERM_STRUCTURE_CONFIG, SIMULATION_CONFIG, REGIME_FORECAST_CONFIG, BOOTSTRAP_CONFIG,
+                    SIGNAL_CONFIG, THRESHOLDS, regime_labels, regime_colors)
 from notifications import send_telegram_alert, format_message
+from signals import generate_signal
+from forecast_eval import evaluate_log, evaluate_in_sample, PUBLISHED
+from bootstrap import load_bootstrap
 
 # ============================================================================
 # CONFIGURAZIONE PAGINA
@@ -281,6 +287,18 @@ st.markdown("""
 # FUNZIONI HELPER PER GRAFICI
 # ============================================================================
 
+def regime_palette(df):
+    """Etichette e colori dei K regimi presenti nello snapshot (colonne P_State_k)."""
+    n_states = sum(col.startswith('P_State_') for col in df.columns)
+    return regime_labels(n_states), regime_colors(n_states)
+
+
+def _rgba(hex_color, alpha):
+    r, g, b = (int(hex_color[i:i + 2], 16) for i in (1, 3, 5))
+    return f'rgba({r}, {g}, {b}, {alpha})'
+
+
+@instrumented('fig_price_regime')
 def create_price_regime_chart(df, n_days=252):
     """Grafico prezzo SPY (o Livello VIX) con overlay regimi di volatilità."""
     df_plot = df.tail(n_days).copy()
@@ -291,18 +309,19 @@ def create_price_regime_chart(df, n_days=252):
     y_col = 'Close'
     y_label = "Livello VIX" if IS_VIX else "Prezzo ($)"
     title_text = f"📈 {y_label} con Regimi di Volatilità"
+    labels, colors = regime_palette(df)
     
     # Punti colorati per regime
-    for state in range(3):
+    for state in labels:
         mask = df_plot['HMM_State'] == state
         if mask.sum() > 0:
             fig.add_trace(go.Scatter(
                 x=df_plot.index[mask],
                 y=df_plot.loc[mask, y_col],
                 mode='markers',
-                name=REGIME_LABELS[state],
-                marker=dict(color=REGIME_COLORS[state], size=5, opacity=0.8),
-                hovertemplate='%{x}<br>' + f'{y_label}: ' + '%{y:.2f}<br>' + REGIME_LABELS[state] + '<extra></extra>'
+                name=labels[state],
+                marker=dict(color=colors[state], size=5, opacity=0.8),
+                hovertemplate='%{x}<br>' + f'{y_label}: ' + '%{y:.2f}<br>' + labels[state] + '<extra></extra>'
             ))
     
     # Linea prezzo/livello
@@ -329,42 +348,69 @@ def create_price_regime_chart(df, n_days=252):
     return fig
 
 
+@instrumented('fig_probability')
 def create_probability_chart(df, n_days=252):
     """Grafico stacked area delle probabilità dei regimi."""
     df_plot = df.tail(n_days).copy()
+    labels, colors = regime_palette(df)
     
     fig = go.Figure()
     
+    for state in labels:
+        fig.add_trace(go.Scatter(
+            x=df_plot.index, y=df_plot[f'P_State_{state}'],
+            mode='lines', name=f'P({labels[state]})', stackgroup='one',
+            fillcolor=_rgba(colors[state], 0.7),
+            line=dict(color=colors[state], width=0.5),
+            hovertemplate=f'{labels[state]}: ' + '%{y:.1%}<extra></extra>'
+        ))
+    
+    # Linea soglia
+    fig.add_hline(y=THRESHOLDS['high_vol'], line_dash="dash", line_color="gray",
+                  annotation_text=f"Soglia Risk-Off ({THRESHOLDS['high_vol']*100:.0f}%)")
+    
+    fig.update_layout(
+        title=dict(text="📊 Probabilità Regimi HMM nel Tempo", font=dict(size=16)),
+        xaxis_title="Data",
+        yaxis_title="Probabilità",
+        yaxis=dict(tickformat='.0%', range=[0, 1]),
+        hovermode='x unified',
+        height=400,
+        template='plotly_white',
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='center', x=0.5),
+        margin=dict(l=50, r=30, t=80, b=50)
+    )
+    
+    return fig
+
+
+def create_regime_outlook_chart(df, n_days=252):
+    """P(High) corrente contro le previsioni a signal_horizon sedute dalla matrice di transizione."""
+    df_plot = df.tail(n_days)
+    horizon = REGIME_FORECAST_CONFIG['signal_horizon']
+    
+    fig = go.Figure()
     fig.add_trace(go.Scatter(
-        x=df_plot.index, y=df_plot['P_Low'],
-        mode='lines', name='P(Low Vol)', stackgroup='one',
-        fillcolor='rgba(40, 167, 69, 0.7)',
-        line=dict(color='#28a745', width=0.5),
-        hovertemplate='Low: %{y:.1%}<extra></extra>'
+        x=df_plot.index, y=df_plot['P_High'], mode='lines', name='P(High) corrente',
+        line=dict(color='#dc3545', width=1.5),
+        hovertemplate='%{y:.1%}<extra></extra>'
     ))
-    
     fig.add_trace(go.Scatter(
-        x=df_plot.index, y=df_plot['P_Medium'],
-        mode='lines', name='P(Medium Vol)', stackgroup='one',
-        fillcolor='rgba(255, 193, 7, 0.7)',
-        line=dict(color='#ffc107', width=0.5),
-        hovertemplate='Medium: %{y:.1%}<extra></extra>'
+        x=df_plot.index, y=df_plot['P_High_Ahead'], mode='lines', name=f'P(High) a {horizon} sedute',
+        line=dict(color='#fd7e14', width=1.5, dash='dash'),
+        hovertemplate='%{y:.1%}<extra></extra>'
     ))
-    
     fig.add_trace(go.Scatter(
-        x=df_plot.index, y=df_plot['P_High'],
-        mode='lines', name='P(High Vol)', stackgroup='one',
-        fillcolor='rgba(220, 53, 69, 0.7)',
-        line=dict(color='#dc3545', width=0.5),
-        hovertemplate='High: %{y:.1%}<extra></extra>'
+        x=df_plot.index, y=df_plot['Hit_High'], mode='lines', name=f'Ingresso in High entro {horizon} sedute',
+        line=dict(color='#6f42c1', width=1.5),
+        hovertemplate='%{y:.1%}<extra></extra>'
     ))
-    
-    # Linea soglia
-    fig.add_hline(y=THRESHOLDS['high_vol'], line_dash="dash", line_color="gray",
-                  annotation_text=f"Soglia Risk-Off ({THRESHOLDS['high_vol']*100:.0f}%)")
+    if REGIME_FORECAST_CONFIG['alert_on_hit_high']:
+        fig.add_hline(y=THRESHOLDS['hit_high'], line_dash="dot", line_color="gray",
+                      annotation_text=f"Soglia Alert ({THRESHOLDS['hit_high']*100:.0f}%)")
     
     fig.update_layout(
-        title=dict(text="📊 Probabilità Regimi HMM nel Tempo", font=dict(size=16)),
+        title=dict(text="🔭 Previsioni dei Regimi dalla Matrice di Transizione", font=dict(size=16)),
         xaxis_title="Data",
         yaxis_title="Probabilità",
         yaxis=dict(tickformat='.0%', range=[0, 1]),
@@ -378,6 +424,7 @@ def create_probability_chart(df, n_days=252):
     return fig
 
 
+@instrumented('fig_volatility')
 def create_volatility_comparison_chart(df, garch_vol, garch_res, n_days=120):
     """
     Grafico confronto volatilità.
@@ -475,14 +522,16 @@ def create_volatility_comparison_chart(df, garch_vol, garch_res, n_days=120):
     return fig
 
 
+@instrumented('fig_regime_distribution')
 def create_regime_distribution_chart(df):
     """Grafico distribuzione volatilità per regime (violin plot o histogram)."""
     fig = go.Figure()
     
     # Adattamento etichette
     x_label = "Livello VIX" if IS_VIX else "Volatilità Annualizzata (%)"
+    labels, colors = regime_palette(df)
     
-    for state in range(3):
+    for state in labels:
         mask = df['HMM_State'] == state
         
         # Se IS_VIX è True, GK_Vol nel data_loader è stato impostato come Close/100.
@@ -492,8 +541,8 @@ def create_regime_distribution_chart(df):
         
         fig.add_trace(go.Histogram(
             x=vol_data,
-            name=REGIME_LABELS[state],
-            marker_color=REGIME_COLORS[state],
+            name=labels[state],
+            marker_color=colors[state],
             opacity=0.7,
             nbinsx=40
         ))
@@ -512,6 +561,7 @@ def create_regime_distribution_chart(df):
     return fig
 
 
+@instrumented('fig_combined')
 def create_combined_dashboard_chart(df, garch_vol, garch_res, n_days=90):
     """Grafico combinato con prezzo, volatilità dinamica e probabilità."""
     df_plot = df.tail(n_days).copy()
@@ -530,15 +580,16 @@ def create_combined_dashboard_chart(df, garch_vol, garch_res, n_days=90):
     
     # --- ROW 1: Asset Principale (Prezzo o Livello VIX) ---
     y_col = 'Close'
-    for state in range(3):
+    labels, colors = regime_palette(df)
+    for state in labels:
         mask = df_plot['HMM_State'] == state
         if mask.sum() > 0:
             fig.add_trace(go.Scatter(
                 x=df_plot.index[mask],
                 y=df_plot.loc[mask, y_col],
                 mode='markers',
-                name=REGIME_LABELS[state],
-                marker=dict(color=REGIME_COLORS[state], size=5),
+                name=labels[state],
+                marker=dict(color=colors[state], size=5),
                 showlegend=True
             ), row=1, col=1)
     
@@ -623,11 +674,175 @@ def create_combined_dashboard_chart(df, garch_vol, garch_res, n_days=90):
     return fig
 
 
+def create_term_structure_chart(curve, tenors):
+    """Curva dei forecast di volatilità: puntuale e media integrata per orizzonte, con i tenor."""
+    fig = go.Figure()
+    
+    fig.add_trace(go.Scatter(
+        x=curve['horizon'],
+        y=curve['vol_ann'] * 100,
+        mode='lines',
+        name='Forecast puntuale',
+        line=dict(color='#6c757d', width=1, dash='dash'),
+        hovertemplate='h=%{x}: %{y:.2f}%<extra></extra>'
+    ))
+    fig.add_trace(go.Scatter(
+        x=curve['horizon'],
+        y=curve['avg_vol_ann'] * 100,
+        mode='lines',
+        name='Media integrata 1..h',
+        line=dict(color='#007bff', width=2),
+        hovertemplate='h=%{x}: %{y:.2f}%<extra></extra>'
+    ))
+    fig.add_trace(go.Scatter(
+        x=[TERM_STRUCTURE_CONFIG['tenors'][label] for label in tenors],
+        y=[v * 100 for v in tenors.values()],
+        mode='markers+text',
+        name='Tenor',
+        text=list(tenors),
+        textposition='top center',
+        marker=dict(color='#007bff', size=9),
+        hovertemplate='%{text}: %{y:.2f}%<extra></extra>'
+    ))
+    
+    fig.update_layout(
+        title=dict(text="📐 Struttura a Termine della Volatilità Prevista", font=dict(size=16)),
+        xaxis_title="Orizzonte (sedute)",
+        yaxis_title="Volatilità Annualizzata (%)",
+        height=350,
+        template='plotly_white',
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='center', x=0.5),
+        margin=dict(l=50, r=30, t=80, b=50)
+    )
+    
+    return fig
+
+
+def create_vix_curve_chart(df, n_days=252):
+    """Serie Cboe della curva (VIX9D, VIX, VIX3M, VIX6M) e rapporto VIX/VIX3M con la soglia di backwardation."""
+    df_plot = df.tail(n_days)
+    
+    fig = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        row_heights=[0.6, 0.4],
+        subplot_titles=("Curva VIX", "VIX / VIX3M")
+    )
+    
+    curve = [('VIX9D', '#dc3545'), ('Close', '#212529'), ('VIX3M', '#007bff'), ('VIX6M', '#6c757d')]
+    for col, color in curve:
+        if col not in df_plot.columns:
+            continue
+        name = 'VIX' if col == 'Close' else col
+        fig.add_trace(go.Scatter(
+            x=df_plot.index, y=df_plot[col],
+            mode='lines', name=name,
+            line=dict(color=color, width=2 if col == 'Close' else 1.2),
+            hovertemplate=f'{name}: %{{y:.2f}}<extra></extra>'
+        ), row=1, col=1)
+    
+    if 'TS_Ratio' in df_plot.columns:
+        fig.add_trace(go.Scatter(
+            x=df_plot.index, y=df_plot['TS_Ratio'],
+            mode='lines', name='VIX / VIX3M',
+            line=dict(color='#fd7e14', width=1.5),
+            showlegend=False,
+            hovertemplate='Ratio: %{y:.3f}<extra></extra>'
+        ), row=2, col=1)
+        # Sopra 1: backwardation (il breve costa più del lungo), tipica dello stress
+        fig.add_hline(y=1.0, line=dict(color='#dc3545', width=1, dash='dash'), row=2, col=1)
+    
+    fig.update_layout(
+        title=dict(text="📈 Term Structure VIX (Cboe)", font=dict(size=16)),
+        height=450,
+        template='plotly_white',
+        legend=dict(orientation='h', yanchor='bottom', y=1.04, xanchor='center', x=0.5),
+        margin=dict(l=50, r=30, t=90, b=40)
+    )
+    
+    return fig
+
+
+def create_fan_chart(fan, title, yaxis_title, scale=1.0, color='#007bff'):
+    """Fan chart da simulation.simulate_paths: bande tra quantili simmetrici e mediana per orizzonte."""
+    fig = go.Figure()
+    quantiles = [q for q in fan.columns if q != 'mean']
+    fill = 'rgba(0, 123, 255, {})'
+    
+    # Bande dall'esterno verso l'interno (es. 5-95% e 25-75%)
+    for i, alpha in zip(range(len(quantiles) // 2), (0.15, 0.3, 0.45)):
+        lo, hi = quantiles[i], quantiles[-1 - i]
+        fig.add_trace(go.Scatter(
+            x=fan.index, y=fan[hi] * scale, mode='lines', line=dict(width=0),
+            showlegend=False, hoverinfo='skip'
+        ))
+        fig.add_trace(go.Scatter(
+            x=fan.index, y=fan[lo] * scale, mode='lines', line=dict(width=0),
+            fill='tonexty', fillcolor=fill.format(alpha),
+            name=f"{lo:.0%}-{hi:.0%}", hoverinfo='skip'
+        ))
+    if len(quantiles) % 2:
+        median = quantiles[len(quantiles) // 2]
+        fig.add_trace(go.Scatter(
+            x=fan.index, y=fan[median] * scale, mode='lines', name='Mediana',
+            line=dict(color=color, width=2),
+            hovertemplate='h=%{x}: %{y:.2f}<extra></extra>'
+        ))
+    fig.add_trace(go.Scatter(
+        x=fan.index, y=fan['mean'] * scale, mode='lines', name='Media',
+        line=dict(color='#6c757d', width=1, dash='dash'),
+        hovertemplate='h=%{x}: %{y:.2f}<extra></extra>'
+    ))
+    
+    fig.update_layout(
+        title=dict(text=title, font=dict(size=16)),
+        xaxis_title="Orizzonte (sedute)",
+        yaxis_title=yaxis_title,
+        height=350,
+        template='plotly_white',
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='center', x=0.5),
+        margin=dict(l=50, r=30, t=80, b=50)
+    )
+    
+    return fig
+
+
+def create_rolling_loss_chart(rolling_qlike):
+    """QLIKE mobile per modello (più bassa = forecast migliore)."""
+    fig = go.Figure()
+    rolling_qlike = rolling_qlike.dropna(how='all')
+    
+    for name in rolling_qlike.columns:
+        published = name == PUBLISHED
+        fig.add_trace(go.Scatter(
+            x=pd.to_datetime(rolling_qlike.index),
+            y=rolling_qlike[name],
+            mode='lines',
+            name=name,
+            line=dict(width=3 if published else 1, color='#212529' if published else None),
+            hovertemplate=f'{name}: %{{y:.4f}}<extra></extra>'
+        ))
+    
+    fig.update_layout(
+        title=dict(text=f"📏 QLIKE Mobile ({FORECAST_EVAL_CONFIG['rolling_window']} sedute)", font=dict(size=16)),
+        yaxis_title="QLIKE",
+        height=350,
+        template='plotly_white',
+        hovermode='x unified',
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='center', x=0.5),
+        margin=dict(l=50, r=30, t=80, b=50)
+    )
+    
+    return fig
+
+
 def calculate_regime_stats(df):
     """Calcola statistiche per ogni regime."""
     stats = []
+    labels, _ = regime_palette(df)
     
-    for state in range(3):
+    for state in labels:
         mask = df['HMM_State'] == state
         regime_data = df[mask]
         
@@ -652,7 +867,7 @@ def calculate_regime_stats(df):
             vol_label = "Vol Media"
             
         stats.append({
-            'Regime': REGIME_LABELS[state],
+            'Regime': labels[state],
             'Giorni': len(regime_data),
             'Frequenza': f"{len(regime_data)/len(df)*100:.1f}%",
             vol_label: vol_mean,
@@ -664,11 +879,39 @@ def calculate_regime_stats(df):
     return pd.DataFrame(stats)
 
 
+# ============================================================================
+# CACHE DATI E MODELLI
+# ============================================================================
+
+@st.cache_resource
+def get_snapshot_refresher():
+    """Refresher condiviso da tutte le sessioni del processo Streamlit."""
+    return SnapshotRefresher(compute_snapshot).start()
+
+
+def load_forecast_evaluation(df, garch_res):
+    """
+    Valutazione dei forecast: registro del job (solo fuori campione: forecast
+    live e semina dalla QLIKE rolling) se ha abbastanza esiti, altrimenti
+    varianze 1-step in campione dello snapshot.
+    """
+    try:
+        evaluation = evaluate_log()
+    except Exception:
+        evaluation = None
+    if evaluation is not None:
+        return evaluation, "Registro forecast del job (fuori campione)"
+    return evaluate_in_sample(df, garch_res), "IN CAMPIONE: varianze 1-step dei fit correnti (registro non disponibile)"
+
+
 # ============================================================================
 # FUNZIONE PRINCIPALE
 # ============================================================================
 
 def main():
+    # Metriche di rendering di questa esecuzione (solo tempi, niente tracemalloc)
+    render_metrics = start_run('dashboard_render', trace_memory=False)
+    
     # --- HEADER ---
     st.markdown("""
     <div class="main-header">
@@ -679,14 +922,22 @@ def main():
     
     # --- SIDEBAR ---
     with st.sidebar:
+        if HMM_SELECTION_CONFIG['enabled']:
+            grid = HMM_SELECTION_CONFIG['n_states']
+            hmm_states_label = f"{min(grid)}-{max(grid)} Stati (selezione {HMM_SELECTION_CONFIG['criterion'].upper()})"
+        else:
+            hmm_states_label = f"{HMM_PARAMS['n_states']} Stati"
+        garch_label = (f"zoo di {len(VOL_MODELS_CONFIG['models'])} modelli (QLIKE)"
+                       if VOL_MODELS_CONFIG['enabled'] else "(1,1)")
+        
         # Placeholder immagine, puoi rimuoverlo o metterne uno vero
         # st.image("https://raw.githubusercontent.com/your-repo/logo.png", width=150)
         st.markdown("### ⚙️ Configurazione")
         
         st.markdown(f"""
         **Ticker:** {TICKER} ({'Modo VIX' if IS_VIX else 'Modo Equity'})  
-        **Modello HMM:** {HMM_PARAMS['n_states']} Stati  
-        **GARCH:** (1,1)  
+        **Modello HMM:** {hmm_states_label}  
+        **GARCH:** {garch_label}  
         """)
         
         st.markdown("---")
@@ -710,64 +961,30 @@ def main():
         st.markdown("[📊 Kriterion Quant](https://kriterionquant.com)")
         
     
-    # --- CARICAMENTO DATI ---
+    # --- CARICAMENTO DATI E MODELLI ---
+    # Lo snapshot è mantenuto caldo da un refresher in background (stale-while-revalidate):
+    # solo il primissimo caricamento del processo attende il calcolo.
+    refresher = get_snapshot_refresher()
     with st.spinner('🔄 Caricamento dati e training modelli...'):
         try:
-            df_raw = download_data()
-            df = calculate_features(df_raw)
+            snapshot = refresher.get()
         except Exception as e:
             st.error(f"❌ Errore nel caricamento dati: {e}")
             st.stop()
     
-    # --- TRAINING MODELLI ---
-    model_hmm, scaler_hmm, state_mapping = train_hmm(df)
-    states, posteriors = get_hmm_states(df, model_hmm, scaler_hmm, state_mapping)
-    
-    df['HMM_State'] = states
-    df['P_Low'] = posteriors[:, 0]
-    df['P_Medium'] = posteriors[:, 1]
-    df['P_High'] = posteriors[:, 2]
-    
-    # GARCH: Calcoliamo sempre, ma interpretiamo diversamente
-    garch_vol_ann, garch_res = train_garch(df)
+    df = snapshot['df']
+    labels, colors = regime_palette(df)
+    garch_vol_ann = snapshot['garch_vol']
+    garch_res = snapshot['garch_res']
     
     # --- CALCOLO SEGNALE ---
+    # Stessa regola del job giornaliero e del daemon (signals.generate_signal)
     last_row = df.iloc[-1]
-    p_high = last_row['P_High']
-    p_low = last_row['P_Low']
-    p_medium = last_row['P_Medium']
-    
-    # Trend P(High) ultimi 5 giorni
-    trend_p_high = df['P_High'].diff(THRESHOLDS['trend_window']).iloc[-1]
-    
-    # Confidenza (probabilità massima)
-    confidence = max(p_high, p_medium, p_low)
-    
-    # Logica generazione segnale
-    signal_type = "NEUTRAL"
-    
-    if p_high > THRESHOLDS['high_vol']:
-        signal_type = "RISK_OFF"
-        
-        # Logica STRONG_RISK_OFF differenziata
-        if IS_VIX:
-            # Se siamo sul VIX, STRONG se siamo nel top 15% dei livelli storici
-            # (Il GARCH qui sarebbe la VVIX, utile ma diversa)
-            if last_row['Close'] > df['Close'].quantile(0.85):
-                signal_type = "STRONG_RISK_OFF"
-        else:
-            # Logica classica Equity: GARCH forecast alto
-            if garch_vol_ann > df['GK_Vol'].quantile(THRESHOLDS['garch_percentile']):
-                signal_type = "STRONG_RISK_OFF"
-            
-    elif trend_p_high > THRESHOLDS['alert_change']:
-        signal_type = "ALERT"
-    elif p_low > THRESHOLDS['low_vol']:
-        signal_type = "RISK_ON"
-    
-    # Check confidenza bassa -> WATCH (allineato con run_daily_check.py)
-    if confidence < THRESHOLDS.get('confidence_min', 0.70) and signal_type == "NEUTRAL":
-        signal_type = "WATCH"
+    sig = generate_signal(snapshot['posteriors'], garch_vol_ann, df['GK_Vol'], forecaster=snapshot['forecaster'])
+    signal_type = sig['signal']
+    p_low, p_medium, p_high = sig['p_low'], sig['p_medium'], sig['p_high']
+    trend_p_high = sig['trend_p_high']
+    confidence = sig['confidence']
     
     sig_conf = SIGNAL_CONFIG.get(signal_type, SIGNAL_CONFIG['NEUTRAL'])
     
@@ -813,9 +1030,20 @@ def main():
                 help="Volatilità Garman-Klass annualizzata"
             )
     
-    # Card 3: GARCH / VVIX
+    # Card 3: GARCH / VVIX (reale se la serie collegata è disponibile)
+    has_vvix = 'VVIX' in df.columns and pd.notna(last_row.get('VVIX'))
     with col3:
-        if IS_VIX:
+        if IS_VIX and has_vvix:
+            # VVIX reale (Cboe): volatilità implicita del VIX a 30 giorni
+            vvix_delta = last_row['VVIX'] - df['VVIX'].iloc[-2] if len(df) > 1 else 0.0
+            st.metric(
+                label="🌪️ VVIX",
+                value=f"{last_row['VVIX']:.1f}",
+                delta=f"{vvix_delta:+.1f}",
+                delta_color="inverse",
+                help=f"Volatilità implicita del VIX (Cboe). Stima GARCH: {garch_vol_ann*100:.1f}%"
+            )
+        elif IS_VIX:
             # Il GARCH sul VIX è la "Volatilità del VIX" (proxy VVIX)
             st.metric(
                 label="🔮 GARCH (VVIX Proxy)",
@@ -829,13 +1057,13 @@ def main():
                 label="🔮 GARCH Forecast",
                 value=f"{garch_vol_ann*100:.2f}%",
                 delta=f"{garch_delta:+.2f}%",
-                help="Previsione volatilità 1-step ahead GARCH(1,1)"
+                help=f"Previsione volatilità 1-step ahead ({garch_res.name if garch_res is not None else 'GARCH'})"
             )
     
     with col4:
         st.metric(
             label="🤖 Regime HMM",
-            value=REGIME_LABELS[last_row['HMM_State']],
+            value=labels[last_row['HMM_State']],
             delta=None
         )
     
@@ -852,29 +1080,16 @@ def main():
     col_prob1, col_prob2 = st.columns([2, 1])
     
     with col_prob1:
-        st.markdown(f"""
-        <div class="prob-container">
-            <div class="prob-bar">
-                <span class="label">🟢 Low Vol</span>
-                <div class="bar-bg">
-                    <div class="bar-fill" style="width: {p_low*100}%; background: #28a745;"></div>
-                </div>
-                <span class="percentage">{p_low*100:.1f}%</span>
-            </div>
+        prob_bars = "".join(f"""
             <div class="prob-bar">
-                <span class="label">🟡 Medium Vol</span>
+                <span class="label">{labels[state]}</span>
                 <div class="bar-bg">
-                    <div class="bar-fill" style="width: {p_medium*100}%; background: #ffc107;"></div>
+                    <div class="bar-fill" style="width: {last_row[f'P_State_{state}']*100}%; background: {colors[state]};"></div>
                 </div>
-                <span class="percentage">{p_medium*100:.1f}%</span>
-            </div>
-            <div class="prob-bar">
-                <span class="label">🔴 High Vol</span>
-                <div class="bar-bg">
-                    <div class="bar-fill" style="width: {p_high*100}%; background: #dc3545;"></div>
-                </div>
-                <span class="percentage">{p_high*100:.1f}%</span>
-            </div>
+                <span class="percentage">{last_row[f'P_State_{state}']*100:.1f}%</span>
+            </div>""" for state in labels)
+        st.markdown(f"""
+        <div class="prob-container">{prob_bars}
         </div>
         """, unsafe_allow_html=True)
     
@@ -946,7 +1161,7 @@ def main():
         st.markdown("""
         <div class="info-box">
             <strong>📖 Interpretazione:</strong><br>
-            Questo grafico mostra l'evoluzione delle probabilità dei tre regimi nel tempo.
+            Questo grafico mostra l'evoluzione delle probabilità dei regimi nel tempo.
             Le aree colorate rappresentano la probabilità stimata dall'HMM di trovarsi in ciascun regime.
             La linea tratteggiata indica la soglia del 60% per il segnale RISK-OFF.
         </div>
@@ -979,6 +1194,58 @@ def main():
             </div>
             """, unsafe_allow_html=True)
         
+        # Previsioni a n passi dalla matrice di transizione (decomposta una volta per fit)
+        outlook = snapshot['regime_forecast']
+        horizon = REGIME_FORECAST_CONFIG['signal_horizon']
+        st.markdown("#### 🔭 Previsione dei Regimi")
+        
+        col_out1, col_out2, col_out3 = st.columns(3)
+        with col_out1:
+            st.metric(f"Ingresso in High entro {horizon} sedute", f"{outlook['first_passage'][horizon]*100:.1f}%",
+                      help="Probabilità di almeno una seduta in High Vol nelle prossime sedute (first passage)")
+        with col_out2:
+            st.metric("Durata residua attesa", f"{outlook['expected_duration']:.1f} sedute",
+                      help="Sedute attese di permanenza nel regime corrente (durata geometrica dalla matrice di transizione)")
+        with col_out3:
+            st.metric("Tempo atteso all'ingresso in High", f"{outlook['expected_hitting_time']:.0f} sedute",
+                      help="Sedute attese fino alla prima seduta in High Vol")
+        
+        col_prob1, col_prob2 = st.columns([2, 1])
+        with col_prob1:
+            st.plotly_chart(create_regime_outlook_chart(df, n_days=chart_period), use_container_width=True)
+        with col_prob2:
+            st.markdown("**P(regime) per orizzonte**")
+            probs_df = outlook['probabilities'].copy()
+            probs_df['Ingresso High'] = outlook['first_passage']
+            probs_df.index = [f"{h} sedute" for h in probs_df.index]
+            st.dataframe(probs_df.map('{:.1%}'.format), use_container_width=True)
+            st.caption("Durata media dei regimi: " + " · ".join(
+                f"{label} {d:.0f} gg" for label, d in outlook['durations'].items()))
+        
+        # Incertezza di stima: bande bootstrap calcolate dal job giornaliero
+        st.markdown("#### 🎯 Incertezza di Stima (Bootstrap)")
+        boot = load_bootstrap(df)
+        if boot is None:
+            st.caption("Bande non disponibili per i dati correnti: sono calcolate dal job giornaliero "
+                       "(run_daily_check.py --bootstrap o BOOTSTRAP_CONFIG['enabled']) e salvate per "
+                       "impronta dei dati.")
+        else:
+            bands = boot['bands']
+            lo, hi = bands.columns[1], bands.columns[-2]
+            col_boot1, col_boot2, col_boot3 = st.columns(3)
+            for col, key, label, fmt in [
+                (col_boot1, 'p_high', "P(High Vol) oggi", '{:.1%}'),
+                (col_boot2, 'persistence', f"Persistenza {boot['persistence_model']}", '{:.3f}'),
+                (col_boot3, 'garch_vol', "Forecast Vol pubblicato", '{:.2%}'),
+            ]:
+                row = bands.loc[key]
+                with col:
+                    st.metric(label, fmt.format(row['point']), help="Stima puntuale del job giornaliero")
+                    st.caption(f"Banda {lo:.0%}-{hi:.0%}: {fmt.format(row[lo])} – {fmt.format(row[hi])}")
+            st.caption(f"{boot['n_ok']}/{boot['n_boot']} replicati validi: HMM con block bootstrap a blocchi "
+                       f"di {BOOTSTRAP_CONFIG['block_size']} sedute, forecast {boot['garch_model']} con "
+                       f"bootstrap sui residui di ogni componente e pesi pubblicati.")
+        
         # Distribuzione volatilità per regime
         st.markdown("#### 📊 Distribuzione Valori per Regime")
         fig_dist = create_regime_distribution_chart(df)
@@ -1008,6 +1275,8 @@ def main():
             st.metric(
                 "GARCH Forecast (1-step)" if not IS_VIX else "VVIX Est (GARCH)",
                 f"{garch_vol_ann*100:.2f}%",
+                delta=f"{garch_vol_ann*100 - last_row['VVIX']:+.1f} vs VVIX" if has_vvix else None,
+                delta_color="off",
                 help="Previsione volatilità per domani"
             )
         
@@ -1027,6 +1296,65 @@ def main():
                 help="Posizione del valore corrente rispetto allo storico"
             )
         
+        # Curva del VIX dalle serie collegate (scaricate con la serie principale)
+        if IS_VIX and 'VIX3M' in df.columns:
+            st.plotly_chart(create_vix_curve_chart(df, n_days=chart_period), use_container_width=True)
+            ts_cols = st.columns(2)
+            ts_metrics = [
+                ('TS_Ratio', "VIX / VIX3M", "{:.3f}", "Sopra 1: backwardation (stress), sotto 1: contango"),
+                ('TS_Slope', "Pendenza 9D→6M", "{:+.3f}", "log(VIX6M / VIX9D): negativa con curva invertita")
+            ]
+            for col, (key, label, fmt, help_text) in zip(ts_cols, ts_metrics):
+                with col:
+                    value = last_row.get(key)
+                    st.metric(label, fmt.format(value) if pd.notna(value) else "n/d", help=help_text)
+        
+        # Struttura a termine del forecast (curva calcolata al fit, nessun costo aggiuntivo)
+        if garch_res is not None:
+            st.markdown("#### 📐 Struttura a Termine del Forecast")
+            curve, tenors = garch_res.term_structure()
+            st.plotly_chart(create_term_structure_chart(curve, tenors), use_container_width=True)
+            tenor_cols = st.columns(len(tenors))
+            for col, (label, vol) in zip(tenor_cols, tenors.items()):
+                with col:
+                    st.metric(f"Vol media {label}", f"{vol*100:.2f}%",
+                              help=f"Volatilità annualizzata media integrata sulle prossime "
+                                   f"{TERM_STRUCTURE_CONFIG['tenors'][label]} sedute")
+        
+        # Simulazione Monte Carlo (percorsi calcolati nella pipeline, in cache con i modelli)
+        simulation = snapshot.get('simulation') or {}
+        if simulation:
+            st.markdown("#### 🎲 Simulazione Monte Carlo")
+            engines = {sim['engine']: sim for sim in simulation.values()}
+            sim = engines[st.radio("Motore", list(engines), horizontal=True, key='sim_engine')]
+            st.caption(f"{sim['n_paths']:,} percorsi su {sim['horizon']} sedute ({sim['chunks']} blocchi, "
+                       f"seed {SIMULATION_CONFIG['seed']}). Volatilità di partenza {sim['ref_vol']*100:.2f}%.")
+            
+            col_fan1, col_fan2 = st.columns(2)
+            with col_fan1:
+                st.plotly_chart(create_fan_chart(sim['fan_vol'], "🌪️ Fan Chart Volatilità",
+                                                 "Volatilità Annualizzata (%)", scale=100),
+                                use_container_width=True)
+            with col_fan2:
+                st.plotly_chart(create_fan_chart(sim['fan_returns'], "📈 Rendimento Cumulato Simulato",
+                                                 "Rendimento cumulato (%)", color='#28a745'),
+                                use_container_width=True)
+            
+            col_risk1, col_risk2 = st.columns(2)
+            with col_risk1:
+                st.markdown("**VaR / Expected Shortfall** (perdita sul rendimento cumulato, %)")
+                risk_df = sim['risk'].rename(columns={
+                    'horizon': 'Sedute', 'confidence': 'Confidenza', 'var': 'VaR', 'es': 'ES'
+                })
+                st.dataframe(risk_df.round(3), use_container_width=True, hide_index=True)
+            with col_risk2:
+                st.markdown("**Probabilità che la volatilità tocchi il livello entro N sedute**")
+                hit_df = sim['hit_prob'].reset_index()
+                hit_df['vol_level'] = (hit_df['vol_level'] * 100).map('{:.1f}%'.format)
+                hit_df = hit_df.rename(columns={'vol_level': 'Livello', 'multiple': 'x Vol attuale'})
+                hit_df.columns = [f"{c} sedute" if isinstance(c, (int, np.integer)) else c for c in hit_df.columns]
+                st.dataframe(hit_df.round(3), use_container_width=True, hide_index=True)
+        
         # Statistiche volatilità
         st.markdown("#### 📊 Statistiche Dettagliate")
         
@@ -1040,6 +1368,32 @@ def main():
         })
         
         st.dataframe(vol_df, use_container_width=True, hide_index=True)
+        
+        # Classifica dello zoo GARCH (QLIKE fuori campione)
+        if garch_res is not None and len(garch_res.table) > 1:
+            st.markdown("#### 🏁 Classifica Modelli di Volatilità")
+            st.markdown(f"Forecast pubblicato: **{garch_res.name}** (QLIKE più bassa = migliore)")
+            zoo_df = pd.DataFrame(garch_res.table).rename(columns={
+                'model': 'Modello', 'qlike': 'QLIKE', 'weight': 'Peso', 'persistence': 'Persistenza',
+                'log_likelihood': 'Log-lik', 'converged': 'Convergenza'
+            })
+            st.dataframe(zoo_df.round(4), use_container_width=True, hide_index=True)
+            
+            # Valutazione dei forecast: registro del job se disponibile, altrimenti varianze in campione
+            evaluation, eval_source = load_forecast_evaluation(df, garch_res)
+            if evaluation is not None:
+                st.markdown("#### 📏 Valutazione dei Forecast")
+                st.caption(f"{eval_source}: {evaluation['n_obs']} sedute, varianza realizzata "
+                           f"{'(rendimenti²)' if IS_VIX else 'Garman-Klass'}. "
+                           f"Diebold-Mariano contro {evaluation['benchmark']} (p < 0.05: differenza significativa), "
+                           f"Mincer-Zarnowitz b ≈ 1 per un forecast non distorto.")
+                eval_df = evaluation['summary'].reset_index().rename(columns={
+                    'index': 'Modello', 'qlike': 'QLIKE', 'mse': 'MSE', 'mz_alpha': 'MZ a', 'mz_beta': 'MZ b',
+                    'mz_r2': 'MZ R²', 'mz_p': 'MZ p (a=0,b=1)', 'loss_diff': 'Δ QLIKE', 'dm_stat': 'DM',
+                    'dm_p': 'DM p', 'n_obs': 'Sedute'
+                })
+                st.dataframe(eval_df.round(4), use_container_width=True, hide_index=True)
+                st.plotly_chart(create_rolling_loss_chart(evaluation['rolling_qlike']), use_container_width=True)
     
     # =========================================================================
     # TAB 4: METODOLOGIA
@@ -1047,13 +1401,15 @@ def main():
     with tab4:
         st.markdown("## 📚 Metodologia")
         
-        st.markdown("""
+        hit_high_rule = (f", o ingresso in High entro {REGIME_FORECAST_CONFIG['signal_horizon']} sedute > "
+                         f"{THRESHOLDS['hit_high']*100:.0f}%" if REGIME_FORECAST_CONFIG['alert_on_hit_high'] else "")
+        st.markdown(f"""
         ### 🤖 Hidden Markov Model (HMM)
         
         L'HMM è un modello probabilistico che assume l'esistenza di **stati nascosti** (non osservabili direttamente)
         che governano il comportamento delle variabili osservate. Nel nostro caso:
         
-        - **Stati nascosti:** 3 regimi di volatilità (Low, Medium, High)
+        - **Stati nascosti:** {len(labels)} regimi di volatilità ({', '.join(labels.values())}), numero scelto dai dati
         - **Variabile osservata:** Volatilità Garman-Klass (o Log-VIX)
         - **Output:** Probabilità di trovarsi in ciascun regime
         
@@ -1086,9 +1442,9 @@ def main():
         |---------|------------|--------|
         | 🟢 RISK_ON | P(Low Vol) > 60% | Esposizione piena |
         | 🟡 NEUTRAL | Nessuna condizione estrema | Allocazione standard |
-        | 🟠 ALERT | P(High Vol) in aumento >15% in 5gg | Preparare coperture |
+        | 🟠 ALERT | P(High Vol) in aumento >15% in 5gg{hit_high_rule} | Preparare coperture |
         | 🔴 RISK_OFF | P(High Vol) > 60% | Ridurre esposizione |
-        | 🔴🔴 STRONG_RISK_OFF | P(High Vol) > 60% AND (GARCH alto o VIX > 85° pct) | Copertura aggressiva |
+        | 🔴🔴 STRONG_RISK_OFF | P(High Vol) > 60% AND forecast GARCH > {THRESHOLDS['garch_percentile']*100:.0f}° pct della vol realizzata | Copertura aggressiva |
         
         ---
         
@@ -1109,7 +1465,7 @@ def main():
         
         ### ⚠️ Limitazioni
         
-        1. **HMM identifica regimi in modo contemporaneo**, non predittivo
+        1. **HMM identifica regimi in modo contemporaneo**: le previsioni a n sedute derivano solo dalla matrice di transizione (catena di Markov omogenea)
         2. **GARCH assume stazionarietà** che può non valere durante crisi
         3. **I segnali non sono raccomandazioni di investimento**
         4. **Le performance passate non garantiscono risultati futuri**
@@ -1143,7 +1499,7 @@ def main():
                     price=last_row['Close'],
                     hmm_probs=[p_low, p_medium, p_high],
                     garch_vol=garch_vol_ann,
-                    regime_label=REGIME_LABELS[last_row['HMM_State']],
+                    regime_label=labels[last_row['HMM_State']],
                     signal_type=signal_type,
                     trend_prob=trend_p_high
                 )
@@ -1165,14 +1521,50 @@ def main():
             | Dati caricati | {len(df):,} righe |
             | Ultima data | {df.index[-1].strftime('%Y-%m-%d')} |
             | Prima data | {df.index[0].strftime('%Y-%m-%d')} |
-            | HMM Stati | {HMM_PARAMS['n_states']} |
-            | GARCH | (1,1) |
+            | HMM Stati | {len(labels)} |
+            | GARCH | {garch_res.name if garch_res is not None else 'n/d'} |
             """)
         
+        # Performance pipeline
+        st.markdown("#### ⏱️ Performance Pipeline")
+        
+        snapshot_metrics = snapshot.get('metrics')
+        col_perf1, col_perf2 = st.columns(2)
+        
+        with col_perf1:
+            st.markdown(f"**Snapshot corrente** (età {refresher.age(snapshot):.0f}s)")
+            if snapshot_metrics:
+                st.dataframe(
+                    pd.DataFrame(snapshot_metrics['stages']),
+                    use_container_width=True,
+                    hide_index=True
+                )
+        
+        with col_perf2:
+            st.markdown("**Rendering grafici** (questa sessione)")
+            st.dataframe(
+                pd.DataFrame(render_metrics.stages),
+                use_container_width=True,
+                hide_index=True
+            )
+        
+        recent_runs = load_recent_runs()
+        if recent_runs:
+            st.markdown("**Ultimi run registrati** (job giornaliero e dashboard)")
+            runs_df = pd.DataFrame([{
+                'Inizio (UTC)': run['started_at'],
+                'Sorgente': run['source'],
+                'Stato': run['status'],
+                'Totale (s)': run['total_s'],
+                'RSS max (MB)': run.get('max_rss_mb'),
+                **{f"{s['stage']} (s)": s['wall_s'] for s in run['stages'] if s.get('depth', 0) == 0}
+            } for run in recent_runs])
+            st.dataframe(runs_df, use_container_width=True, hide_index=True)
+        
         # Dati raw
         st.markdown("#### 📋 Ultimi Dati")
         
-        display_cols = ['Close', 'Returns', 'GK_Vol', 'HMM_State', 'P_Low', 'P_Medium', 'P_High']
+        display_cols = ['Close', 'Returns', 'GK_Vol', 'HMM_State'] + [f'P_State_{state}' for state in labels]
         st.dataframe(
             df[display_cols].tail(50).sort_index(ascending=False).round(4),
             use_container_width=True
@@ -0,0 +1,279 @@
+# benchmark.py - Benchmark offline degli hot path su dati sintetici a regimi
+# Kriterion Volatility Monitor
+#
+# Uso:
+#   python benchmark.py                                  # griglia di default
+#   python benchmark.py --lengths 1000 10000 --tickers 1 8 --repeat 5
+#   python benchmark.py --compare benchmarks/results/<run>.json
+#   python benchmark.py --data fixtures/VIX.csv --lengths 1000 3000  # fixture locale
+#
+# Ogni run salva un JSON in benchmarks/results/ (commit git nel nome) così i
+# risultati restano confrontabili nel tempo; --compare segnala regressioni di
+# tempo o di accuratezza rispetto a un run precedente (exit code 1).
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import io
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from synthetic_data import generate_regime_ohlcv, SYNTHETIC_PARAMS
+from data_providers import FileProvider
+from data_loader import calculate_features
+from models import train_hmm, get_hmm_states, train_garch, clear_selection_cache, ordered_transmat
+from vol_models import persistence
+from fast_vol import EWMAForecaster, HARForecaster, realized_variance
+from regime_forecast import regime_forecaster
+from simulation import garch_engine, regime_engine, simulate_paths
+from signals import generate_signal
+from utils import get_git_commit
+from config import SIGNAL_CONFIG
+
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+DEFAULT_LENGTHS = [1000, 5000, 20000, 100000]
+DEFAULT_TICKERS = [1, 4, 16]
+TICKER_BARS = 2500                  # Lunghezza storico per il benchmark multi-ticker
+TIME_TOLERANCE = 0.25               # Rallentamento relativo tollerato in --compare
+TIME_FLOOR_S = 0.01                 # Sotto questa soglia le differenze sono rumore
+ACCURACY_TOLERANCE = 0.05           # Calo massimo di accuratezza tollerato
+
+
+def _timed(fn, repeat):
+    """Esegue fn `repeat` volte; ritorna (mediana secondi, ultimo risultato)."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        # I modelli stampano messaggi diagnostici: li silenziamo per non falsare i tempi
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)), result
+
+
+def state_accuracy(states, truth):
+    """
+    Quota di sedute classificate nel regime vero, dopo aver associato ogni
+    stato stimato al regime vero più frequente tra le sue sedute: vale per
+    qualsiasi K e non dipende dall'ordinamento per volatilità degli stati.
+    """
+    states, truth = np.asarray(states), np.asarray(truth)
+    mapped = np.empty_like(truth)
+    for s in np.unique(states):
+        mask = states == s
+        mapped[mask] = np.bincount(truth[mask]).argmax()
+    return float(np.mean(mapped == truth))
+
+
+def bench_length(n_bars, repeat, seed=0, source=None):
+    """
+    Tempi e accuratezza di tutti gli hot path su una serie di n_bars.
+    Con source (DataFrame OHLCV, es. da una fixture) usa le sue ultime n_bars
+    barre: gli stati veri non sono noti, quindi si misurano solo i tempi e la
+    convergenza dei modelli.
+    """
+    if source is None:
+        df_raw, true_states = generate_regime_ohlcv(n_bars, seed=seed)
+        true_states = pd.Series(true_states, index=df_raw.index)
+    else:
+        df_raw, true_states = source.iloc[-n_bars:], None
+
+    timings = {}
+    timings['calculate_features'], df = _timed(lambda: calculate_features(df_raw, ticker='SYNTH'), repeat)
+    # La selezione HMM è in cache per impronta dei dati: ogni ripetizione riparte da zero
+    timings['train_hmm'], (model, scaler, mapping) = _timed(
+        lambda: (clear_selection_cache(), train_hmm(df))[1], repeat
+    )
+    timings['get_hmm_states'], (states, posteriors) = _timed(
+        lambda: get_hmm_states(df, model, scaler, mapping), repeat
+    )
+    timings['train_garch'], (garch_vol, garch_res) = _timed(lambda: train_garch(df), repeat)
+    returns_pct, rv = df['Returns'] * 100, realized_variance(df)
+    timings['fit_ewma'], ewma = _timed(lambda: EWMAForecaster(returns_pct, rv).fit(), repeat)
+    timings['fit_har'], har = _timed(lambda: HARForecaster(returns_pct, rv).fit(), repeat)
+    # Aggiornamento O(1) dello stato con una nuova seduta (nowcast / multi-ticker)
+    timings['update_fast_vol'], _ = _timed(
+        lambda: (ewma.update(returns_pct.iloc[-1]), har.update(returns_pct.iloc[-1], rv.iloc[-1])), repeat
+    )
+    # Monte Carlo con i parametri di SIMULATION_CONFIG (memoria limitata dalla dimensione dei blocchi)
+    timings['simulate_garch'], _ = _timed(lambda: simulate_paths(garch_engine(garch_res)), repeat)
+    timings['simulate_regime'], _ = _timed(
+        lambda: simulate_paths(regime_engine(df, states, posteriors, ordered_transmat(model, mapping))), repeat
+    )
+    def forecast_regimes():
+        # Decomposizione della matrice di transizione e previsioni su tutte le date storiche
+        forecaster = regime_forecaster(model, mapping)
+        forecaster.history(posteriors)
+        return forecaster
+
+    timings['regime_forecast'], forecaster = _timed(forecast_regimes, repeat)
+    timings['generate_signal'], signal = _timed(
+        lambda: generate_signal(posteriors, garch_vol, df['GK_Vol'], forecaster=forecaster), repeat
+    )
+
+    accuracy = {
+        'hmm_converged': bool(model.monitor_.converged),
+        'hmm_n_states': int(model.n_components),
+        'hmm_em_iterations': int(model.monitor_.iter),
+        'garch_model': garch_res.name,
+        'garch_persistence': persistence(garch_res.best),
+        'signal_valid': signal['signal'] in SIGNAL_CONFIG
+    }
+    if true_states is not None:
+        truth = true_states.reindex(df.index).values
+        last_true_vol = SYNTHETIC_PARAMS['vol_ann'][truth[-1]]
+        accuracy['garch_forecast_abs_err'] = float(abs(garch_vol - last_true_vol))
+        accuracy['hmm_state_accuracy'] = state_accuracy(states, truth)
+        # Le transizioni sono confrontabili solo se la selezione ritrova il K vero
+        if model.n_components == len(SYNTHETIC_PARAMS['transmat']):
+            accuracy['hmm_transmat_max_err'] = float(np.max(np.abs(
+                ordered_transmat(model, mapping) - SYNTHETIC_PARAMS['transmat']
+            )))
+
+    return {'n_bars': len(df_raw), 'timings': timings, 'accuracy': accuracy}
+
+
+def bench_tickers(n_tickers, n_bars=TICKER_BARS):
+    """Tempo della pipeline completa (features -> segnale) su n_tickers serie."""
+    universe = [generate_regime_ohlcv(n_bars, seed=100 + i)[0] for i in range(n_tickers)]
+
+    def run_all():
+        for df_raw in universe:
+            df = calculate_features(df_raw, ticker='SYNTH')
+            model, scaler, mapping = train_hmm(df)
+            _, posteriors = get_hmm_states(df, model, scaler, mapping)
+            garch_vol, _ = train_garch(df)
+            generate_signal(posteriors, garch_vol, df['GK_Vol'])
+
+    total, _ = _timed(run_all, repeat=1)
+    return {
+        'n_tickers': n_tickers,
+        'n_bars': n_bars,
+        'total_s': total,
+        'per_ticker_s': total / n_tickers
+    }
+
+
+def run_benchmarks(lengths, tickers, repeat, source=None, source_name=None):
+    results = {
+        'meta': {
+            'commit': get_git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'data': source_name or 'synthetic'
+        },
+        'lengths': [],
+        'tickers': []
+    }
+
+    for n_bars in lengths:
+        print(f"⏱️ Serie da {n_bars:,} barre...")
+        if source is not None and n_bars > len(source):
+            print(f"   ⚠️ La fixture ha solo {len(source):,} barre: lunghezza saltata.")
+            continue
+        entry = bench_length(n_bars, repeat, source=source)
+        results['lengths'].append(entry)
+        for stage_name, seconds in entry['timings'].items():
+            print(f"   {stage_name:<20} {seconds*1000:>10.1f} ms")
+        acc = entry['accuracy']
+        if 'hmm_state_accuracy' in acc:
+            # L'errore sulla matrice di transizione esiste solo con K pari a quello simulato
+            transmat = (f"err. transmat {acc['hmm_transmat_max_err']:.3f} | "
+                        if 'hmm_transmat_max_err' in acc else "")
+            print(f"   accuratezza stati HMM {acc['hmm_state_accuracy']*100:.1f}% | {transmat}"
+                  f"persistenza GARCH {acc['garch_persistence']:.3f}")
+        else:
+            print(f"   HMM {acc['hmm_n_states']} stati, convergenza {acc['hmm_converged']} ({acc['hmm_em_iterations']} iter) | "
+                  f"persistenza GARCH {acc['garch_persistence']:.3f}")
+
+    for n_tickers in tickers:
+        print(f"⏱️ Universo da {n_tickers} ticker ({TICKER_BARS:,} barre ciascuno)...")
+        entry = bench_tickers(n_tickers)
+        results['tickers'].append(entry)
+        print(f"   totale {entry['total_s']:.2f}s | per ticker {entry['per_ticker_s']:.2f}s")
+
+    return results
+
+
+def save_results(results, out_dir=RESULTS_DIR):
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(out_dir, f"{stamp}_{results['meta']['commit']}.json")
+    with open(path, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    return path
+
+
+def compare_results(current, baseline):
+    """Confronta due run. Ritorna la lista delle regressioni trovate."""
+    regressions = []
+    base_by_len = {e['n_bars']: e for e in baseline.get('lengths', [])}
+
+    print(f"\n📊 Confronto con {baseline['meta']['commit']} ({baseline['meta']['timestamp']})")
+    for entry in current['lengths']:
+        base = base_by_len.get(entry['n_bars'])
+        if base is None:
+            continue
+        for stage_name, seconds in entry['timings'].items():
+            old = base['timings'].get(stage_name)
+            if old is None:
+                continue
+            ratio = seconds / old if old > 0 else float('inf')
+            flag = ''
+            if ratio > 1 + TIME_TOLERANCE and seconds - old > TIME_FLOOR_S:
+                flag = ' ❌'
+                regressions.append(f"{stage_name}@{entry['n_bars']}: x{ratio:.2f}")
+            print(f"   {entry['n_bars']:>7} {stage_name:<20} {old*1000:>9.1f} -> {seconds*1000:>9.1f} ms (x{ratio:.2f}){flag}")
+
+        acc_new = entry['accuracy'].get('hmm_state_accuracy')
+        acc_old = base['accuracy'].get('hmm_state_accuracy')
+        if acc_new is not None and acc_old is not None and acc_old - acc_new > ACCURACY_TOLERANCE:
+            regressions.append(f"hmm_state_accuracy@{entry['n_bars']}: {acc_old:.3f} -> {acc_new:.3f}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Kriterion su dati sintetici a regimi")
+    parser.add_argument('--lengths', type=int, nargs='+', default=DEFAULT_LENGTHS,
+                        help="Lunghezze storico (barre) da testare")
+    parser.add_argument('--tickers', type=int, nargs='*', default=DEFAULT_TICKERS,
+                        help="Numero di ticker per il benchmark multi-ticker")
+    parser.add_argument('--repeat', type=int, default=3, help="Ripetizioni per misura (mediana)")
+    parser.add_argument('--out', default=RESULTS_DIR, help="Directory risultati")
+    parser.add_argument('--compare', help="JSON di un run precedente da usare come baseline")
+    parser.add_argument('--data', metavar='PATH',
+                        help="Fixture OHLCV (.csv/.parquet) al posto della serie sintetica (solo tempi)")
+    args = parser.parse_args(argv)
+
+    source = FileProvider(args.data).history('BENCH') if args.data else None
+    results = run_benchmarks(args.lengths, args.tickers, args.repeat, source=source, source_name=args.data)
+    path = save_results(results, args.out)
+    print(f"\n💾 Risultati salvati in {path}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare_results(results, baseline)
+        if regressions:
+            print("\n❌ Regressioni rilevate:")
+            for r in regressions:
+                print(f"   - {r}")
+            return 1
+        print("\n✅ Nessuna regressione rispetto alla baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
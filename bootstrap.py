@@ -0,0 +1,297 @@
+# bootstrap.py - Bande di confidenza bootstrap per HMM e GARCH
+# Kriterion Volatility Monitor
+#
+# La "confidenza" del segnale è la probabilità massima di un solo modello
+# stimato: non dice nulla sull'incertezza di stima. Qui i modelli sono
+# riaddestrati su storici ricampionati per misurare quanto variano:
+#   - P(High) di oggi: block bootstrap (blocchi contigui per preservare la
+#     dipendenza seriale), ogni HMM ricampionato filtra lo storico reale
+#   - forecast di volatilità a una seduta pubblicato (combinazione dello zoo):
+#     bootstrap sui residui, cioè per ogni componente arch rendimenti simulati
+#     dal modello stimato con innovazioni estratte dai residui standardizzati,
+#     refit e forecast sullo storico reale a parametri del replicato, poi
+#     combinazione con i pesi pubblicati (EWMA/HAR restano fissi: nessun
+#     parametro stimato per ottimizzazione)
+#   - persistenza α+β (+γ/2) del componente arch con peso maggiore, dagli
+#     stessi replicati
+# Il bootstrap sui residui conserva il clustering della volatilità: un block
+# bootstrap dei rendimenti lo spezza a ogni giunzione tra blocchi e sottostima
+# sistematicamente la persistenza.
+# Ogni replicato parte dai parametri del fit puntuale (warm start: pochi
+# passi EM e ottimizzazioni brevi), ha il proprio generatore (SeedSequence)
+# e i replicati sono distribuiti su un pool di processi: il risultato non
+# dipende dal numero di worker.
+#
+# Il calcolo costa n_boot refit di HMM e di ogni componente arch (decine di
+# secondi con un solo core): è disattivato di default e si attiva con
+# BOOTSTRAP_CONFIG['enabled'] o con run_daily_check.py --bootstrap.
+# Il risultato è salvato per impronta dei dati e della configurazione: il job
+# paga il calcolo, la dashboard lo legge (load_bootstrap).
+
+import os
+import copy
+import pickle
+import warnings
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from arch.utility.exceptions import StartingValueWarning, ConvergenceWarning
+
+from vol_models import baseline_spec, make_model, forecast_variance, persistence, fit_vol_models
+from fast_vol import FastForecaster
+from shared_cache import cache_key
+from features import FeaturePipeline
+from instrumentation import instrumented, annotate
+from stages import process_pool
+from config import (HMM_PARAMS, HMM_SELECTION_CONFIG, HMM_FEATURES_CONFIG, GARCH_PARAMS, VOL_MODELS_CONFIG,
+                    BOOTSTRAP_CONFIG)
+
+
+def block_indices(n, block_size, rng):
+    """
+    Indici di un moving block bootstrap: blocchi contigui di block_size
+    osservazioni con inizio uniforme, concatenati fino a n.
+    """
+    block_size = min(block_size, n)
+    n_blocks = -(-n // block_size)
+    starts = rng.integers(0, n - block_size + 1, size=n_blocks)
+    return (starts[:, None] + np.arange(block_size)).ravel()[:n]
+
+
+def bootstrap_key(df):
+    """Impronta di dati (solo le colonne usate) e configurazione dei modelli."""
+    columns = [c for c in FeaturePipeline().columns if c in df.columns and c != 'Returns']
+    # 'enabled' non cambia il risultato: la dashboard legge anche i run con --bootstrap
+    cfg = {k: v for k, v in BOOTSTRAP_CONFIG.items() if k != 'enabled'}
+    return cache_key('bootstrap', df[columns + ['Returns']], HMM_PARAMS, HMM_SELECTION_CONFIG,
+                     HMM_FEATURES_CONFIG, GARCH_PARAMS, VOL_MODELS_CONFIG, cfg)
+
+
+def _garch_components(garch_result):
+    """
+    Componenti del forecast pubblicato da ricampionare, in ordine di peso:
+    spec, parametri e residui standardizzati (centrati, varianza unitaria)
+    per i modelli arch, varianza prevista fissa per EWMA/HAR.
+    """
+    models = VOL_MODELS_CONFIG['models']
+    components = []
+    for c in garch_result.components:
+        res = c['result']
+        if isinstance(res, FastForecaster):
+            components.append({'name': c['name'], 'weight': c['weight'],
+                               'next_sigma2': float(forecast_variance(res, 1)[0])})
+            continue
+        z = res.std_resid
+        z = z[np.isfinite(z)]
+        components.append({'name': c['name'], 'weight': c['weight'], 'spec': models.get(c['name'], baseline_spec()),
+                           'params': res.params, 'z': (z - z.mean()) / z.std(), 'result': res})
+    return components
+
+
+# =============================================================================
+# REPLICATI (WORKER DI PROCESSO)
+# =============================================================================
+
+def _refit_hmm(model, X, idx, vol_index):
+    """EM dai parametri puntuali sul campione ricampionato; P(High) dell'ultima seduta reale."""
+    boot = copy.deepcopy(model)
+    boot.init_params = ''       # Warm start: nessuna reinizializzazione dei parametri
+    boot.n_iter = BOOTSTRAP_CONFIG['hmm_n_iter']
+    # Blocchi concatenati in un'unica sequenza: passare le lunghezze a hmmlearn
+    # (un forward-backward per blocco) costa un ordine di grandezza in più
+    boot.fit(X[idx])
+    high = int(np.argmax(boot.means_[:, vol_index]))
+    return float(boot.predict_proba(X)[-1, high])
+
+
+def _simulate_returns(model, c, rng):
+    """Rendimenti dal modello stimato con innovazioni ricampionate dai residui standardizzati."""
+    params = c['params'].values
+    vol_params = params[model.num_params:model.num_params + model.volatility.num_params]
+    data, _ = model.volatility.simulate(vol_params, model.y.shape[0], lambda size: rng.choice(c['z'], size=size),
+                                        burn=BOOTSTRAP_CONFIG['burn'])
+    return pd.Series(c['params'].get('mu', 0.0) + data, index=model.y.index)
+
+
+def _refit_garch(returns, components, rng):
+    """
+    Refit di ogni componente arch su rendimenti simulati, forecast sullo storico
+    reale e combinazione con i pesi pubblicati.
+
+    Returns:
+    --------
+    tuple
+        (persistenza del componente arch con peso maggiore, volatilità annualizzata 1-step)
+    """
+    variance, pers = 0.0, np.nan
+    for c in components:
+        if 'spec' not in c:
+            variance += c['weight'] * c['next_sigma2']
+            continue
+        model = make_model(returns, c['spec'])
+        simulated = _simulate_returns(model, c, rng)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', StartingValueWarning)
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            res = make_model(simulated, c['spec']).fit(starting_values=c['params'].values, disp='off',
+                                                       options={'maxiter': BOOTSTRAP_CONFIG['garch_maxiter']})
+        variance += c['weight'] * forecast_variance(model.fix(res.params), 1)[0]
+        if np.isnan(pers):
+            pers = persistence(res)
+    return pers, float(np.sqrt(variance) / 100 * np.sqrt(252))
+
+
+def _run_batch(data, seeds):
+    """Replicati di un batch con gli stessi dati (serializzati una sola volta per batch)."""
+    rows = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        row = {'p_high': np.nan, 'persistence': np.nan, 'garch_vol': np.nan}
+        try:
+            idx = block_indices(len(data['X']), BOOTSTRAP_CONFIG['block_size'], rng)
+            row['p_high'] = _refit_hmm(data['model'], data['X'], idx, data['vol_index'])
+        except Exception:       # Replicato degenerato (es. stato senza osservazioni): escluso
+            pass
+        try:
+            row['persistence'], row['garch_vol'] = _refit_garch(data['returns'], data['components'], rng)
+        except Exception:
+            pass
+        rows.append(row)
+    return rows
+
+
+# =============================================================================
+# BANDE
+# =============================================================================
+
+@instrumented('bootstrap')
+def run_bootstrap(df, model, scaler, mapping, garch_result=None, n_boot=None, workers=None, seed=None):
+    """
+    Bootstrap di HMM (a blocchi) e del forecast di volatilità pubblicato (sui residui) in un pool di processi.
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Features della pipeline (colonne delle features HMM, Returns)
+    model, scaler, mapping :
+        HMM puntuale (vedi models.train_hmm), punto di partenza dei replicati
+    garch_result : vol_models.VolatilityForecast, optional
+        Forecast pubblicato (stima puntuale e componenti da ricampionare);
+        se assente lo zoo è stimato sulla finestra GARCH
+    n_boot, workers, seed : int, optional
+        Default da BOOTSTRAP_CONFIG
+
+    Returns:
+    --------
+    dict
+        point (stime puntuali), bands (DataFrame quantili per grandezza),
+        samples (DataFrame dei replicati), garch_model (forecast pubblicato),
+        persistence_model (componente della persistenza), n_boot, n_ok
+    """
+    cfg = BOOTSTRAP_CONFIG
+    n_boot = n_boot or cfg['n_boot']
+    workers = workers or cfg['workers']
+    seed = cfg['seed'] if seed is None else seed
+
+    X = scaler.transform(FeaturePipeline(scaler.features).matrix(df))
+    returns = (df['Returns'] * 100).iloc[-GARCH_PARAMS['window_size']:]
+    garch_result = garch_result or fit_vol_models(returns)
+    components = _garch_components(garch_result)
+    main = next((c for c in components if 'spec' in c), None)   # Componente arch con peso maggiore
+    high = max(mapping, key=mapping.get)     # Stato originale del regime High
+
+    # Stime puntuali: quelle pubblicate dal job (forecast combinato dello zoo)
+    point = {
+        'p_high': float(model.predict_proba(X)[-1, high]),
+        'persistence': persistence(main['result']) if main else np.nan,
+        'garch_vol': garch_result.vol_ann(1)
+    }
+    data = {'model': model, 'X': X, 'vol_index': scaler.vol_index, 'returns': returns,
+            'components': [{k: v for k, v in c.items() if k != 'result'} for c in components]}
+
+    # Un batch per worker: i dati viaggiano una volta per batch, i seed restano per replicato
+    seeds = np.random.SeedSequence(seed).spawn(n_boot)
+    workers = max(1, min(workers, n_boot))
+    batches = [seeds[i::workers] for i in range(workers)]
+    if workers > 1 and multiprocessing.parent_process() is None:
+        results = list(process_pool(workers).map(_run_batch, [data] * workers, batches))
+    else:
+        results = [_run_batch(data, batch) for batch in batches]
+
+    # Riordino nell'ordine dei seed (batch interlacciati)
+    rows = [None] * n_boot
+    for i, batch_rows in enumerate(results):
+        rows[i::workers] = batch_rows
+    samples = pd.DataFrame(rows)
+
+    quantiles = cfg['quantiles']
+    bands = samples.quantile(quantiles).T
+    bands.columns = quantiles
+    bands.insert(0, 'point', pd.Series(point))
+    bands['n_ok'] = samples.notna().sum()
+    annotate(n_boot=n_boot, workers=workers, failed=int(samples.isna().any(axis=1).sum()))
+
+    return {
+        'point': point,
+        'bands': bands,
+        'samples': samples,
+        'garch_model': garch_result.name,
+        'persistence_model': main['name'] if main else None,
+        'n_boot': n_boot,
+        'n_ok': int(samples.notna().all(axis=1).sum())
+    }
+
+
+def cached_bootstrap(df, model, scaler, mapping, garch_result=None, path=None):
+    """
+    run_bootstrap con il risultato salvato per impronta (vedi bootstrap_key):
+    con gli stessi dati e la stessa configurazione non rifà i refit.
+
+    Returns:
+    --------
+    tuple
+        (risultato, cache_hit)
+    """
+    path = path or BOOTSTRAP_CONFIG['path']
+    key = bootstrap_key(df)
+    cached = load_bootstrap(df, path)
+    if cached is not None:
+        return cached, True
+
+    result = run_bootstrap(df, model, scaler, mapping, garch_result)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        pickle.dump({'key': key, 'result': result}, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return result, False
+
+
+def load_bootstrap(df, path=None):
+    """Risultato salvato dal job se corrisponde ai dati correnti, altrimenti None (nessun calcolo)."""
+    path = path or BOOTSTRAP_CONFIG['path']
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as fh:
+            saved = pickle.load(fh)
+    except Exception:
+        return None
+    return saved['result'] if saved.get('key') == bootstrap_key(df) else None
+
+
+def format_bands(result, labels=None):
+    """Righe di testo 'grandezza: puntuale [q_lo, q_hi]' per job e report."""
+    labels = labels or {'p_high': 'P(High)', 'persistence': 'Persistenza', 'garch_vol': 'Vol 1-step'}
+    bands = result['bands']
+    lo, hi = bands.columns[1], bands.columns[-2]
+    lines = []
+    for key, label in labels.items():
+        row = bands.loc[key]
+        if key == 'persistence':
+            lines.append(f"{label}: {row['point']:.3f} [{row[lo]:.3f}, {row[hi]:.3f}]")
+        else:
+            lines.append(f"{label}: {row['point']*100:.1f}% [{row[lo]*100:.1f}%, {row[hi]*100:.1f}%]")
+    return lines
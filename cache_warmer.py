@@ -0,0 +1,153 @@
+# cache_warmer.py - Refresh in background della cache Dashboard
+# Kriterion Volatility Monitor
+
+import threading
+import time
+from concurrent.futures import Future
+
+from shared_cache import get_shared_cache, NullCache
+from config import CACHE_CONFIG
+
+
+class SnapshotRefresher:
+    """
+    Mantiene in memoria l'ultimo snapshot della pipeline e lo ricalcola in
+    background poco prima della scadenza del TTL (stale-while-revalidate).
+
+    - Senza cache condivisa il refresh parte margin secondi prima di
+      computed_at + ttl, così lo snapshot servito non è mai scaduto.
+    - Con una cache condivisa la pipeline indicizza i dati scaricati per
+      finestra TTL (time // ttl): un refresh dentro la stessa finestra
+      rileggerebbe gli stessi dati. Il refresh parte quindi all'inizio della
+      finestra successiva a quella dei dati dello snapshot.
+
+    - Le sessioni ricevono sempre l'ultimo snapshot disponibile, anche se scaduto,
+      mentre il ricalcolo avviene in un thread separato.
+    - Le richieste concorrenti durante un ricalcolo condividono un unico calcolo in corso.
+    - Solo il primo caricamento assoluto (nessuno snapshot) attende il calcolo.
+    """
+
+    def __init__(self, compute_fn, ttl=None, retry_delay=None, margin=None, aligned=None):
+        self.compute_fn = compute_fn
+        self.ttl = ttl if ttl is not None else CACHE_CONFIG['ttl']
+        self.retry_delay = retry_delay if retry_delay is not None else CACHE_CONFIG['retry_delay']
+        self.margin = margin if margin is not None else CACHE_CONFIG['prewarm_margin']
+        # Allineamento alla finestra TTL solo se la chiave ttl_bucket ha effetto
+        self.aligned = aligned if aligned is not None else not isinstance(get_shared_cache(), NullCache)
+
+        self._lock = threading.Lock()
+        self._snapshot = None       # Ultimo snapshot valido (sostituito in modo atomico)
+        self._inflight = None       # Future del ricalcolo in corso
+        self._last_error = None
+        self._wakeup = threading.Event()
+        self._scheduler = None
+
+    # ------------------------------------------------------------------
+    # API pubblica
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Avvia il thread di pre-warming (idempotente)."""
+        with self._lock:
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(
+                    target=self._run_scheduler, name="kriterion-cache-warmer", daemon=True
+                )
+                self._scheduler.start()
+        return self
+
+    def get(self, timeout=None):
+        """
+        Ritorna lo snapshot corrente.
+
+        Se scaduto, avvia un ricalcolo in background e ritorna comunque il dato
+        vecchio. Se non esiste ancora alcuno snapshot, attende il calcolo in corso
+        (condiviso tra tutte le sessioni) e rilancia l'eventuale eccezione.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if time.time() >= self.expires_at(snapshot):
+                self.refresh()
+            return snapshot
+
+        return self.refresh().result(timeout=timeout)
+
+    def refresh(self):
+        """Avvia (o riusa) il ricalcolo in corso e ne ritorna il Future."""
+        with self._lock:
+            if self._inflight is not None:
+                return self._inflight
+            future = Future()
+            self._inflight = future
+
+        worker = threading.Thread(
+            target=self._compute, args=(future,), name="kriterion-cache-refresh", daemon=True
+        )
+        worker.start()
+        return future
+
+    def expires_at(self, snapshot):
+        """
+        Istante del refresh dello snapshot (computed_at = download dei dati):
+        fine della sua finestra TTL con cache condivisa, altrimenti margin
+        secondi prima di computed_at + ttl.
+        """
+        if self.aligned:
+            return (snapshot['computed_at'] // self.ttl + 1) * self.ttl
+        return snapshot['computed_at'] + self.ttl - self.margin
+
+    def age(self, snapshot=None):
+        """Età (secondi) dei dati dello snapshot indicato o di quello corrente."""
+        snapshot = snapshot if snapshot is not None else self._snapshot
+        if snapshot is None:
+            return float('inf')
+        return time.time() - snapshot['computed_at']
+
+    @property
+    def last_error(self):
+        return self._last_error
+
+    # ------------------------------------------------------------------
+    # Helper interni
+    # ------------------------------------------------------------------
+
+    def _compute(self, future):
+        try:
+            snapshot = self.compute_fn()
+        except Exception as e:
+            print(f"❌ Refresh cache fallito: {e}")
+            self._last_error = e
+            with self._lock:
+                self._inflight = None
+            future.set_exception(e)
+        else:
+            with self._lock:
+                self._snapshot = snapshot
+                self._last_error = None
+                self._inflight = None
+            future.set_result(snapshot)
+        finally:
+            # Risveglia lo scheduler per ripianificare il prossimo refresh
+            self._wakeup.set()
+
+    def _next_delay(self):
+        """Secondi di attesa prima del prossimo refresh pianificato."""
+        if self._snapshot is None or self._last_error is not None:
+            return self.retry_delay if self._last_error is not None else 0
+        return max(self.expires_at(self._snapshot) - time.time(), 0)
+
+    def _run_scheduler(self):
+        while True:
+            delay = self._next_delay()
+            if delay > 0:
+                # Un risveglio anticipato significa che lo snapshot è cambiato: ricalcola l'attesa
+                if self._wakeup.wait(timeout=delay):
+                    self._wakeup.clear()
+                    continue
+
+            future = self.refresh()
+            try:
+                future.result()
+            except Exception:
+                pass
+            self._wakeup.clear()
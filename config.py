@@ -1,5 +1,6 @@
 # config.py - Configurazione Kriterion Volatility Monitor v2.0
 
+import os
 import datetime
 
 # ============================================================================
@@ -9,18 +10,107 @@ import datetime
 TICKER = 'VIX'
 START_DATE = '2005-01-01'
 
+# Fonte dati OHLCV (vedi data_providers.py). Sovrascrivibile con le variabili
+# d'ambiente KRITERION_DATA_PROVIDER, KRITERION_DATA_PATH ed EODHD_BASE_URL.
+DATA_PROVIDER_CONFIG = {
+    'provider': 'auto',                         # 'auto', 'yahoo', 'eodhd', 'file', 'synthetic'
+    'eodhd_base_url': 'https://eodhd.com/api',
+    'timeout': 10,                              # Timeout (s) delle richieste HTTP
+    'file_path': 'fixtures/{ticker}.csv',       # Fixture del provider 'file' (.csv o .parquet)
+    'synthetic_bars': 4000,                     # Storico del provider 'synthetic'
+    'synthetic_seed': 0,
+    'synthetic_start': '2005-01-03'
+}
+
+# Serie Cboe collegate al VIX (vedi data_loader.fetch_companions): scaricate in
+# parallelo con la serie principale e allineate alle sue sedute in un solo join
+VIX_COMPANIONS_CONFIG = {
+    'enabled': True,                # Solo in modalità VIX
+    'tickers': {                    # Colonna -> simbolo del provider
+        'VIX9D': '^VIX9D',
+        'VIX3M': '^VIX3M',
+        'VIX6M': '^VIX6M',
+        'VVIX': '^VVIX'
+    },
+    'workers': 5,                   # Download concorrenti (serie principale inclusa)
+    'max_gap': 5                    # Sedute mancanti colmate con l'ultimo valore noto
+}
+
+# Calendario di borsa NYSE (vedi market_calendar.py)
+MARKET_CALENDAR_CONFIG = {
+    'timezone': 'America/New_York',
+    'open': '09:30',                # Orari della seduta regolare
+    'close': '16:00',
+    'early_close': '13:00',         # Chiusura anticipata (3 luglio, venerdì del Ringraziamento, 24 dicembre)
+    'close_buffer_minutes': 15,     # Attesa dopo la chiusura prima di considerare definitiva la barra
+    'first_year': 1990,             # Intervallo dell'indice precalcolato delle sedute
+    'last_year': 2040
+}
+
+# ============================================================================
+# CACHE DASHBOARD
+# ============================================================================
+
+CACHE_CONFIG = {
+    'ttl': 600,                 # Validità (secondi) dello snapshot della dashboard
+    'prewarm_margin': 60,       # Anticipo (secondi) del refresh sulla scadenza, senza cache condivisa
+    'retry_delay': 30           # Attesa (secondi) prima di ritentare un refresh fallito
+}
+
+# Cache condivisa tra processi/repliche (volume condiviso). Sovrascrivibile con
+# le variabili d'ambiente KRITERION_CACHE_BACKEND e KRITERION_CACHE_PATH.
+SHARED_CACHE_CONFIG = {
+    'backend': 'none',                      # 'none', 'sqlite' o 'file'
+    'path': 'cache/kriterion_cache.db',     # File SQLite o directory (backend 'file')
+    'max_bytes': 512 * 1024 * 1024,         # Dimensione massima prima dell'eviction LRU
+    'lock_timeout': 30,                     # Attesa massima (secondi) sui lock
+    'lease_timeout': 600                    # Durata massima (secondi) del calcolo di una chiave da parte di una replica
+}
+
 # ============================================================================
 # HMM CONFIGURATION
 # ============================================================================
 
 HMM_PARAMS = {
-    'n_states': 3,              # Numero di stati nascosti (Low, Medium, High)
-    'covariance_type': 'diag',  # Tipo di matrice covarianza
+    'n_states': 3,              # Numero di stati nascosti se la selezione è disattivata
+    'covariance_type': 'diag',  # Tipo di matrice covarianza se la selezione è disattivata
     'n_iter': 100,              # Iterazioni massime EM
     'random_state': 42,         # Seed per riproducibilità
     'vol_window': 20            # Finestra rolling per volatilità realizzata
 }
 
+# Selezione del modello HMM (vedi models.select_hmm): griglia su numero di
+# stati e tipo di covarianza, fit in parallelo, risultato in cache per dati.
+# Disattivata di default: le soglie di THRESHOLDS sono calibrate su 3 regimi e
+# con K > 3 P(High) è la probabilità del solo regime più volatile (i regimi
+# intermedi confluiscono in Medium, vedi signals.collapse_posteriors), quindi
+# attivarla rende il segnale più conservativo. Ricalibrare high_vol/low_vol
+# prima di attivarla in produzione.
+HMM_SELECTION_CONFIG = {
+    'enabled': False,
+    'n_states': [2, 3, 4, 5],
+    'covariance_types': ['diag', 'full'],
+    'criterion': 'bic',             # 'bic', 'aic' o 'holdout' (log-likelihood fuori campione)
+    'holdout_fraction': 0.2,        # Coda della serie esclusa dal fit per il punteggio fuori campione
+    'workers': 4                    # Processi paralleli (1 = sequenziale)
+}
+
+# Features dell'HMM (vedi features.py): matrice assemblata da una pipeline
+# condivisa da training, inferenza, bootstrap e nowcast
+HMM_FEATURES_CONFIG = {
+    'features': ['Log_Vol'],        # Tra Log_Vol, Returns, Trend, Log_Range, VIX_Ratio, TS_Slope, Log_VVIX
+    'trend_window': 20,             # Sedute della media dei rendimenti (Trend)
+    'range_span': 5                 # Span EMA del range intraday (Log_Range)
+}
+
+# Previsioni dei regimi dalla matrice di transizione (vedi regime_forecast.py)
+REGIME_FORECAST_CONFIG = {
+    'horizons': [1, 5, 10, 21],     # Orizzonti (sedute) del riepilogo
+    'signal_horizon': 5,            # Orizzonte del first passage in High Vol usato dal segnale
+    'alert_on_hit_high': False,     # ALERT se il first passage supera THRESHOLDS['hit_high'] (soglia da calibrare)
+    'max_condition': 1e8            # Oltre questo numero di condizione degli autovettori: potenze dirette
+}
+
 # ============================================================================
 # GARCH CONFIGURATION
 # ============================================================================
@@ -32,6 +122,203 @@ GARCH_PARAMS = {
     'window_size': 1000         # Finestra per il training rolling
 }
 
+# Zoo di modelli di volatilità (vedi vol_models.py): stimati in parallelo,
+# ordinati per QLIKE rolling fuori campione; si pubblica il migliore o una
+# combinazione. Lo zoo di default copre effetto leva (GJR, EGARCH) e code
+# spesse (t) con tre stime arch; altre varianti (es. 'GARCH-skewt': {'vol':
+# 'GARCH', 'o': 0, 'dist': 'skewt'}) costano ~0.1-0.2s ciascuna su 1000 sedute
+VOL_MODELS_CONFIG = {
+    'enabled': True,                # False: solo GARCH(p,q) con GARCH_PARAMS['dist']
+    'models': {
+        'GARCH-N': {'vol': 'GARCH', 'o': 0, 'dist': 'normal'},
+        'GJR-t': {'vol': 'GARCH', 'o': 1, 'dist': 't'},
+        'EGARCH-t': {'vol': 'EGARCH', 'o': 1, 'dist': 't'},
+        'EWMA': {'vol': 'EWMA'},
+        'HAR-RV': {'vol': 'HAR'}
+    },
+    'oos_window': 250,              # Sedute finali valutate fuori campione (QLIKE)
+    'refit_every': 63,              # Sedute tra due ri-stime nella finestra (0 = parametri congelati)
+    'combination': 'weighted',      # 'best' (solo il migliore) o 'weighted' (pesi dalla QLIKE)
+    'min_weight': 0.02,             # Componenti con peso inferiore escluse dalla combinazione
+    'workers': 4                    # Processi paralleli (limitati ai core; 1 = sequenziale)
+}
+
+# Forecaster a costo costante (vedi fast_vol.py): nessuna ottimizzazione numerica,
+# stato aggiornato in O(1) per nowcast intraday e universi multi-ticker
+FAST_VOL_CONFIG = {
+    'ewma_lambda': 0.94,            # Decadimento RiskMetrics (dati giornalieri)
+    'ewma_seed_window': 30,         # Sedute per la varianza iniziale dell'EWMA
+    'har_lags': [1, 5, 22],         # Componenti HAR: giornaliera, settimanale, mensile
+    'fallback': 'EWMA'              # Forecast pubblicato se nessun modello arch converge
+}
+
+# Struttura a termine del forecast (vedi VolatilityForecast.term_structure): curva
+# 1..max_horizon calcolata una volta al fit, volatilità media integrata per tenor
+TERM_STRUCTURE_CONFIG = {
+    'max_horizon': 63,
+    'tenors': {'1S': 5, '1M': 21, '2M': 42, '3M': 63}   # Sedute per tenor (scadenze futures/opzioni VIX)
+}
+
+# Valutazione fuori campione dei forecast (vedi forecast_eval.py): registro
+# incrementale dei forecast 1-step per modello, confrontati con la varianza realizzata
+FORECAST_EVAL_CONFIG = {
+    'path': 'state/forecast_eval.db',
+    'backfill': True,               # Primo run: semina il registro con le σ² 1-step fuori campione dello zoo
+    'rolling_window': 63,           # Sedute per le perdite mobili
+    'benchmark': 'GARCH-N',         # Riferimento per i test di Diebold-Mariano
+    'min_obs': 30                   # Osservazioni minime per le statistiche
+}
+
+# ============================================================================
+# SIMULAZIONE MONTE CARLO
+# ============================================================================
+
+# Percorsi di volatilità e rendimenti (vedi simulation.py) per VaR/ES, fan chart
+# e probabilità di superamento. La memoria dipende da chunk_size, non da n_paths.
+SIMULATION_CONFIG = {
+    'n_paths': 20000,
+    'horizon': 63,                      # Sedute simulate
+    'chunk_size': 5000,                 # Percorsi per blocco
+    'seed': 42,
+    'workers': 1,                       # Processi per i blocchi (1 = sequenziale)
+    'confidence': [0.95, 0.99],         # Livelli di VaR/ES
+    'risk_horizons': [1, 5, 21],        # Orizzonti (sedute) di VaR/ES
+    'quantiles': [0.05, 0.25, 0.5, 0.75, 0.95],     # Bande del fan chart
+    'hit_levels': [1.25, 1.5, 2.0],     # Livelli di vol (multipli della vol prevista a 1 passo)
+    'bins': 2000                        # Risoluzione degli istogrammi per passo
+}
+
+# ============================================================================
+# INCERTEZZA DI STIMA (BOOTSTRAP)
+# ============================================================================
+
+# Bootstrap di HMM e del forecast di volatilità (vedi bootstrap.py): bande per
+# P(High), persistenza e forecast. Calcolato dal job e salvato per impronta dei
+# dati. Costoso (n_boot refit di HMM e di ogni componente arch dello zoo):
+# disattivato di default, si attiva qui o con run_daily_check.py --bootstrap
+BOOTSTRAP_CONFIG = {
+    'enabled': False,
+    'n_boot': 100,                      # Replicati
+    'block_size': 20,                   # Sedute per blocco dell'HMM (dipendenza seriale)
+    'burn': 500,                        # Sedute scartate all'inizio delle simulazioni GARCH
+    'workers': 4,                       # Processi paralleli (1 = sequenziale)
+    'seed': 7,
+    'hmm_n_iter': 20,                   # Passi EM per replicato (warm start dal fit puntuale)
+    'garch_maxiter': 200,               # Iterazioni dell'ottimizzatore arch per replicato
+    'quantiles': [0.05, 0.5, 0.95],     # Estremi della banda e mediana
+    'path': 'state/bootstrap.pkl'       # Ultimo risultato con la sua impronta
+}
+
+# ============================================================================
+# ESECUZIONE JOB GIORNALIERO
+# ============================================================================
+
+PIPELINE_CONFIG = {
+    'executor': 'thread',       # 'thread' o 'process' per gli stage indipendenti
+    'max_workers': 2,           # HMM e GARCH in parallelo
+    'stage_timeouts': {         # Timeout (secondi) per stage: lo marcano fallito, non lo interrompono
+        'data': 180,
+        'hmm': 600,
+        'garch': 300
+    }
+}
+
+# Registro append-only dei segnali (idempotenza dei run e storico auditabile).
+# In CI state/ è ripristinato dal branch git 'state' (vedi workflow e README):
+# con require_existing il job si ferma con errore se il registro manca, invece
+# di ripartire da un registro vuoto e rinotificare tutti i destinatari
+SIGNAL_STORE_CONFIG = {
+    'path': 'state/signal_history.db',
+    'regime_history_path': 'state/regime_history.csv',  # Regime e probabilità HMM per seduta (ultimo run)
+    'require_existing': os.environ.get('KRITERION_REQUIRE_STATE') == '1'
+}
+
+# Replay storico (python run_daily_check.py --as-of / --replay-range)
+REPLAY_CONFIG = {
+    'snapshot_path': 'state/history_{ticker}.csv',  # Snapshot OHLCV aggiornato da ogni run live
+    'output_dir': 'artifacts/replay',               # Risultati di --replay-range
+    'workers': 4                                    # Processi per --replay-range
+}
+
+# Nowcast intraday (python nowcast.py) sulla barra parziale della seduta in corso
+NOWCAST_CONFIG = {
+    'state_path': 'state/nowcast_model.pkl',    # Stato dei modelli salvato dal job giornaliero
+    'output_path': 'state/nowcast.json',        # Ultimo nowcast pubblicato
+    'poll_interval': 60,                        # Secondi tra due aggiornamenti
+    'alert_signals': ['STRONG_RISK_OFF', 'RISK_OFF', 'ALERT']  # Segnali provvisori che generano un avviso
+}
+
+# Monitor residente (python daemon.py) in alternativa al cron giornaliero
+DAEMON_CONFIG = {
+    'poll_interval': 60,            # Secondi tra due nowcast sulla barra parziale
+    'refresh_interval': 900,        # Secondi tra due controlli di nuove sedute chiuse (refit)
+    'health_host': '127.0.0.1',
+    'health_port': 8765,
+    'stale_polls': 3                # /health risponde 503 dopo questi poll mancati a mercato aperto
+}
+
+# API HTTP in sola lettura (python api.py) sui risultati precalcolati del job
+API_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 8080,
+    'max_age': 60,              # Cache-Control: max-age (secondi) delle risposte
+    'min_gzip_bytes': 512       # Risposte più piccole non vengono compresse
+}
+
+# ============================================================================
+# NOTIFICHE TELEGRAM
+# ============================================================================
+
+# Destinatari: secret TELEGRAM_CHAT_IDS (separati da virgola) o TELEGRAM_CHAT_ID
+TELEGRAM_CONFIG = {
+    'global_rate': 25,              # Messaggi/s per bot (limite Telegram ~30/s)
+    'per_chat_rate': 1.0,           # Messaggi/s per chat (limite Telegram ~1/s)
+    'timeout': 15,                  # Timeout (s) della singola richiesta HTTP
+    'max_retries': 4,               # Tentativi extra su 429 / 5xx / errori di rete
+    'backoff_base': 1.0,            # Attesa (s) del primo retry, poi raddoppia
+    'max_backoff': 60,              # Attesa massima (s) tra due tentativi
+    'outbox_path': 'state/telegram_outbox.json',  # Messaggi da reinviare al run successivo
+    'outbox_max_age_hours': 72      # Oltre questa età un alert in outbox viene scartato
+}
+
+# Politica di notifica (solo eventi + digest settimanale). Modalità:
+#   'all'      report completo ogni giorno
+#   'changes'  solo cambi di segnale/regime o salti di P(High), più il digest settimanale
+#   'digest'   solo il digest settimanale
+#   'off'      nessun messaggio (gli alert di errore vengono comunque inviati)
+# La modalità di un destinatario si imposta in 'subscribers' (chat_id -> dict di
+# override) oppure nel secret con la forma TELEGRAM_CHAT_IDS="123:changes,456:all".
+ALERT_POLICY_CONFIG = {
+    'default': {
+        'mode': 'changes',
+        'p_high_jump': 0.15,        # Variazione assoluta di P(High) che genera un alert
+        'notify_regime': True,      # Alert anche sul solo cambio di regime HMM
+        'digest_weekday': 4         # Giorno del digest (0=lunedì, 4=venerdì)
+    },
+    'subscribers': {},
+    'state_path': 'state/alert_state.json'  # Ultimo digest inviato per destinatario
+}
+
+# ============================================================================
+# METRICHE DI PERFORMANCE
+# ============================================================================
+
+METRICS_CONFIG = {
+    'path': 'state/metrics.jsonl',  # Un record JSON per run (job e dashboard)
+    'trace_memory': False,          # Picco memoria per stage via tracemalloc in ogni run (sempre con --profile)
+    'trace_memory_sources': ['daily_job'],  # Run con picco memoria per stage anche senza trace_memory
+    'max_bytes': 5 * 1024 ** 2,     # Oltre questa dimensione il file ruota in metrics.jsonl.1
+    'history_runs': 20              # Run mostrati nel tab Test & Debug
+}
+
+# Modalità profiling del job (python run_daily_check.py --profile [DIR])
+PROFILING_CONFIG = {
+    'artifacts_dir': 'artifacts/profile',   # Una sottocartella per run (timestamp_commit)
+    'top_n': 40,                            # Righe nei report testuali (funzioni e allocazioni)
+    'sample_interval': 0.005,               # Intervallo (s) del campionatore di stack
+    'tracemalloc_frames': 25                # Profondità traceback per le allocazioni
+}
+
 # ============================================================================
 # SOGLIE SEGNALI (Risk Management)
 # ============================================================================
@@ -42,7 +329,8 @@ THRESHOLDS = {
     'trend_window': 5,          # Giorni per calcolo trend probabilità
     'alert_change': 0.15,       # Variazione % per ALERT
     'garch_percentile': 0.75,   # Percentile per definire "Alta Vol" su GARCH
-    'confidence_min': 0.70      # Confidenza minima per segnale affidabile
+    'confidence_min': 0.70,     # Confidenza minima per segnale affidabile
+    'hit_high': 0.50            # P(ingresso in High Vol entro signal_horizon) per ALERT (se alert_on_hit_high)
 }
 
 # ============================================================================
@@ -61,6 +349,37 @@ REGIME_COLORS = {
     2: '#dc3545'    # Rosso
 }
 
+# Etichette e colori per K regimi (numero di stati scelto dalla selezione HMM),
+# sempre ordinati per volatilità media crescente
+REGIME_LABEL_SETS = {
+    2: ['Low Volatility', 'High Volatility'],
+    3: ['Low Volatility', 'Medium Volatility', 'High Volatility'],
+    4: ['Low Volatility', 'Medium-Low Volatility', 'Medium-High Volatility', 'High Volatility'],
+    5: ['Very Low Volatility', 'Low Volatility', 'Medium Volatility', 'High Volatility', 'Very High Volatility']
+}
+
+REGIME_COLOR_SETS = {
+    2: ['#28a745', '#dc3545'],
+    3: ['#28a745', '#ffc107', '#dc3545'],
+    4: ['#28a745', '#a3c940', '#fd7e14', '#dc3545'],
+    5: ['#1e7e34', '#28a745', '#ffc107', '#fd7e14', '#dc3545']
+}
+
+
+def regime_labels(n_states):
+    """Etichette {stato: nome} per n_states regimi ordinati per volatilità."""
+    labels = REGIME_LABEL_SETS.get(n_states) or [f'Regime {i + 1}' for i in range(n_states)]
+    return dict(enumerate(labels))
+
+
+def regime_colors(n_states):
+    """Colori {stato: colore} per n_states regimi (dal verde al rosso)."""
+    if n_states in REGIME_COLOR_SETS:
+        return dict(enumerate(REGIME_COLOR_SETS[n_states]))
+    palette = REGIME_COLOR_SETS[5]
+    return {i: palette[round(i * (len(palette) - 1) / max(n_states - 1, 1))] for i in range(n_states)}
+
+
 REGIME_DESCRIPTIONS = {
     0: 'Mercato tranquillo, volatilità contenuta. Condizioni favorevoli per strategie direzionali.',
     1: 'Volatilità nella norma. Mercato in fase di transizione o equilibrio.',
@@ -140,15 +459,17 @@ TEXTS = {
     """,
     
     'hmm_explanation': """
-        L'Hidden Markov Model (HMM) identifica stati nascosti di mercato basandosi sulla volatilità osservata.
-        Il modello stima la probabilità di trovarsi in ciascuno dei 3 regimi (Low, Medium, High Volatility)
-        e calcola la matrice di transizione tra gli stati.
+        L'Hidden Markov Model (HMM) identifica stati nascosti di mercato basandosi sulla volatilità osservata
+        (ed eventuali altre features, vedi HMM_FEATURES_CONFIG). Il numero di regimi è HMM_PARAMS['n_states']
+        (3 di default) oppure è scelto dalla selezione per BIC/AIC; i regimi ordinati per volatilità sono
+        ricondotti a Low, Medium e High Volatility e il modello stima la matrice di transizione tra gli stati.
     """,
     
     'garch_explanation': """
-        Il modello GARCH(1,1) cattura la "memoria" della volatilità: gli shock recenti influenzano
-        la previsione della volatilità futura. La somma α+β (persistenza) indica quanto velocemente
-        la volatilità ritorna alla media.
+        I modelli della famiglia GARCH catturano la "memoria" della volatilità: gli shock recenti influenzano
+        la previsione della volatilità futura. La previsione combina i modelli di VOL_MODELS_CONFIG pesati per
+        QLIKE fuori campione (con lo zoo disattivato, un solo GARCH(1,1)). La persistenza (α+β per il GARCH)
+        indica quanto velocemente la volatilità ritorna alla media.
     """,
     
     'signal_explanation': """
@@ -0,0 +1,343 @@
+# daemon.py - Monitor residente (asyncio) in alternativa al cron giornaliero
+# Kriterion Volatility Monitor
+#
+# Il cron di GitHub Actions paga ogni giorno l'avvio a freddo (install, import,
+# download, refit) e non vede nulla tra un run e l'altro. Il daemon tiene dati
+# e modelli in memoria e pianifica con asyncio due attività:
+#   - poll:    barra parziale -> nowcast (un passo di filtro HMM e GARCH, ms)
+#   - refresh: nuove sedute chiuse -> refit dei modelli in un thread
+# A ogni refit valuta le regole di alert sul segnale ufficiale (cambi di
+# segnale, regime, salti di P(High) rispetto alla chiusura precedente); i
+# nowcast seguono le stesse regole di nowcast.py: avviso solo per i segnali di
+# NOWCAST_CONFIG['alert_signals'] diversi dall'ufficiale, una volta per
+# 'seduta:segnale'. Un endpoint HTTP /health espone lo stato del monitor.
+#
+# Uso:
+#   python daemon.py                      # provider configurato (Yahoo/EODHD)
+#   python daemon.py --provider file      # fixture locali
+#   python daemon.py --stub --poll 1      # provider sintetico locale, senza notifiche né state/nowcast.json
+#   curl http://127.0.0.1:8765/health
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+
+import telegram_delivery
+from data_loader import fetch_data, fetch_partial_bar, calculate_features
+from models import train_hmm, get_hmm_states, train_garch
+from signals import generate_signal
+from regime_forecast import regime_forecaster
+from stages import Stage, run_stages
+from nowcast import Nowcaster, build_model_state, write_nowcast, format_nowcast_alert, market_open, alert_key
+from alert_policy import detect_changes
+from notifications import format_change_alert
+from data_providers import get_provider, SyntheticProvider
+from market_calendar import get_calendar
+from config import TICKER, ALERT_POLICY_CONFIG, DAEMON_CONFIG, regime_labels
+
+
+# =============================================================================
+# PROVIDER DATI
+# =============================================================================
+
+class LiveProvider:
+    """Provider configurato (data_providers): sedute chiuse validate e barra parziale."""
+
+    def __init__(self, provider=None):
+        self.provider = provider or get_provider()
+        self.ticker = TICKER
+
+    def history(self):
+        return fetch_data(self.provider)
+
+    def partial_bar(self):
+        return fetch_partial_bar(self.provider)
+
+    def session_open(self):
+        return market_open()
+
+    def last_closed_session(self):
+        return get_calendar().last_closed_session()
+
+
+class StubProvider:
+    """
+    Provider locale per i test: serie sintetica a regimi rivelata tick per tick
+    (vedi data_providers.SyntheticProvider), mercato sempre aperto.
+    """
+
+    ticker = 'SYNTH'
+
+    def __init__(self, n_history=1500, seed=0, ticks_per_bar=5):
+        self.source = SyntheticProvider(n_bars=n_history, seed=seed, ticks_per_bar=ticks_per_bar)
+
+    def history(self):
+        return self.source.history(self.ticker)
+
+    def partial_bar(self):
+        return self.source.partial_bar(self.ticker)
+
+    def session_open(self):
+        return True
+
+    def last_closed_session(self):
+        return None     # Nessun calendario: ogni refresh controlla lo storico
+
+
+# =============================================================================
+# MODELLI
+# =============================================================================
+
+def _fit_hmm(data):
+    model, scaler, mapping = train_hmm(data)
+    states, posteriors = get_hmm_states(data, model, scaler, mapping)
+    return model, scaler, mapping, posteriors
+
+
+def fit_models(df_raw, ticker):
+    """
+    Pipeline completa (features, HMM || GARCH, segnale) su uno storico di sedute
+    chiuse. Ritorna lo stato dei modelli per il Nowcaster (vedi build_model_state).
+    """
+    df = calculate_features(df_raw, ticker=ticker)
+    results = run_stages([
+        Stage('hmm', _fit_hmm, deps=['data']),
+        Stage('garch', train_garch, deps=['data']),
+    ], inputs={'data': df})
+
+    if not results['hmm'].ok:
+        raise results['hmm'].error
+    model, scaler, mapping, posteriors = results['hmm'].value
+    if results['garch'].ok:
+        garch_vol, garch_result = results['garch'].value
+    else:
+        garch_vol, garch_result = df['GK_Vol'].iloc[-1], None
+
+    sig = generate_signal(posteriors, garch_vol, df['GK_Vol'], forecaster=regime_forecaster(model, mapping))
+    return build_model_state(df, model, scaler, mapping, posteriors, garch_result,
+                             sig['signal'], ticker=ticker)
+
+
+# =============================================================================
+# DAEMON
+# =============================================================================
+
+class MonitorDaemon:
+    """Monitor residente: modelli caldi in memoria, poll intraday, refit sulle sedute chiuse."""
+
+    def __init__(self, provider, poll_interval=None, refresh_interval=None, notify=True, write=True):
+        self.provider = provider
+        self.poll_interval = poll_interval or DAEMON_CONFIG['poll_interval']
+        self.refresh_interval = refresh_interval or DAEMON_CONFIG['refresh_interval']
+        self.notify = notify
+        # Con write=False (--stub) il nowcast non sostituisce state/nowcast.json di produzione
+        self.write = write
+        self.policy = ALERT_POLICY_CONFIG['default']
+
+        self.started_at = time.monotonic()
+        self.nowcaster = None
+        self.history = None
+        self.official = None        # Ultimo segnale ufficiale (riferimento delle regole di alert)
+        self.alerted = set()        # Chiavi 'seduta:segnale' dei nowcast già notificati
+        self.last_nowcast = None
+        self.last_poll = None       # time.monotonic() dell'ultimo poll riuscito
+        self.counters = {'polls': 0, 'refits': 0, 'alerts': 0, 'errors': 0}
+        self.last_error = None
+
+    # ------------------------------------------------------------------
+    # Aggiornamenti
+    # ------------------------------------------------------------------
+
+    async def refresh(self):
+        """Scarica lo storico; se c'è una nuova seduta chiusa riaddestra i modelli."""
+        # Probe sul calendario: senza nuove sedute chiuse non serve nemmeno scaricare
+        expected = self.provider.last_closed_session()
+        if self.history is not None and expected is not None and self.history.index[-1].date() >= expected:
+            return False
+
+        df_raw = await asyncio.to_thread(self.provider.history)
+        if self.history is not None and df_raw.index[-1] <= self.history.index[-1]:
+            return False
+
+        t0 = time.perf_counter()
+        state = await asyncio.to_thread(fit_models, df_raw, self.provider.ticker)
+        self.history = df_raw
+        self.nowcaster = Nowcaster(state)
+        # Gli avvisi delle sedute ora chiuse non servono più alla deduplica
+        self.alerted = {k for k in self.alerted if k.split(':')[0] > state['market_date']}
+        self.counters['refits'] += 1
+
+        probs = state['posteriors_tail'][-1]
+        official = {
+            'signal': state['signal'],
+            'regime': regime_labels(len(probs))[int(np.argmax(probs))],
+            'p_high': float(probs[-1])
+        }
+        print(f"🤖 Modelli aggiornati alla seduta {state['market_date']} "
+              f"({time.perf_counter() - t0:.1f}s): segnale {state['signal']}")
+        await self.evaluate(official, header=f"Chiusura {state['market_date']}")
+        return True
+
+    async def poll(self):
+        """Nowcast sulla barra parziale e valutazione delle regole di alert."""
+        if self.nowcaster is None or not self.provider.session_open():
+            return
+        bar = await asyncio.to_thread(self.provider.partial_bar)
+        if bar is None or bar['Date'].strftime('%Y-%m-%d') <= self.nowcaster.state['market_date']:
+            return
+
+        nowcast = self.nowcaster.update(bar)
+        self.last_nowcast = nowcast
+        self.last_poll = time.monotonic()
+        self.counters['polls'] += 1
+        await self.evaluate_nowcast(nowcast)
+        if self.write:
+            write_nowcast(nowcast)
+
+    async def evaluate(self, official, header=None):
+        """Regole di alert sul segnale ufficiale: cambiamenti rispetto alla chiusura precedente."""
+        previous, self.official = self.official, official
+        if previous is None:
+            return
+        events = detect_changes(official, previous, self.policy)
+        if not events:
+            return
+        if header:
+            events = [header] + events
+        await self._send(events, format_change_alert(events))
+
+    async def evaluate_nowcast(self, nowcast):
+        """
+        Nowcast confrontato solo con il segnale ufficiale (mai con il poll
+        precedente): un avviso per 'seduta:segnale', solo per i segnali di rischio.
+        """
+        key = alert_key(nowcast, self.alerted)
+        nowcast['alert_sent'] = key is not None or f"{nowcast['session']}:{nowcast['signal']}" in self.alerted
+        if key is None:
+            return
+        self.alerted.add(key)
+        events = detect_changes(nowcast, self.official, self.policy) if self.official else []
+        message = format_nowcast_alert(nowcast)
+        if events:
+            message = format_change_alert([f"Provvisorio {nowcast['session']}"] + events) + "\n\n" + message
+        await self._send(events or [f"Nowcast {nowcast['session']}: {nowcast['signal']}"], message)
+
+    async def _send(self, events, message):
+        self.counters['alerts'] += 1
+        print(f"🔔 {' | '.join(events)}")
+        if self.notify:
+            await telegram_delivery.send_async(message)
+
+    async def _every(self, interval, func, name):
+        while True:
+            try:
+                await func()
+            except Exception as e:
+                self.counters['errors'] += 1
+                self.last_error = f"{name}: {e}"
+                print(f"⚠️ Errore {name}: {e}")
+            await asyncio.sleep(interval)
+
+    # ------------------------------------------------------------------
+    # Health endpoint
+    # ------------------------------------------------------------------
+
+    def health(self):
+        """Ritorna (status HTTP, payload) per /health."""
+        now = time.monotonic()
+        poll_age = now - self.last_poll if self.last_poll is not None else None
+        stale = (self.provider.session_open() and poll_age is not None
+                 and poll_age > DAEMON_CONFIG['stale_polls'] * self.poll_interval)
+        healthy = self.nowcaster is not None and not stale
+
+        payload = {
+            'status': 'ok' if healthy else ('starting' if self.nowcaster is None else 'stale'),
+            'ticker': self.provider.ticker,
+            'uptime_s': round(now - self.started_at, 1),
+            'model_date': self.nowcaster.state['market_date'] if self.nowcaster else None,
+            'official_signal': self.nowcaster.state['signal'] if self.nowcaster else None,
+            'last_poll_age_s': round(poll_age, 1) if poll_age is not None else None,
+            'nowcast': self.last_nowcast,
+            'counters': self.counters,
+            'last_error': self.last_error,
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds')
+        }
+        return (200 if healthy else 503), payload
+
+    async def _handle_http(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            path = parts[1] if len(parts) > 1 else '/'
+
+            if path.split('?')[0] == '/health':
+                status, payload = self.health()
+            else:
+                status, payload = 404, {'error': 'not found'}
+            body = json.dumps(payload, default=str).encode()
+            reason = {200: 'OK', 404: 'Not Found', 503: 'Service Unavailable'}[status]
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # ------------------------------------------------------------------
+    # Avvio
+    # ------------------------------------------------------------------
+
+    async def run(self, host=None, port=None):
+        host = host or DAEMON_CONFIG['health_host']
+        port = port or DAEMON_CONFIG['health_port']
+        server = await asyncio.start_server(self._handle_http, host, port)
+        print(f"🩺 Health endpoint su http://{host}:{port}/health")
+
+        print(f"🔥 Warm-up modelli ({self.provider.ticker})...")
+        await self.refresh()
+
+        async with server:
+            await asyncio.gather(
+                self._every(self.poll_interval, self.poll, 'poll'),
+                self._every(self.refresh_interval, self.refresh, 'refresh'),
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monitor Kriterion residente (asyncio)")
+    parser.add_argument('--stub', action='store_true', help="Provider sintetico locale (test, senza notifiche)")
+    parser.add_argument('--provider', help="Provider dati (vedi data_providers.PROVIDERS)")
+    parser.add_argument('--poll', type=float, help="Secondi tra due nowcast")
+    parser.add_argument('--refresh', type=float, help="Secondi tra due controlli di nuove sedute chiuse")
+    parser.add_argument('--host', help="Host dell'endpoint /health")
+    parser.add_argument('--port', type=int, help="Porta dell'endpoint /health")
+    parser.add_argument('--no-notify', action='store_true', help="Non inviare alert Telegram")
+    args = parser.parse_args(argv)
+
+    provider = StubProvider() if args.stub else LiveProvider(get_provider(args.provider) if args.provider else None)
+    daemon = MonitorDaemon(
+        provider,
+        poll_interval=args.poll,
+        refresh_interval=args.refresh or (args.poll if args.stub else None),
+        notify=not (args.no_notify or args.stub),
+        write=not args.stub
+    )
+    try:
+        asyncio.run(daemon.run(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n👋 Daemon arrestato.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
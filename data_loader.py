@@ -1,163 +1,188 @@
 # data_loader.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
-import requests
 import streamlit as st
-import yfinance as yf
-from datetime import datetime, time
-import pytz # Necessario per gestire il fuso orario di NY
 
-from utils import get_secret
-from config import TICKER, START_DATE, HMM_PARAMS
+from data_providers import get_provider, FileProvider
+from market_calendar import get_calendar
+from features import term_structure, TERM_STRUCTURE_COLUMNS, FeaturePipeline
+from instrumentation import instrumented, annotate
+from config import TICKER, START_DATE, HMM_PARAMS, CACHE_CONFIG, REPLAY_CONFIG, VIX_COMPANIONS_CONFIG
+
+# Span delle medie esponenziali delle features (usati anche dal nowcast intraday)
+VIX_EMA_SPAN = 3
+GK_EMA_SPAN = 5
+IMPOSSIBLE_THRESHOLD = 0.25     # Range intraday oltre il quale la barra è considerata un tick anomalo
 
 # NOTA: Riduciamo il TTL della cache per evitare di vedere dati vecchi in fasi critiche
-@st.cache_data(ttl=600) 
+@instrumented('download_data', cache_hit=True)
+@st.cache_data(ttl=CACHE_CONFIG['ttl'])
 def download_data():
+    """Versione in cache (Streamlit) di fetch_data."""
+    return fetch_data()
+
+def fetch_data(provider=None):
     """
-    Scarica i dati OHLCV. 
-    Usa Yahoo Finance per il VIX (o se forzato) e EODHD per tutto il resto.
+    Scarica i dati OHLCV (senza cache) dal provider configurato (vedi data_providers).
+    Di default: Yahoo Finance per il VIX e EODHD per tutto il resto.
+    In modalità VIX aggiunge le serie collegate (VIX9D, VIX3M, VIX6M, VVIX),
+    scaricate in parallelo alla serie principale (vedi fetch_companions).
     Applica la logica di 'Ultima Chiusura Giornaliera' per garantire dati consolidati.
     """
-    df = pd.DataFrame()
+    # Se chiamata da download_data, segnala che la cache Streamlit non è stata usata
+    annotate(cache_hit=False)
 
-    # --- 1. SELEZIONE FONTE DATI ---
-    # Se il ticker contiene VIX, forziamo Yahoo Finance (gli indici spesso non sono nel piano base EODHD)
-    if 'VIX' in TICKER.upper():
-        print(f"⚠️ Ticker '{TICKER}' rilevato: switch forzato a Yahoo Finance (Dati Indice).")
-        df = _download_from_yahoo()
+    # --- 1. DOWNLOAD DAL PROVIDER ---
+    provider = provider or get_provider()
+    annotate(provider=provider.name)
+    symbols = companion_symbols(provider)
+    if symbols:
+        # Tutte le serie nello stesso pool: la latenza è quella del download più lento
+        with ThreadPoolExecutor(max_workers=VIX_COMPANIONS_CONFIG['workers']) as pool:
+            main = pool.submit(provider.history, TICKER, start=START_DATE)
+            companions = fetch_companions(provider, symbols, pool)
+            df = main.result()
     else:
-        # Tenta EODHD per titoli azionari/ETF
-        try:
-            df = _download_from_eodhd()
-        except Exception as e:
-            print(f"❌ Errore EODHD: {e}. Tento fallback su Yahoo...")
-            df = _download_from_yahoo()
+        df = provider.history(TICKER, start=START_DATE)
+        companions = {}
 
     # --- 2. VALIDAZIONE CHIUSURA GIORNALIERA ---
     # Questa è la parte cruciale per risolvere il problema dei dati parziali
     df = _validate_market_close(df)
 
+    # --- 3. SERIE COLLEGATE SULLE SEDUTE DELLA SERIE PRINCIPALE ---
+    if companions:
+        df = align_companions(df, companions)
+        annotate(companions=len(companions))
+
     return df
 
-def _download_from_yahoo():
-    """Scarica dati da Yahoo Finance (helper interno)."""
-    # Gestione simbolo Yahoo (vuole ^VIX per l'indice)
-    yf_ticker = TICKER
-    
-    # Se è VIX e manca il cappelletto, aggiungilo
-    if 'VIX' in TICKER.upper() and not TICKER.startswith('^'):
-        yf_ticker = f"^{TICKER}"
-        print(f"ℹ️ Simbolo adattato per Yahoo: {TICKER} -> {yf_ticker}")
+def companion_symbols(provider):
+    """Serie collegate da scaricare (colonna -> simbolo): solo in modalità VIX e con provider multi-ticker."""
+    cfg = VIX_COMPANIONS_CONFIG
+    if not cfg['enabled'] or 'VIX' not in TICKER.upper() or not provider.companions:
+        return {}
+    return dict(cfg['tickers'])
+
+def fetch_companions(provider, symbols, pool):
+    """
+    Chiusure delle serie collegate, scaricate in parallelo sul pool dato.
+    Una serie non disponibile viene saltata: le features che la usano restano assenti.
     
-    try:
-        # Scarichiamo un periodo ampio per essere sicuri di avere tutto
-        ticker_obj = yf.Ticker(yf_ticker)
-        df = ticker_obj.history(period="5y", auto_adjust=False)
-        
-        if df.empty:
-            raise Exception(f"Yahoo Finance non ha restituito dati per {yf_ticker}.")
-
-        # Rinomina e standardizza
-        df = df.rename(columns={
-            'Open': 'Open', 'High': 'High', 'Low': 'Low', 
-            'Close': 'Close', 'Adj Close': 'Adj_Close', 'Volume': 'Volume'
-        })
-        
-        # Fix colonne mancanti
-        if 'Adj_Close' not in df.columns:
-            df['Adj_Close'] = df['Close']
-        
-        # Pulizia indice
-        df.index.name = 'Date'
-        df.index = pd.to_datetime(df.index).tz_localize(None)
-        
-        # Filtro data inizio
-        df = df[df.index >= pd.to_datetime(START_DATE)]
-        
-        print(f"✅ Dati scaricati da Yahoo: {len(df)} righe")
-        return df
+    Returns:
+    --------
+    dict
+        Colonna -> pd.Series delle chiusure
+    """
+    futures = {name: pool.submit(provider.history, symbol, start=START_DATE)
+               for name, symbol in symbols.items()}
+    companions = {}
+    for name, future in futures.items():
+        try:
+            companions[name] = future.result()['Close'].dropna()
+        except Exception as e:
+            print(f"⚠️ Serie {name} non disponibile: {e}")
+    return companions
 
-    except Exception as e:
-        raise Exception(f"Errore download Yahoo Finance: {str(e)}")
+def align_companions(df, companions):
+    """
+    Allinea le serie collegate alle sedute della serie principale e le unisce
+    in un solo join. Sedute mancanti in una serie (calendari di pubblicazione
+    diversi) prendono l'ultimo valore noto, per al più max_gap sedute.
+    """
+    limit = VIX_COMPANIONS_CONFIG['max_gap']
+    aligned = pd.DataFrame({
+        name: series[~series.index.duplicated(keep='last')].sort_index().reindex(
+            df.index, method='ffill', limit=limit)
+        for name, series in companions.items()
+    }, index=df.index)
+    return df.drop(columns=list(aligned.columns), errors='ignore').join(aligned)
 
-def _download_from_eodhd():
-    """Scarica dati da EODHD (helper interno)."""
-    api_key = get_secret('EODHD_API_KEY')
-    if not api_key:
-        raise ValueError("EODHD_API_KEY non trovata.")
+def fetch_partial_bar(provider=None):
+    """
+    Barra giornaliera in corso (Open/High/Low/Close finora) per il nowcast intraday.
+    
+    Returns:
+    --------
+    dict
+        Date (Timestamp della seduta), Open, High, Low, Close
+    """
+    provider = provider or get_provider()
+    return provider.partial_bar(TICKER)
 
-    clean_ticker = TICKER.replace('^', '').strip()
-    url = f"https://eodhd.com/api/eod/{clean_ticker}"
-    params = {'api_token': api_key, 'from': START_DATE, 'fmt': 'json'}
+def _snapshot_path(ticker=None):
+    return REPLAY_CONFIG['snapshot_path'].format(ticker=(ticker or TICKER).replace('^', ''))
 
-    response = requests.get(url, params=params, timeout=10)
-    
-    if response.status_code != 200:
-        raise Exception(f"API EODHD errore {response.status_code}")
+def save_history_snapshot(df, path=None):
+    """
+    Salva lo storico OHLCV scaricato nello snapshot locale usato dal replay.
+    Le righe già presenti vengono mantenute (lo storico cresce oltre la finestra
+    del provider); per le date in comune prevale l'ultimo download.
+    """
+    if df.empty:
+        return df
+    path = path or _snapshot_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        old = pd.read_csv(path, index_col=0, parse_dates=True)
+        df = pd.concat([old[~old.index.isin(df.index)], df]).sort_index()
+    df.to_csv(path)
+    return df
 
-    data = response.json()
-    
-    # Check se la risposta è vuota
-    if not data or len(data) == 0:
-         raise Exception("Nessun dato restituito da EODHD.")
-
-    df = pd.DataFrame(data)
-    df = df.rename(columns={
-        'date': 'Date', 'open': 'Open', 'high': 'High', 
-        'low': 'Low', 'close': 'Close', 'adjusted_close': 'Adj_Close', 'volume': 'Volume'
-    })
-    
-    df['Date'] = pd.to_datetime(df['Date'])
-    df.set_index('Date', inplace=True)
-    df.sort_index(inplace=True)
-    
-    # Conversione numerica
-    for c in ['Open', 'High', 'Low', 'Close', 'Adj_Close', 'Volume']:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors='coerce')
-            
+def load_history_snapshot(as_of=None, path=None):
+    """
+    Carica lo snapshot locale, troncato (incluso) alla data as_of se indicata.
+    Nessun accesso alla rete: base del replay 'as-of' del job.
+    """
+    path = path or _snapshot_path()
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"Snapshot storico non trovato ({path}): esegui prima il job live almeno una volta"
+        )
+    df = FileProvider(path).history(TICKER, end=as_of)
+    if df.empty:
+        raise ValueError(f"Nessun dato nello snapshot fino al {as_of}")
     return df
 
 def _validate_market_close(df):
     """
-    Logica 'Smart':
-    - Se l'ultima data è < di Oggi: OK (è una chiusura passata).
-    - Se l'ultima data è == Oggi:
-        - Se ora < 16:15 NY (mercato aperto): SCARTA l'ultima riga (è incompleta).
-        - Se ora >= 16:15 NY (mercato chiuso): TIENI l'ultima riga (è la chiusura di oggi).
+    Logica 'Smart' guidata dal calendario di borsa (market_calendar):
+    - Se l'ultima data è una seduta già chiusa: OK.
+    - Se la seduta dell'ultima data non è ancora chiusa (chiusura regolare
+      16:00 o anticipata 13:00, più il buffer di pubblicazione): SCARTA
+      l'ultima riga (è incompleta).
     """
     if df.empty:
         return df
 
-    # Configurazione Timezone NY
-    ny_tz = pytz.timezone('America/New_York')
-    now_ny = datetime.now(ny_tz)
-    today_date_ny = now_ny.date()
-    
+    cal = get_calendar()
+    now_ny = cal.now()
     last_date_in_df = df.index[-1].date()
 
-    # Se il dato più recente nel DF è di oggi
-    if last_date_in_df == today_date_ny:
-        # Orario di chiusura mercato USA (16:00) + 15 min buffer
-        market_close_time = time(16, 15)
-        current_time = now_ny.time()
-        
-        if current_time < market_close_time:
-            print(f"🕒 Mercato NY ancora aperto ({current_time.strftime('%H:%M')}).")
-            print(f"⚠️ Rimuovo la candela di oggi ({last_date_in_df}) perché incompleta.")
-            print(f"   L'analisi verrà fatta sulla chiusura di IERI.")
-            df = df.iloc[:-1]
-        else:
-            print(f"🌑 Mercato NY chiuso ({current_time.strftime('%H:%M')}).")
-            print(f"✅ La candela di oggi ({last_date_in_df}) è confermata e verrà usata.")
-            
+    if not cal.session_complete(last_date_in_df, now_ny):
+        close_time = cal.close_time(last_date_in_df)
+        early = " (chiusura anticipata)" if last_date_in_df in cal.early_closes else ""
+        print(f"🕒 Mercato NY ancora aperto ({now_ny.strftime('%H:%M')}, chiusura {close_time.strftime('%H:%M')}{early}).")
+        print(f"⚠️ Rimuovo la candela di oggi ({last_date_in_df}) perché incompleta.")
+        print(f"   L'analisi verrà fatta sulla chiusura di {cal.previous_session(last_date_in_df)}.")
+        df = df.iloc[:-1]
+    elif last_date_in_df == now_ny.date():
+        print(f"🌑 Mercato NY chiuso ({now_ny.strftime('%H:%M')}).")
+        print(f"✅ La candela di oggi ({last_date_in_df}) è confermata e verrà usata.")
+
     return df
 
-def calculate_features(df):
+@instrumented('calculate_features')
+def calculate_features(df, ticker=None):
     """
     Calcola le features per l'HMM.
     Gestisce automaticamente sia SPY (calcolando GK Vol) che VIX (usando il livello Close).
+    `ticker` (default: TICKER di config) decide quale delle due logiche applicare.
     """
+    ticker = ticker or TICKER
     if df.empty:
         raise ValueError("DataFrame vuoto in calculate_features")
 
@@ -171,7 +196,7 @@ def calculate_features(df):
     # =========================================================================
     
     # Verifica se stiamo lavorando col VIX (controlla sia 'VIX' che '^VIX')
-    if 'VIX' in TICKER.upper():
+    if 'VIX' in ticker.upper():
         print("ℹ️ Rilevato Ticker VIX: Utilizzo 'Close' come proxy di volatilità diretta.")
         
         # Il VIX è già quotato in % annualizzata (es. 20.0 = 20%)
@@ -181,18 +206,20 @@ def calculate_features(df):
         # Nota: Non applichiamo smoothing eccessivo al VIX perché è già un segnale "puro",
         # ma un minimo di EMA aiuta a ridurre il rumore giornaliero per l'HMM.
         # Usiamo uno span molto basso (3 giorni) per mantenere massima reattività.
-        df['GK_Vol'] = df['GK_Vol'].ewm(span=3, adjust=False).mean()
+        df['GK_Vol'] = df['GK_Vol'].ewm(span=VIX_EMA_SPAN, adjust=False).mean()
         
         # Per l'HMM usiamo il Log(VIX). 
         # Questo è standard in letteratura perché il VIX è log-normale.
         df['Log_Vol'] = np.log(df['GK_Vol'])
         
+        # Term structure e VVIX reale, se le serie collegate sono disponibili
+        df = _term_structure_features(df)
+        
     else:
         # --- LOGICA STANDARD PER EQUITY (SPY, QQQ, ecc.) ---
         
         # --- CIRCUIT BREAKER FILTER (PHYSICS BASED) ---
         df['Intraday_Range'] = (df['High'] - df['Low']) / df['Open']
-        IMPOSSIBLE_THRESHOLD = 0.25 
         
         bad_ticks = df['Intraday_Range'].abs() > IMPOSSIBLE_THRESHOLD
         
@@ -219,15 +246,78 @@ def calculate_features(df):
         df['GK_Daily_Ann'] = np.sqrt(df['Garman_Klass'] * 252)
         
         # Smoothing "Fast" (Media Esponenziale 5gg)
-        df['GK_Vol'] = df['GK_Daily_Ann'].ewm(span=5, adjust=False).mean()
+        df['GK_Vol'] = df['GK_Daily_Ann'].ewm(span=GK_EMA_SPAN, adjust=False).mean()
         
         # Log-Volatility per HMM
         df['Log_Vol'] = np.log(df['GK_Vol'] + 1e-6)
 
-    # Pulizia finale (rimuove i primi giorni di NaN dovuti a shift/rolling)
-    df.dropna(inplace=True)
+    # Pulizia finale (rimuove i primi giorni di NaN dovuti a shift/rolling).
+    # Le serie collegate possono iniziare più tardi: i loro NaN non tagliano lo storico
+    optional = set(VIX_COMPANIONS_CONFIG['tickers']) | set(TERM_STRUCTURE_COLUMNS)
+    df.dropna(subset=[c for c in df.columns if c not in optional], inplace=True)
     
     if df.empty:
         raise ValueError("Storico insufficiente dopo il calcolo delle features.")
 
+    # Con features HMM dalle serie collegate lo storico parte dalla prima seduta
+    # in cui sono tutte disponibili: training, inferenza, bootstrap e nowcast
+    # vedono le stesse righe (con il solo Log_Vol non si taglia nulla)
+    start = FeaturePipeline().first_complete(df)
+    if start:
+        print(f"   ✂️ Storico dal {df.index[start].date()}: prima seduta con tutte le features HMM")
+        df = df.iloc[start:]
+
     return df
+
+def _term_structure_features(df):
+    """
+    Colonne della term structure (features.term_structure) dalle serie collegate
+    presenti: calcolate una sola volta qui e lette dalla pipeline dell'HMM.
+    """
+    inputs = ['Close', *VIX_COMPANIONS_CONFIG['tickers']]
+    cols = {c: df[c].to_numpy(dtype=float) for c in inputs if c in df.columns}
+    for name, values in term_structure(cols).items():
+        df[name] = values
+    return df
+
+def advance_features(prev_gk_vol, bar, ticker=None):
+    """
+    Features di una nuova barra (anche parziale) a partire dallo stato EMA
+    precedente, senza ricalcolare lo storico: stessa logica dell'ultima riga
+    di calculate_features.
+    
+    Parameters:
+    -----------
+    prev_gk_vol : float
+        GK_Vol dell'ultima seduta chiusa
+    bar : dict
+        Open, High, Low, Close della barra
+    ticker : str, optional
+        Default: TICKER di config
+        
+    Returns:
+    --------
+    tuple
+        (GK_Vol, Log_Vol) della barra
+    """
+    ticker = ticker or TICKER
+    
+    if 'VIX' in ticker.upper():
+        raw, span = bar['Close'] / 100.0, VIX_EMA_SPAN
+    else:
+        o, h, l, c = bar['Open'], bar['High'], bar['Low'], bar['Close']
+        if abs(h - l) / o > IMPOSSIBLE_THRESHOLD:
+            # Tick anomalo: la barra non aggiorna lo stato
+            return prev_gk_vol, np.log(prev_gk_vol + 1e-6)
+        epsilon = 1e-8
+        gk = 0.5 * np.log(h / (l + epsilon)) ** 2 - (2 * np.log(2) - 1) * np.log(c / (o + epsilon)) ** 2
+        gk = min(gk, 0.05)
+        # GK negativo -> NaN nello storico: l'EMA mantiene il valore precedente
+        if gk < 0:
+            return prev_gk_vol, np.log(prev_gk_vol + 1e-6)
+        raw, span = np.sqrt(gk * 252), GK_EMA_SPAN
+    
+    alpha = 2.0 / (span + 1)
+    gk_vol = alpha * raw + (1 - alpha) * prev_gk_vol
+    log_vol = np.log(gk_vol) if 'VIX' in ticker.upper() else np.log(gk_vol + 1e-6)
+    return gk_vol, log_vol
@@ -0,0 +1,462 @@
+# data_providers.py - Fonti dati OHLCV intercambiabili
+# Kriterion Volatility Monitor
+#
+# Ogni provider espone la stessa interfaccia:
+#   history(ticker, start=None, end=None) -> DataFrame OHLCV giornaliero (indice 'Date')
+#   partial_bar(ticker)                   -> dict Date/Open/High/Low/Close della seduta in corso
+#   companions                            -> True se fornisce anche le serie collegate al VIX
+#
+# Provider registrati:
+#   'auto'       comportamento storico: Yahoo per il VIX, EODHD (fallback Yahoo) per il resto
+#   'yahoo'      Yahoo Finance (yfinance)
+#   'eodhd'      API EODHD; base_url configurabile (es. StubEODHDServer in-process)
+#   'file'       fixture locali CSV o Parquet, nessun accesso alla rete
+#   'synthetic'  serie sintetica a regimi deterministica (synthetic_data)
+#
+# La scelta avviene in DATA_PROVIDER_CONFIG oppure con le variabili d'ambiente
+# KRITERION_DATA_PROVIDER e KRITERION_DATA_PATH: job, dashboard, replay,
+# nowcast e benchmark girano così offline e su dati identici (CI, test di
+# performance non limitati dai rate limit delle API).
+#
+# Fixture deterministica di esempio:
+#   python data_providers.py --make-fixture fixtures/VIX.csv --bars 3000 --seed 0
+
+import os
+import sys
+import json
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+import pytz
+import requests
+import yfinance as yf
+
+from utils import get_secret
+from synthetic_data import generate_regime_ohlcv, SYNTHETIC_PARAMS
+from config import DATA_PROVIDER_CONFIG
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj_Close', 'Volume']
+
+
+def _clip(df, start=None, end=None):
+    if start is not None:
+        df = df[df.index >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df.index <= pd.Timestamp(end)]
+    return df
+
+
+class DataProvider:
+    """Interfaccia base dei provider."""
+
+    name = 'base'
+    companions = True       # Serve anche le serie collegate (es. ^VIX3M) oltre al ticker principale
+
+    def history(self, ticker, start=None, end=None):
+        raise NotImplementedError
+
+    def partial_bar(self, ticker):
+        raise NotImplementedError(f"Il provider '{self.name}' non fornisce barre intraday")
+
+
+# =============================================================================
+# PROVIDER DI RETE
+# =============================================================================
+
+class YahooProvider(DataProvider):
+    """Yahoo Finance (yfinance). Per il VIX aggiunge il '^' richiesto da Yahoo."""
+
+    name = 'yahoo'
+
+    @staticmethod
+    def symbol(ticker):
+        if 'VIX' in ticker.upper() and not ticker.startswith('^'):
+            print(f"ℹ️ Simbolo adattato per Yahoo: {ticker} -> ^{ticker}")
+            return f"^{ticker}"
+        return ticker
+
+    def history(self, ticker, start=None, end=None):
+        yf_ticker = self.symbol(ticker)
+        try:
+            # Scarichiamo un periodo ampio per essere sicuri di avere tutto
+            df = yf.Ticker(yf_ticker).history(period="5y", auto_adjust=False)
+
+            if df.empty:
+                raise Exception(f"Yahoo Finance non ha restituito dati per {yf_ticker}.")
+
+            df = df.rename(columns={'Adj Close': 'Adj_Close'})
+            if 'Adj_Close' not in df.columns:
+                df['Adj_Close'] = df['Close']
+
+            df.index.name = 'Date'
+            df.index = pd.to_datetime(df.index).tz_localize(None)
+            df = _clip(df, start, end)
+
+            print(f"✅ Dati scaricati da Yahoo: {len(df)} righe")
+            return df
+
+        except Exception as e:
+            raise Exception(f"Errore download Yahoo Finance: {str(e)}")
+
+    def partial_bar(self, ticker):
+        yf_ticker = self.symbol(ticker)
+        bars = yf.Ticker(yf_ticker).history(period="1d", interval="1m", auto_adjust=False)
+        if bars.empty:
+            raise Exception(f"Yahoo Finance non ha restituito dati intraday per {yf_ticker}.")
+        return {
+            'Date': pd.Timestamp(bars.index[-1].date()),
+            'Open': float(bars['Open'].iloc[0]),
+            'High': float(bars['High'].max()),
+            'Low': float(bars['Low'].min()),
+            'Close': float(bars['Close'].iloc[-1])
+        }
+
+
+class EODHDProvider(DataProvider):
+    """API EODHD (eod e real-time). base_url permette di puntare a uno stub locale."""
+
+    name = 'eodhd'
+
+    def __init__(self, base_url=None, api_key=None, timeout=None):
+        self.base_url = (base_url or get_secret('EODHD_BASE_URL')
+                         or DATA_PROVIDER_CONFIG['eodhd_base_url']).rstrip('/')
+        self._api_key = api_key
+        self.timeout = timeout or DATA_PROVIDER_CONFIG['timeout']
+
+    @property
+    def api_key(self):
+        api_key = self._api_key or get_secret('EODHD_API_KEY')
+        if not api_key:
+            raise ValueError("EODHD_API_KEY non trovata.")
+        return api_key
+
+    def history(self, ticker, start=None, end=None):
+        clean_ticker = ticker.replace('^', '').strip()
+        params = {'api_token': self.api_key, 'fmt': 'json'}
+        if start is not None:
+            params['from'] = pd.Timestamp(start).strftime('%Y-%m-%d')
+        if end is not None:
+            params['to'] = pd.Timestamp(end).strftime('%Y-%m-%d')
+
+        response = requests.get(f"{self.base_url}/eod/{clean_ticker}", params=params, timeout=self.timeout)
+        if response.status_code != 200:
+            raise Exception(f"API EODHD errore {response.status_code}")
+
+        data = response.json()
+        if not data:
+            raise Exception("Nessun dato restituito da EODHD.")
+
+        df = pd.DataFrame(data).rename(columns={
+            'date': 'Date', 'open': 'Open', 'high': 'High',
+            'low': 'Low', 'close': 'Close', 'adjusted_close': 'Adj_Close', 'volume': 'Volume'
+        })
+        df['Date'] = pd.to_datetime(df['Date'])
+        df.set_index('Date', inplace=True)
+        df.sort_index(inplace=True)
+
+        for c in OHLCV_COLUMNS:
+            if c in df.columns:
+                df[c] = pd.to_numeric(df[c], errors='coerce')
+        return df
+
+    def partial_bar(self, ticker):
+        clean_ticker = ticker.replace('^', '').strip()
+        response = requests.get(f"{self.base_url}/real-time/{clean_ticker}",
+                                params={'api_token': self.api_key, 'fmt': 'json'}, timeout=self.timeout)
+        if response.status_code != 200:
+            raise Exception(f"API EODHD real-time errore {response.status_code}")
+
+        quote = response.json()
+        ny_tz = pytz.timezone('America/New_York')
+        return {
+            'Date': pd.Timestamp(datetime.fromtimestamp(int(quote['timestamp']), ny_tz).date()),
+            'Open': float(quote['open']),
+            'High': float(quote['high']),
+            'Low': float(quote['low']),
+            'Close': float(quote['close'])
+        }
+
+
+class AutoProvider(DataProvider):
+    """
+    Selezione storica della fonte: Yahoo per il VIX (gli indici spesso non sono
+    nel piano base EODHD), EODHD con fallback su Yahoo per titoli ed ETF.
+    """
+
+    name = 'auto'
+
+    def __init__(self, yahoo=None, eodhd=None):
+        self.yahoo = yahoo or YahooProvider()
+        self.eodhd = eodhd or EODHDProvider()
+
+    def _call(self, method, ticker, *args):
+        if 'VIX' in ticker.upper():
+            print(f"⚠️ Ticker '{ticker}' rilevato: switch forzato a Yahoo Finance (Dati Indice).")
+            return getattr(self.yahoo, method)(ticker, *args)
+        try:
+            return getattr(self.eodhd, method)(ticker, *args)
+        except Exception as e:
+            print(f"❌ Errore EODHD: {e}. Tento fallback su Yahoo...")
+            return getattr(self.yahoo, method)(ticker, *args)
+
+    def history(self, ticker, start=None, end=None):
+        return self._call('history', ticker, start, end)
+
+    def partial_bar(self, ticker):
+        return self._call('partial_bar', ticker)
+
+
+# =============================================================================
+# PROVIDER OFFLINE
+# =============================================================================
+
+class FileProvider(DataProvider):
+    """
+    Fixture locali: un file CSV o Parquet per ticker (indice/colonna 'Date').
+    path può contenere {ticker}. Con partial_date la riga di quella data viene
+    esclusa dallo storico e restituita come barra parziale (test del nowcast).
+    """
+
+    name = 'file'
+
+    def __init__(self, path=None, partial_date=None):
+        self.path = path or get_secret('KRITERION_DATA_PATH') or DATA_PROVIDER_CONFIG['file_path']
+        self.partial_date = pd.Timestamp(partial_date) if partial_date else None
+        self._frames = {}
+
+    @property
+    def companions(self):
+        # Un percorso senza {ticker} è la fixture di una sola serie
+        return '{ticker}' in self.path
+
+    def _resolve(self, ticker):
+        return self.path.format(ticker=ticker.replace('^', ''))
+
+    def _load(self, ticker):
+        path = self._resolve(ticker)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        cached = self._frames.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if mtime is None:
+            raise FileNotFoundError(f"Fixture dati non trovata: {path}")
+
+        if path.endswith('.parquet'):
+            df = pd.read_parquet(path)
+            if 'Date' in df.columns:
+                df = df.set_index('Date')
+        else:
+            df = pd.read_csv(path, index_col=0, parse_dates=True)
+        df.index = pd.to_datetime(df.index)
+        df.index.name = 'Date'
+        df = df.sort_index()
+        self._frames[path] = (mtime, df)
+        return df
+
+    def history(self, ticker, start=None, end=None):
+        df = self._load(ticker)
+        if self.partial_date is not None:
+            df = df[df.index < self.partial_date]
+        return _clip(df, start, end).copy()
+
+    def partial_bar(self, ticker):
+        df = self._load(ticker)
+        if self.partial_date is None or self.partial_date not in df.index:
+            raise LookupError("Nessuna barra parziale: imposta partial_date su una data della fixture")
+        row = df.loc[self.partial_date]
+        return {'Date': self.partial_date, **{c: float(row[c]) for c in ['Open', 'High', 'Low', 'Close']}}
+
+
+def _synthetic_params():
+    # Date realistiche (dentro START_DATE) invece dell'origine remota usata dal benchmark
+    return {**SYNTHETIC_PARAMS, 'start_date': DATA_PROVIDER_CONFIG['synthetic_start']}
+
+
+class SyntheticProvider(DataProvider):
+    """
+    Serie sintetica a regimi deterministica (stesso seed = stessi dati).
+    Con ticks_per_bar la serie viene rivelata progressivamente: ogni chiamata
+    a partial_bar fa avanzare la barra in corso di un tick e, dopo
+    ticks_per_bar tick, la barra si chiude ed entra nello storico.
+    """
+
+    name = 'synthetic'
+    companions = False      # Una sola serie sintetica, qualunque sia il ticker
+
+    def __init__(self, n_bars=None, seed=None, ticks_per_bar=5):
+        n_bars = n_bars or DATA_PROVIDER_CONFIG['synthetic_bars']
+        seed = DATA_PROVIDER_CONFIG['synthetic_seed'] if seed is None else seed
+        # Barre extra oltre lo storico iniziale, rivelate da partial_bar
+        self._data, _ = generate_regime_ohlcv(n_bars + 5000, seed=seed, params=_synthetic_params())
+        self._n = n_bars
+        self._tick = 0
+        self.ticks_per_bar = ticks_per_bar
+
+    def history(self, ticker, start=None, end=None):
+        return _clip(self._data.iloc[:self._n], start, end).copy()
+
+    def partial_bar(self, ticker):
+        self._tick += 1
+        if self._tick > self.ticks_per_bar:
+            self._n = min(self._n + 1, len(self._data) - 1)     # Barra chiusa
+            self._tick = 1
+        row = self._data.iloc[self._n]
+        frac = self._tick / self.ticks_per_bar
+        close = row['Open'] + (row['Close'] - row['Open']) * frac
+        return {
+            'Date': row.name,
+            'Open': float(row['Open']),
+            'High': float(max(row['Open'] + (row['High'] - row['Open']) * frac, close)),
+            'Low': float(min(row['Open'] - (row['Open'] - row['Low']) * frac, close)),
+            'Close': float(close)
+        }
+
+
+PROVIDERS = {
+    'auto': AutoProvider,
+    'yahoo': YahooProvider,
+    'eodhd': EODHDProvider,
+    'file': FileProvider,
+    'synthetic': SyntheticProvider,
+}
+
+_instance = None
+
+
+def get_provider(name=None):
+    """
+    Provider configurato (singleton per processo se name non è indicato).
+    Sovrascrivibile con la variabile d'ambiente KRITERION_DATA_PROVIDER.
+    """
+    global _instance
+    if name is None and _instance is not None:
+        return _instance
+
+    selected = (name or get_secret('KRITERION_DATA_PROVIDER') or DATA_PROVIDER_CONFIG['provider']).lower()
+    if selected not in PROVIDERS:
+        raise ValueError(f"Provider dati '{selected}' sconosciuto. Disponibili: {', '.join(PROVIDERS)}")
+
+    provider = PROVIDERS[selected]()
+    if name is None:
+        _instance = provider
+    return provider
+
+
+# =============================================================================
+# STUB EODHD IN-PROCESS
+# =============================================================================
+
+class StubEODHDServer:
+    """
+    Server HTTP locale che imita gli endpoint EODHD usati dal monitor
+    (/api/eod/{ticker} e /api/real-time/{ticker}) servendo DataFrame in memoria.
+
+    Esempio:
+        with StubEODHDServer({'SPY': df}) as stub:
+            df = EODHDProvider(base_url=stub.base_url, api_key='stub').history('SPY')
+    """
+
+    def __init__(self, frames, host='127.0.0.1', port=0):
+        self.frames = {t.replace('^', ''): df for t, df in frames.items()}
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                url = urlsplit(self.path)
+                parts = url.path.strip('/').split('/')
+                query = parse_qs(url.query)
+                status, payload = stub.handle(parts, query)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def handle(self, parts, query):
+        if len(parts) != 3 or parts[0] != 'api' or parts[1] not in ('eod', 'real-time'):
+            return 404, {'error': 'not found'}
+        if not query.get('api_token'):
+            return 401, {'error': 'api_token mancante'}
+        df = self.frames.get(parts[2].split('.')[0])
+        if df is None:
+            return 404, {'error': f"ticker {parts[2]} sconosciuto"}
+
+        if parts[1] == 'real-time':
+            row = df.iloc[-1]
+            return 200, {
+                'code': parts[2], 'timestamp': int(df.index[-1].timestamp()) + 15 * 3600,
+                'open': float(row['Open']), 'high': float(row['High']),
+                'low': float(row['Low']), 'close': float(row['Close'])
+            }
+
+        df = _clip(df, query.get('from', [None])[0], query.get('to', [None])[0])
+        records = [{
+            'date': idx.strftime('%Y-%m-%d'),
+            'open': row['Open'], 'high': row['High'], 'low': row['Low'], 'close': row['Close'],
+            'adjusted_close': row.get('Adj_Close', row['Close']),
+            'volume': int(row['Volume']) if 'Volume' in row and not np.isnan(row['Volume']) else 0
+        } for idx, row in df.iterrows()]
+        return 200, records
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='kriterion-eodhd-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def make_fixture(path, n_bars, seed=0):
+    """Scrive una fixture OHLCV sintetica deterministica (CSV o Parquet)."""
+    df, _ = generate_regime_ohlcv(n_bars, seed=seed, params=_synthetic_params())
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith('.parquet'):
+        df.to_parquet(path)
+    else:
+        df.to_csv(path)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provider dati Kriterion")
+    parser.add_argument('--make-fixture', metavar='PATH', required=True,
+                        help="Scrive una fixture sintetica deterministica (.csv o .parquet)")
+    parser.add_argument('--bars', type=int, default=3000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    df = make_fixture(args.make_fixture, args.bars, args.seed)
+    print(f"💾 Fixture {args.make_fixture}: {len(df)} barre ({df.index[0].date()} -> {df.index[-1].date()})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
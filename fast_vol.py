@@ -0,0 +1,218 @@
+# fast_vol.py - Forecaster di volatilità a costo costante (EWMA/RiskMetrics e HAR-RV)
+# Kriterion Volatility Monitor
+#
+# Lo zoo GARCH (vol_models.py) richiede un'ottimizzazione numerica per modello.
+# Qui due forecaster senza ottimizzatore, costruiti su Returns e sulla
+# varianza realizzata (Garman-Klass per le equity, rendimenti al quadrato per il VIX):
+#   - EWMA (RiskMetrics): σ²(t+1) = λ σ²(t) + (1-λ) r²(t), ricorsione vettoriale
+#   - HAR-RV (Corsi): RV(t+1) = b0 + bd RV(t) + bw RV_5(t) + bm RV_22(t), stimato
+#     con minimi quadrati sulle medie mobili precalcolate con somme cumulative
+# Entrambi espongono la stessa interfaccia dei risultati arch usata dallo zoo
+# (conditional_volatility, resid, params, forecast multi-step, stato per il
+# nowcast) e aggiornano lo stato in O(1) a ogni nuova barra (update).
+#
+# Unità: rendimenti in % e varianze in %² giornaliere, come per i modelli arch.
+
+import numpy as np
+import pandas as pd
+
+from config import FAST_VOL_CONFIG
+
+# Pavimento relativo (sulla media di RV) per i forecast HAR, che in livelli possono diventare negativi
+HAR_FLOOR = 0.01
+
+
+def realized_variance(df):
+    """
+    Varianza realizzata giornaliera (%²) dalle features.
+
+    Garman-Klass se disponibile (equity), altrimenti rendimenti al quadrato
+    (il VIX usa il livello Close come feature e non ha stimatori da range).
+    """
+    if 'Garman_Klass' in df.columns:
+        return df['Garman_Klass'] * 1e4
+    return (df['Returns'] * 100) ** 2
+
+
+def bar_realized_variance(bar, prev_close, ticker):
+    """Varianza realizzata (%²) di una singola barra, anche parziale (stessa logica di realized_variance)."""
+    if 'VIX' in ticker.upper():
+        return float((np.log(bar['Close'] / prev_close) * 100) ** 2)
+    o, h, l, c = bar['Open'], bar['High'], bar['Low'], bar['Close']
+    epsilon = 1e-8
+    gk = 0.5 * np.log(h / (l + epsilon)) ** 2 - (2 * np.log(2) - 1) * np.log(c / (o + epsilon)) ** 2
+    return float(np.clip(gk, 0.0, 0.05) * 1e4)
+
+
+class FastForecaster:
+    """
+    Base comune: varianza condizionale in campione e forecast senza ottimizzatore.
+
+    fit(last_obs) stima i parametri sulle prime last_obs osservazioni e calcola
+    la varianza condizionale su tutto il campione a parametri fissi (come
+    arch con last_obs + fix), quindi la coda è un forecast fuori campione.
+    """
+
+    vol_name = None
+    convergence_flag = 0            # Nessuna ottimizzazione: sempre "convergente"
+    optimization_result = None
+
+    def __init__(self, returns, rv=None):
+        self.returns = returns
+        self.rv = rv if rv is not None else returns ** 2
+        self.sigma2 = None          # σ²(t) noto a t-1, allineato a returns
+        self.state = None           # Stato minimo per forecast e update
+
+    @property
+    def resid(self):
+        return self.returns
+
+    @property
+    def conditional_volatility(self):
+        return pd.Series(np.sqrt(self.sigma2), index=self.returns.index)
+
+    @property
+    def loglikelihood(self):
+        """Log-verosimiglianza gaussiana (confrontabile con i modelli arch a errori normali)."""
+        r2 = self.returns.values ** 2
+        return float(-0.5 * np.sum(np.log(2 * np.pi) + np.log(self.sigma2) + r2 / self.sigma2))
+
+    def update(self, r, rv=None):
+        """Aggiunge una seduta chiusa allo stato in O(1). Ritorna la varianza prevista per la successiva."""
+        self.state = advance_state(self.state, r, rv)
+        return self.state['next_sigma2']
+
+    def nowcast_state(self):
+        return dict(self.state)
+
+
+class EWMAForecaster(FastForecaster):
+    """EWMA RiskMetrics sui rendimenti: media nulla, λ fisso (nessun parametro da stimare)."""
+
+    vol_name = 'EWMA'
+
+    def __init__(self, returns, rv=None, lam=None):
+        super().__init__(returns, rv)
+        self.lam = FAST_VOL_CONFIG['ewma_lambda'] if lam is None else lam
+
+    @property
+    def params(self):
+        return pd.Series({'lambda': self.lam})
+
+    def fit(self, last_obs=None):
+        r2 = self.returns.values ** 2
+        seed = float(np.mean(r2[:FAST_VOL_CONFIG['ewma_seed_window']]))
+        # ewm(adjust=False): y(t) = λ y(t-1) + (1-λ) r²(t), con y(-1) = seed
+        smoothed = pd.Series(np.concatenate([[seed], r2])).ewm(alpha=1 - self.lam, adjust=False).mean().values
+        self.sigma2 = smoothed[:-1]
+        self.state = {'vol': 'EWMA', 'mu': 0.0, 'lam': self.lam, 'next_sigma2': float(smoothed[-1])}
+        return self
+
+    def forecast_variance(self, horizon=1):
+        # Varianza a random walk: forecast piatto su tutti gli orizzonti
+        return np.full(horizon, self.state['next_sigma2'])
+
+    def persistence(self):
+        return 1.0
+
+
+class HARForecaster(FastForecaster):
+    """
+    HAR-RV sulla varianza realizzata, riscalato sulla varianza dei rendimenti.
+
+    La scala media(r²)/media(RV) sul campione di stima corregge la parte
+    di varianza non catturata dallo stimatore da range (gap overnight).
+    """
+
+    vol_name = 'HAR'
+
+    def __init__(self, returns, rv=None, lags=None):
+        super().__init__(returns, rv)
+        self.lags = list(lags or FAST_VOL_CONFIG['har_lags'])
+        self.coef = None
+        self.scale = 1.0
+
+    @property
+    def params(self):
+        names = ['const'] + [f'rv_{lag}' for lag in self.lags]
+        return pd.Series(np.append(self.coef, self.scale), index=names + ['scale'])
+
+    def _design(self, x):
+        """Regressori [1, RV medio su ogni lag] per ogni t >= max_lag - 1 (somme cumulative, O(n))."""
+        csum = np.concatenate([[0.0], np.cumsum(x)])
+        L = max(self.lags)
+        t = np.arange(L - 1, len(x))
+        cols = [np.ones(len(t))] + [(csum[t + 1] - csum[t + 1 - lag]) / lag for lag in self.lags]
+        return np.column_stack(cols)
+
+    def fit(self, last_obs=None):
+        x = self.rv.values.astype(float)
+        r2 = self.returns.values ** 2
+        n_fit = len(x) if last_obs is None else last_obs
+        L = max(self.lags)
+        if n_fit < L + len(self.lags) + 2:
+            raise ValueError(f"HAR-RV: servono almeno {L + len(self.lags) + 2} sedute (disponibili {n_fit})")
+
+        X = self._design(x)                 # riga i -> regressori a t = L-1+i
+        n_rows = n_fit - L                  # target x(t+1) con t+1 < n_fit
+        self.coef = np.linalg.lstsq(X[:n_rows], x[L:n_fit], rcond=None)[0]
+        self.scale = float(np.mean(r2[:n_fit]) / max(np.mean(x[:n_fit]), 1e-12))
+        floor = HAR_FLOOR * float(np.mean(x[:n_fit]))
+
+        fitted = np.maximum(X @ self.coef, floor)    # forecast di x(t+1) per t = L-1 ... n-1
+        sigma2 = np.empty(len(x))
+        sigma2[:L] = np.mean(x[:L])
+        sigma2[L:] = fitted[:-1]
+        self.sigma2 = self.scale * sigma2
+        self.state = {
+            'vol': 'HAR', 'mu': 0.0, 'lags': self.lags, 'coef': self.coef.tolist(),
+            'scale': self.scale, 'floor': floor,
+            'rv': x[-L:].tolist(),              # ultime max(lags) RV chiuse
+            'next_sigma2': float(self.scale * fitted[-1])
+        }
+        return self
+
+    def forecast_variance(self, horizon=1):
+        """Forecast iterato: le RV future nelle medie sono sostituite dai forecast."""
+        s = self.state
+        hist = list(s['rv'])
+        out = []
+        for _ in range(horizon):
+            f = _har_predict(s, hist)
+            out.append(f)
+            hist.append(f)
+        return s['scale'] * np.array(out)
+
+    def persistence(self):
+        return float(np.sum(self.coef[1:]))
+
+
+def _har_predict(state, hist):
+    """RV prevista per il periodo successivo alla fine di hist (RV in ordine cronologico)."""
+    coef = state['coef']
+    value = coef[0] + sum(b * np.mean(hist[-lag:]) for b, lag in zip(coef[1:], state['lags']))
+    return max(float(value), state['floor'])
+
+
+def advance_state(state, r, rv=None):
+    """
+    Stato dopo una nuova seduta con rendimento r (%) e varianza realizzata rv (%²).
+    Costo costante: EWMA usa solo σ² corrente, HAR le ultime max(lags) RV.
+    """
+    rv = r ** 2 if rv is None else rv
+    if state['vol'] == 'EWMA':
+        lam = state['lam']
+        return {**state, 'next_sigma2': float(lam * state['next_sigma2'] + (1 - lam) * (r - state['mu']) ** 2)}
+    hist = state['rv'][1:] + [rv]
+    return {**state, 'rv': hist, 'next_sigma2': float(state['scale'] * _har_predict(state, hist))}
+
+
+def next_variance(state, r, rv=None):
+    """Varianza (%²) prevista per la seduta successiva a quella con rendimento r (nowcast)."""
+    return advance_state(state, r, rv)['next_sigma2']
+
+
+FAST_MODELS = {
+    'EWMA': EWMAForecaster,
+    'HAR': HARForecaster,
+}
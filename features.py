@@ -0,0 +1,255 @@
+# features.py - Matrice delle features dell'HMM da una pipeline condivisa
+# Kriterion Volatility Monitor
+#
+# Il solo livello di volatilità (Log_Vol) non distingue un rialzo tranquillo
+# da una discesa lenta a volatilità bassa. Qui le features dell'HMM sono una
+# lista configurabile (HMM_FEATURES_CONFIG) e una sola pipeline le assembla,
+# per training, inferenza, bootstrap e nowcast, in una matrice float64
+# contigua (n_obs x n_features):
+#   - ogni colonna grezza del DataFrame è letta una sola volta come array numpy
+#   - ogni feature è una funzione vettoriale su quegli array (medie mobili con
+#     somme cumulative, EMA con un filtro lineare): nessuna operazione pandas
+#     per colonna, il costo cresce con il numero di features e non con
+#     l'overhead degli oggetti
+#   - lo scaler standardizza ogni feature con media e deviazione standard in
+#     cache per impronta della colonna: refit e replay sugli stessi dati non
+#     ricalcolano le statistiche
+# Con più features i tipi di covarianza 'diag' e 'full' diventano modelli
+# diversi e la selezione (models.select_hmm) li confronta entrambi.
+
+import numpy as np
+from scipy.signal import lfilter
+
+from utils import content_hash
+from config import HMM_FEATURES_CONFIG
+
+
+def _ema(x, span):
+    """EMA come pandas ewm(span, adjust=False): y0 = x0, y_t = a x_t + (1-a) y_(t-1)."""
+    if len(x) == 0:
+        return x
+    alpha = 2.0 / (span + 1)
+    y, _ = lfilter([alpha], [1.0, alpha - 1.0], x, zi=[(1 - alpha) * x[0]])
+    return y
+
+
+def _rolling_mean(x, window):
+    """Media mobile con finestra parziale all'inizio (nessun NaN), da somme cumulative."""
+    csum = np.cumsum(x)
+    out = np.empty_like(csum)
+    w = min(window, len(x))
+    out[:w] = csum[:w] / np.arange(1, w + 1)
+    out[w:] = (csum[w:] - csum[:-w]) / w
+    return out
+
+
+def _required(cols, column):
+    if column not in cols:
+        raise ValueError(f"Colonna {column} assente: servono le serie collegate al VIX "
+                         f"(VIX_COMPANIONS_CONFIG)")
+    return cols[column]
+
+
+# Colonne della term structure e serie da cui derivano (Close = VIX in modalità VIX)
+TERM_STRUCTURE_INPUTS = {
+    'TS_Ratio': ('Close', 'VIX3M'),
+    'TS_Slope': ('VIX9D', 'VIX6M'),
+    'VVIX_Vol': ('VVIX',)
+}
+TERM_STRUCTURE_COLUMNS = list(TERM_STRUCTURE_INPUTS)
+
+
+def term_structure(cols):
+    """
+    Colonne derivate dalle serie collegate al VIX (solo quelle con gli input presenti):
+    - TS_Ratio: VIX / VIX3M (> 1 = backwardation, tipica dello stress)
+    - TS_Slope: log(VIX6M / VIX9D), pendenza della curva dal breve al lungo
+    - VVIX_Vol: VVIX in decimale (volatilità implicita del VIX, come GK_Vol)
+    Usata da data_loader.calculate_features e, sulla coda, dal nowcast.
+    """
+    out = {}
+    if 'Close' in cols and 'VIX3M' in cols:
+        out['TS_Ratio'] = cols['Close'] / cols['VIX3M']
+    if 'VIX9D' in cols and 'VIX6M' in cols:
+        out['TS_Slope'] = np.log(cols['VIX6M'] / cols['VIX9D'])
+    if 'VVIX' in cols:
+        out['VVIX_Vol'] = cols['VVIX'] / 100.0
+    return out
+
+
+# Registro delle features: colonne lette (da calculate_features) e funzione sugli array numpy
+FEATURES = {
+    'Log_Vol': (('Log_Vol',), lambda cols, cfg: cols['Log_Vol']),
+    'Returns': (('Returns',), lambda cols, cfg: cols['Returns']),
+    # Rendimento medio recente: direzione del mercato, che Log_Vol non vede
+    'Trend': (('Returns',), lambda cols, cfg: _rolling_mean(cols['Returns'], cfg['trend_window'])),
+    # Range intraday log(H/L) lisciato, in log come Log_Vol
+    'Log_Range': (('High', 'Low'),
+                  lambda cols, cfg: np.log(_ema(np.log(cols['High'] / cols['Low']), cfg['range_span']) + 1e-6)),
+    # Term structure in log: > 0 in backwardation (stress), < 0 in contango
+    'VIX_Ratio': (('TS_Ratio',), lambda cols, cfg: np.log(_required(cols, 'TS_Ratio'))),
+    # Pendenza della curva VIX9D -> VIX6M
+    'TS_Slope': (('TS_Slope',), lambda cols, cfg: _required(cols, 'TS_Slope')),
+    # VVIX reale, in log come Log_Vol
+    'Log_VVIX': (('VVIX_Vol',), lambda cols, cfg: np.log(_required(cols, 'VVIX_Vol')))
+}
+
+
+def vol_index(features):
+    """Colonna che ordina i regimi per volatilità: Log_Vol se presente, altrimenti la prima."""
+    features = list(features)
+    return features.index('Log_Vol') if 'Log_Vol' in features else 0
+
+
+# =============================================================================
+# SCALER
+# =============================================================================
+
+# Media e deviazione standard per (feature, impronta della colonna)
+_stats_cache = {}
+STATS_CACHE_SIZE = 64
+
+
+class FeatureScaler:
+    """
+    Standardizzazione per feature ((x - media) / dev. std), con la stessa
+    interfaccia di sklearn StandardScaler (transform, inverse_transform,
+    mean_, scale_) e l'elenco delle features: il modello addestrato porta
+    con sé la definizione della propria matrice.
+    """
+
+    def __init__(self, features):
+        self.features = tuple(features)
+        self.vol_index = vol_index(self.features)
+        self.mean_ = None
+        self.scale_ = None
+
+    def fit(self, X):
+        X = np.asarray(X, dtype=float)
+        mean = np.empty(X.shape[1])
+        scale = np.empty(X.shape[1])
+        for j, name in enumerate(self.features):
+            col = np.ascontiguousarray(X[:, j])
+            key = (name, content_hash(col))
+            stats = _stats_cache.get(key)
+            if stats is None:
+                std = col.std()
+                stats = (col.mean(), std if std > 0 else 1.0)   # Feature costante: nessuna scala
+                if len(_stats_cache) >= STATS_CACHE_SIZE:
+                    _stats_cache.pop(next(iter(_stats_cache)))
+                _stats_cache[key] = stats
+            mean[j], scale[j] = stats
+        self.mean_, self.scale_ = mean, scale
+        return self
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=float) - self.mean_) / self.scale_
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def inverse_transform(self, X):
+        return np.asarray(X, dtype=float) * self.scale_ + self.mean_
+
+
+# =============================================================================
+# PIPELINE
+# =============================================================================
+
+class FeaturePipeline:
+    """Assembla le features configurate in una matrice float64 contigua."""
+
+    def __init__(self, features=None, config=None):
+        self.config = dict(HMM_FEATURES_CONFIG, **(config or {}))
+        self.features = tuple(features or self.config['features'])
+        unknown = [f for f in self.features if f not in FEATURES]
+        if unknown:
+            raise ValueError(f"Features HMM sconosciute: {unknown} (disponibili: {list(FEATURES)})")
+
+        self.columns = []
+        for name in self.features:
+            self.columns += [c for c in FEATURES[name][0] if c not in self.columns]
+        # Il nowcast ricalcola le colonne della term structure dalle serie di partenza
+        self.tail_columns = list(self.columns)
+        for c in self.columns:
+            self.tail_columns += [i for i in TERM_STRUCTURE_INPUTS.get(c, ()) if i not in self.tail_columns]
+        # Sedute di storia per ricalcolare l'ultima riga (finestre e memoria delle EMA)
+        self.lookback = max(self.config['trend_window'], 10 * self.config['range_span']) + 1
+
+    def arrays(self, df):
+        """Colonne grezze disponibili come array float64 (una lettura per colonna)."""
+        return {c: df[c].to_numpy(dtype=float) for c in self.columns if c in df.columns}
+
+    def matrix(self, data):
+        """
+        Parameters:
+        -----------
+        data : pd.DataFrame or dict
+            Features di calculate_features, o colonne grezze già estratte (arrays)
+
+        Returns:
+        --------
+        np.ndarray
+            Matrice (n_obs x n_features) C-contigua, colonne nell'ordine di features
+        """
+        X = self._compute(data)
+        if not np.isfinite(X).all():
+            # Tipicamente una serie collegata con storico più corto della principale
+            missing = [f for j, f in enumerate(self.features) if not np.isfinite(X[:, j]).all()]
+            raise ValueError(f"Features HMM con valori mancanti: {missing}")
+        return X
+
+    def _compute(self, data):
+        cols = self.arrays(data) if hasattr(data, 'columns') else data
+        n = len(next(iter(cols.values())))
+        X = np.empty((n, len(self.features)), dtype=float)
+        for j, name in enumerate(self.features):
+            X[:, j] = FEATURES[name][1](cols, self.config)
+        return X
+
+    def first_complete(self, df):
+        """
+        Posizione della prima seduta con tutte le features finite: le serie
+        collegate al VIX partono dopo la principale (VIX3M/VVIX ~2007, VIX9D 2011)
+        e lo storico usato dall'HMM va tagliato lì (vedi calculate_features).
+        """
+        if any(c not in df.columns for c in self.columns):
+            return 0        # Colonne assenti: l'errore esplicito è di matrix
+        complete = np.isfinite(self._compute(df)).all(axis=1)
+        if not complete.any():
+            raise ValueError(f"Nessuna seduta con tutte le features HMM {list(self.features)}")
+        return int(np.argmax(complete))
+
+    def fit_scaler(self, X):
+        return FeatureScaler(self.features).fit(X)
+
+    def tail(self, df):
+        """Ultime lookback sedute delle colonne grezze e delle serie di partenza (stato per il nowcast)."""
+        return {c: df[c].to_numpy(dtype=float)[-self.lookback:].copy()
+                for c in self.tail_columns if c in df.columns}
+
+    def advance(self, tail, bar, log_vol, prev_close):
+        """
+        Riga di features (non standardizzata) di una nuova barra, anche
+        parziale, dalla coda dello storico: stessa logica dell'ultima riga di matrix.
+
+        Parameters:
+        -----------
+        tail : dict
+            Colonne grezze delle ultime sedute (vedi tail)
+        bar : dict
+            Open, High, Low, Close della barra (ed eventuali colonne extra, es. VIX3M)
+        log_vol : float
+            Log_Vol della barra (data_loader.advance_features)
+        prev_close : float
+            Chiusura dell'ultima seduta completa
+        """
+        new = {'Log_Vol': log_vol, 'Returns': np.log(bar['Close'] / prev_close)}
+        cols = {}
+        for c, values in tail.items():
+            # Colonne senza valore nella barra (es. VIX3M): ultimo valore noto
+            value = new[c] if c in new else bar.get(c, values[-1])
+            cols[c] = np.append(values, float(value))
+        # Term structure con la chiusura della barra (stessa funzione di calculate_features)
+        cols.update({c: v for c, v in term_structure(cols).items() if c in cols})
+        return self.matrix(cols)[-1]
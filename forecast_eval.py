@@ -0,0 +1,390 @@
+# forecast_eval.py - Valutazione fuori campione dei forecast di volatilità
+# Kriterion Volatility Monitor
+#
+# Il forecast 1-step mostrato nella dashboard non era mai confrontato con ciò
+# che si è poi realizzato. Ogni run del job registra qui (SQLite) il forecast
+# di varianza per la seduta successiva di ogni modello dello zoo e del forecast
+# pubblicato; quando la seduta si chiude la riga riceve la varianza realizzata
+# (Garman-Klass, o rendimento al quadrato per il VIX: vedi fast_vol.realized_variance).
+# Ogni giorno si aggiunge quindi una riga per modello, senza backtest da rifare.
+#
+# Fonti dei forecast nel registro:
+#   - 'live': forecast registrato dal job prima dell'esito
+#   - 'oos':  semina al primo run con le σ² 1-step fuori campione della QLIKE
+#             rolling dello zoo (vol_models.fit_spec, finestra oos_window); per
+#             il forecast pubblicato i pesi sono stimati sulla stessa finestra
+#   - 'backfill': varianze in campione dei registri seminati prima delle
+#             righe 'oos' (parametri stimati sull'intero campione), non più scritte
+# La valutazione usa di default solo le fonti fuori campione (OUT_OF_SAMPLE).
+#
+# Metriche (vettoriali sulle serie allineate):
+#   - perdite QLIKE e MSE, medie e mobili
+#   - regressione di Mincer-Zarnowitz RV = a + b·forecast con test a=0, b=1
+#   - test di Diebold-Mariano contro il benchmark (varianza di Newey-West)
+#
+# Uso:
+#   python forecast_eval.py [--source live|oos|backfill] [--window 63]
+
+import os
+import sys
+import sqlite3
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from fast_vol import realized_variance
+from market_calendar import get_calendar
+from config import TICKER, FORECAST_EVAL_CONFIG
+
+PUBLISHED = 'Pubblicato'        # Nome del forecast pubblicato (combinazione dello zoo) nel registro
+OUT_OF_SAMPLE = ('live', 'oos')  # Fonti valutate di default (vedi intestazione)
+# Una riga è sostituita solo da una fonte con priorità maggiore
+SOURCE_PRIORITY = {'backfill': 0, 'oos': 1, 'live': 2}
+
+
+def _priority_sql(column):
+    cases = ' '.join(f"WHEN '{source}' THEN {p}" for source, p in SOURCE_PRIORITY.items())
+    return f"(CASE {column} {cases} ELSE 0 END)"
+
+
+# =============================================================================
+# REGISTRO DEI FORECAST
+# =============================================================================
+
+class ForecastLog:
+    """
+    Registro SQLite dei forecast 1-step: una riga per (ticker, modello, seduta obiettivo).
+
+    Un forecast 'live' non viene mai riscritto (è quello emesso prima dell'esito)
+    e sostituisce un eventuale forecast 'oos' o 'backfill' per la stessa seduta;
+    un forecast 'oos' sostituisce un 'backfill' in campione.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or FORECAST_EVAL_CONFIG['path']
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS forecasts (
+                    ticker TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    target_date TEXT NOT NULL,
+                    variance REAL NOT NULL,
+                    realized REAL,
+                    source TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (ticker, model, target_date)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_forecasts_pending ON forecasts(ticker, realized)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def count(self, ticker, sources=None):
+        query, params = "SELECT COUNT(*) FROM forecasts WHERE ticker = ?", [ticker]
+        if sources:
+            query += f" AND source IN ({', '.join('?' * len(sources))})"
+            params += list(sources)
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+    def add(self, ticker, rows, source):
+        """
+        Registra forecast (modello, seduta obiettivo ISO, varianza %²).
+        Ritorna il numero di righe inserite o aggiornate.
+        """
+        created_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        values = [(ticker, model, target, float(var), source, created_at) for model, target, var in rows]
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany(f"""
+                INSERT INTO forecasts (ticker, model, target_date, variance, source, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ticker, model, target_date) DO UPDATE SET
+                    variance = excluded.variance, source = excluded.source, created_at = excluded.created_at
+                WHERE {_priority_sql('forecasts.source')} < {_priority_sql('excluded.source')}
+            """, values)
+            return conn.total_changes - before
+
+    def pending_dates(self, ticker):
+        """Sedute obiettivo ancora senza varianza realizzata."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT target_date FROM forecasts WHERE ticker = ? AND realized IS NULL",
+                (ticker,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def set_realized(self, ticker, realized):
+        """Completa le righe in attesa con la varianza realizzata ({data ISO: %²}). Ritorna le righe aggiornate."""
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE forecasts SET realized = ? WHERE ticker = ? AND target_date = ? AND realized IS NULL",
+                [(float(v), ticker, d) for d, v in realized.items()]
+            )
+            return conn.total_changes - before
+
+    def frame(self, ticker, source=None):
+        """
+        Forecast valutabili (con esito) allineati per seduta, delle fonti
+        indicate (una o una sequenza; None: tutte).
+
+        Returns:
+        --------
+        tuple
+            (DataFrame sedute x modelli delle varianze previste, Series della varianza realizzata)
+        """
+        query = "SELECT model, target_date, variance, realized FROM forecasts WHERE ticker = ? AND realized IS NOT NULL"
+        params = [ticker]
+        if source:
+            sources = [source] if isinstance(source, str) else list(source)
+            query += f" AND source IN ({', '.join('?' * len(sources))})"
+            params += sources
+        with self._connect() as conn:
+            rows = pd.read_sql_query(query, conn, params=params)
+        forecast = rows.pivot(index='target_date', columns='model', values='variance').sort_index()
+        forecast.columns.name = None
+        realized = rows.groupby('target_date')['realized'].first().reindex(forecast.index)
+        return forecast, realized
+
+
+def model_forecasts(garch_result):
+    """Varianze 1-step per modello (vedi VolatilityForecast.forecasts) più il forecast pubblicato."""
+    return {
+        **garch_result.forecasts,
+        PUBLISHED: {'sigma2': garch_result.conditional_volatility ** 2,
+                    'oos_sigma2': garch_result.oos_variance(),
+                    'next': float(garch_result.variance(1)[0])}
+    }
+
+
+def update_log(df, garch_result, ticker=None, log=None):
+    """
+    Aggiornamento incrementale del job: esiti delle sedute in attesa e
+    forecast di ogni modello per la prossima seduta.
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Features fino all'ultima seduta chiusa
+    garch_result : vol_models.VolatilityForecast
+    ticker : str, optional
+        Default: TICKER di config
+    log : ForecastLog, optional
+
+    Returns:
+    --------
+    dict
+        added (forecast registrati), realized (esiti completati), target_date
+    """
+    ticker = ticker or TICKER
+    log = log or ForecastLog()
+    forecasts = model_forecasts(garch_result)
+
+    added = 0
+    if FORECAST_EVAL_CONFIG['backfill'] and log.count(ticker, OUT_OF_SAMPLE) == 0:
+        # Solo σ² fuori campione (QLIKE rolling dello zoo): nessuna semina senza finestra di valutazione
+        for name, f in forecasts.items():
+            sigma2 = f.get('oos_sigma2')
+            if sigma2 is None:
+                continue
+            added += log.add(ticker, zip([name] * len(sigma2), sigma2.index.strftime('%Y-%m-%d'), sigma2.values),
+                             'oos')
+
+    rv = pd.Series(realized_variance(df).values, index=df.index.strftime('%Y-%m-%d'))
+    pending = [d for d in log.pending_dates(ticker) if d in rv.index]
+    realized = log.set_realized(ticker, rv.loc[pending].to_dict())
+
+    target = get_calendar().next_session(df.index[-1]).isoformat()
+    added += log.add(ticker, [(name, target, f['next']) for name, f in forecasts.items()], 'live')
+    return {'added': added, 'realized': realized, 'target_date': target}
+
+
+# =============================================================================
+# METRICHE
+# =============================================================================
+
+def losses(forecast, realized, kind='qlike'):
+    """Perdite per seduta e modello: QLIKE (log σ² + RV/σ²) o MSE ((RV - σ²)²)."""
+    f = forecast.values
+    y = realized.values[:, None]
+    if kind == 'qlike':
+        values = np.log(f) + y / f
+    elif kind == 'mse':
+        values = (y - f) ** 2
+    else:
+        raise ValueError(f"Perdita sconosciuta: {kind}")
+    return pd.DataFrame(values, index=forecast.index, columns=forecast.columns)
+
+
+def newey_west_lags(n_obs):
+    return int(np.floor(4 * (n_obs / 100) ** (2 / 9)))
+
+
+def newey_west_variance(x, lags=None):
+    """Varianza di lungo periodo (kernel di Bartlett) di ogni colonna di x (n_obs x k)."""
+    x = np.asarray(x, dtype=float)
+    n_obs = len(x)
+    lags = newey_west_lags(n_obs) if lags is None else lags
+    u = x - x.mean(axis=0)
+    lrv = (u * u).sum(axis=0) / n_obs
+    for lag in range(1, lags + 1):
+        lrv = lrv + 2 * (1 - lag / (lags + 1)) * (u[lag:] * u[:-lag]).sum(axis=0) / n_obs
+    return lrv
+
+
+def diebold_mariano(loss, benchmark):
+    """
+    Test di Diebold-Mariano di ogni modello contro il benchmark.
+    loss_diff < 0 e p_value piccolo: il modello batte il benchmark.
+    """
+    d = loss.values - loss[[benchmark]].values
+    n_obs = len(d)
+    mean = d.mean(axis=0)
+    se = np.sqrt(newey_west_variance(d) / n_obs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stat = np.where(se > 0, mean / se, np.nan)
+    return pd.DataFrame({
+        'loss_diff': mean,
+        'dm_stat': stat,
+        'dm_p': 2 * stats.norm.sf(np.abs(stat))
+    }, index=loss.columns)
+
+
+def mincer_zarnowitz(forecast, realized):
+    """
+    Regressione RV = a + b·forecast per modello, con test congiunto a=0, b=1
+    (covarianza di Newey-West). Un forecast non distorto ha a≈0, b≈1.
+    """
+    y = realized.values
+    n_obs = len(y)
+    lags = newey_west_lags(n_obs)
+    rows = {}
+    for name in forecast.columns:
+        X = np.column_stack([np.ones(n_obs), forecast[name].values])
+        coef, *_ = np.linalg.lstsq(X, y, rcond=None)
+        resid = y - X @ coef
+        # Covarianza HAC: (X'X)^-1 S (X'X)^-1, S dai prodotti X·e con pesi di Bartlett
+        xtx_inv = np.linalg.inv(X.T @ X)
+        g = X * resid[:, None]
+        S = g.T @ g
+        for lag in range(1, lags + 1):
+            gamma = g[lag:].T @ g[:-lag]
+            S += (1 - lag / (lags + 1)) * (gamma + gamma.T)
+        cov = xtx_inv @ S @ xtx_inv
+        diff = coef - np.array([0.0, 1.0])
+        wald = float(diff @ np.linalg.solve(cov, diff))
+        rows[name] = {
+            'mz_alpha': coef[0],
+            'mz_beta': coef[1],
+            'mz_r2': 1 - resid.var() / y.var(),
+            'mz_p': stats.chi2.sf(wald, 2)
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def evaluate(forecast, realized, window=None, benchmark=None, min_obs=None):
+    """
+    Metriche di valutazione sulle sedute in cui tutti i modelli hanno un forecast.
+
+    Returns:
+    --------
+    dict or None
+        summary (per modello, ordinato per QLIKE), rolling_qlike (perdite mobili),
+        benchmark, n_obs; None se le osservazioni sono meno di min_obs
+    """
+    cfg = FORECAST_EVAL_CONFIG
+    window = window or cfg['rolling_window']
+    min_obs = cfg['min_obs'] if min_obs is None else min_obs
+
+    # Modelli con storia sufficiente, poi solo le sedute comuni a tutti
+    forecast = forecast.loc[:, forecast.notna().sum() >= min_obs]
+    valid = forecast.notna().all(axis=1) & realized.notna() & (forecast > 0).all(axis=1)
+    forecast, realized = forecast[valid], realized[valid]
+    if len(forecast) < min_obs or forecast.shape[1] == 0:
+        return None
+
+    qlike = losses(forecast, realized, 'qlike')
+    mse = losses(forecast, realized, 'mse')
+    summary = pd.DataFrame({'qlike': qlike.mean(), 'mse': mse.mean()})
+    summary = summary.join(mincer_zarnowitz(forecast, realized))
+
+    benchmark = benchmark or cfg['benchmark']
+    if benchmark not in forecast.columns:
+        benchmark = summary['qlike'].idxmin()
+    summary = summary.join(diebold_mariano(qlike, benchmark))
+    summary['n_obs'] = len(forecast)
+
+    return {
+        'summary': summary.sort_values('qlike'),
+        'rolling_qlike': qlike.rolling(window, min_periods=min(window, min_obs)).mean(),
+        'benchmark': benchmark,
+        'n_obs': len(forecast)
+    }
+
+
+def evaluate_log(ticker=None, source=OUT_OF_SAMPLE, log=None, **kwargs):
+    """
+    Valutazione dal registro, di default solo sui forecast fuori campione
+    (None se il registro non ha abbastanza esiti).
+    """
+    log = log or ForecastLog()
+    forecast, realized = log.frame(ticker or TICKER, source=source)
+    if forecast.empty:
+        return None
+    return evaluate(forecast, realized, **kwargs)
+
+
+def evaluate_in_sample(df, garch_result, **kwargs):
+    """Valutazione sulle varianze 1-step in campione dei fit correnti (senza registro, es. dashboard)."""
+    forecasts = model_forecasts(garch_result)
+    forecast = pd.DataFrame({name: f['sigma2'] for name, f in forecasts.items()})
+    realized = realized_variance(df).reindex(forecast.index)
+    return evaluate(forecast, realized, **kwargs)
+
+
+def format_summary(result, top=None):
+    """Righe di testo della classifica (job e CLI)."""
+    summary = result['summary'] if top is None else result['summary'].head(top)
+    lines = []
+    for name, row in summary.iterrows():
+        dm = '   bench' if name == result['benchmark'] else f"DM p {row['dm_p']:.2f}"
+        lines.append(f"{name:<14} QLIKE {row['qlike']:.4f}  MZ b {row['mz_beta']:.2f} "
+                     f"(R² {row['mz_r2']:.2f})  {dm}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Valutazione fuori campione dei forecast di volatilità")
+    parser.add_argument('--ticker', default=TICKER)
+    parser.add_argument('--source', choices=list(SOURCE_PRIORITY),
+                        help="Solo una fonte (default: live e oos, fuori campione)")
+    parser.add_argument('--window', type=int, help="Sedute per le perdite mobili")
+    args = parser.parse_args(argv)
+
+    result = evaluate_log(args.ticker, source=args.source or OUT_OF_SAMPLE, window=args.window)
+    if result is None:
+        print(f"⚠️ Registro forecast insufficiente per {args.ticker} "
+              f"(servono almeno {FORECAST_EVAL_CONFIG['min_obs']} sedute con esito)")
+        return 1
+
+    print(f"📏 Valutazione forecast {args.ticker}: {result['n_obs']} sedute, benchmark {result['benchmark']}")
+    for line in format_summary(result):
+        print(f"   {line}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
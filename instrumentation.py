@@ -0,0 +1,326 @@
+# instrumentation.py - Metriche per stage (tempo, memoria, convergenza, cache)
+# Kriterion Volatility Monitor
+#
+# Le funzioni della pipeline sono decorate con @instrumented: se è attivo un
+# MetricsRecorder (contextvar) ogni chiamata registra tempo wall e info
+# specifiche (iterazioni EM, convergenza, cache hit/miss).
+# Senza recorder attivo il decoratore costa una sola lettura della contextvar.
+#
+# Il picco di memoria per stage usa tracemalloc, che è globale al processo e
+# rallenta le allocazioni (quindi i tempi misurati): è attivo nel job
+# giornaliero (METRICS_CONFIG['trace_memory_sources']), dove un run al giorno
+# paga volentieri qualche punto percentuale sui tempi, e sotto --profile
+# (profiling.profile_call avvia tracemalloc); la dashboard, che si rinfresca
+# in un thread di fondo, non lo usa. Con stage aperti in più thread il picco
+# include le allocazioni degli altri thread ed è marcato peak_mem_approx.
+#
+# Il file metriche ruota oltre METRICS_CONFIG['max_bytes'] (una copia .1) e
+# load_recent_runs legge solo la coda del file.
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import tracemalloc
+import functools
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource         # Solo Unix: su Windows max_rss_mb non è disponibile
+except ImportError:
+    resource = None
+
+from config import METRICS_CONFIG
+
+
+def _max_rss_mb():
+    """Picco RSS del processo in MB (ru_maxrss è in KiB su Linux, in byte su macOS)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 ** 2 if sys.platform == 'darwin' else 1024), 1)
+
+
+_current_recorder = contextvars.ContextVar('kriterion_metrics_recorder', default=None)
+
+# tracemalloc è globale: avviato dal primo recorder che lo richiede e fermato
+# dall'ultimo, mai se avviato da altri (profiling). Thread con stage tracciati aperti.
+_trace_lock = threading.Lock()
+_trace_owners = 0
+_traced_threads = {}
+
+
+def _acquire_tracing():
+    global _trace_owners
+    with _trace_lock:
+        if _trace_owners == 0:
+            if tracemalloc.is_tracing():
+                return False
+            tracemalloc.start()
+        _trace_owners += 1
+        return True
+
+
+def _release_tracing():
+    global _trace_owners
+    with _trace_lock:
+        _trace_owners -= 1
+        if _trace_owners == 0:
+            tracemalloc.stop()
+
+
+def _enter_traced():
+    """Registra uno stage tracciato del thread; True se nessun altro thread ne ha di aperti."""
+    me = threading.get_ident()
+    with _trace_lock:
+        alone = all(t == me for t in _traced_threads)
+        _traced_threads[me] = _traced_threads.get(me, 0) + 1
+        if alone:
+            tracemalloc.reset_peak()
+        return alone, tracemalloc.get_traced_memory()[0]
+
+
+def _exit_traced():
+    """Chiude uno stage tracciato: (picco, solo) con il picco azzerato se il thread è solo."""
+    me = threading.get_ident()
+    with _trace_lock:
+        _traced_threads[me] -= 1
+        if not _traced_threads[me]:
+            del _traced_threads[me]
+        alone = all(t == me for t in _traced_threads)
+        peak = tracemalloc.get_traced_memory()[1]
+        if alone:
+            tracemalloc.reset_peak()
+        return peak, alone
+
+
+class MetricsRecorder:
+    """Raccoglie le metriche degli stage di una singola esecuzione."""
+
+    def __init__(self, source, trace_memory=None):
+        self.source = source
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = datetime.now(timezone.utc)
+        if trace_memory is None:
+            # Default: sorgenti configurate (job giornaliero), config globale o profiling già attivo
+            trace_memory = (METRICS_CONFIG['trace_memory'] or source in METRICS_CONFIG['trace_memory_sources']
+                            or tracemalloc.is_tracing())
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.meta = {}
+        self._local = threading.local()   # Stack degli stage aperti, separato per thread
+        self._t0 = time.perf_counter()
+        self._owns_tracemalloc = _acquire_tracing() if self.trace_memory else False
+
+    @property
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    # ------------------------------------------------------------------
+    # Stage
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Misura un blocco di codice. Il dict restituito accetta campi extra."""
+        info = {'stage': name, **fields}
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            alone_start, mem_start = _enter_traced()
+        frame = {'info': info, 'child_peak': 0}
+        self._stack.append(frame)
+
+        t0 = time.perf_counter()
+        try:
+            yield info
+        except Exception as e:
+            info['error'] = str(e)[:200]
+            raise
+        finally:
+            info['wall_s'] = round(time.perf_counter() - t0, 4)
+            self._stack.pop()
+            if tracing:
+                peak, alone_end = _exit_traced()
+                own_peak = max(peak, frame['child_peak']) - mem_start
+                info['peak_mem_mb'] = round(max(own_peak, 0) / 1024 ** 2, 2)
+                if not (alone_start and alone_end):
+                    info['peak_mem_approx'] = True
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent['child_peak'] = max(parent['child_peak'], peak, frame['child_peak'])
+            info['depth'] = len(self._stack)
+            self.stages.append(info)
+
+    def annotate(self, **fields):
+        """Aggiunge campi allo stage attualmente aperto (il più interno)."""
+        if self._stack:
+            self._stack[-1]['info'].update(fields)
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+
+    def to_record(self, status='ok'):
+        return {
+            'run_id': self.run_id,
+            'source': self.source,
+            'status': status,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'total_s': round(time.perf_counter() - self._t0, 4),
+            'max_rss_mb': _max_rss_mb(),
+            'stages': list(self.stages),
+            **self.meta
+        }
+
+    def save(self, status='ok', path=None):
+        """Chiude il run e accoda il record JSON al file metriche."""
+        record = self.to_record(status)
+        path = path or METRICS_CONFIG['path']
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > METRICS_CONFIG['max_bytes']:
+                os.replace(path, path + '.1')     # Rotazione: una sola copia precedente
+            with open(path, 'a') as fh:
+                fh.write(json.dumps(record, default=str) + '\n')
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare le metriche: {e}")
+        if self._owns_tracemalloc:
+            _release_tracing()
+            self._owns_tracemalloc = False
+        return record
+
+    def summary_lines(self):
+        """Righe testuali (solo stage di primo livello) per i log del job."""
+        return [
+            f"{s['stage']:<22} {s['wall_s']:>8.2f}s"
+            + (f" {s['peak_mem_mb']:>8.1f} MB" if 'peak_mem_mb' in s else '')
+            for s in self.stages if s['depth'] == 0
+        ]
+
+
+# ----------------------------------------------------------------------
+# Recorder attivo
+# ----------------------------------------------------------------------
+
+def start_run(source, trace_memory=None):
+    """Crea un recorder e lo rende attivo nel contesto corrente."""
+    recorder = MetricsRecorder(source, trace_memory=trace_memory)
+    _current_recorder.set(recorder)
+    return recorder
+
+
+@contextmanager
+def use_recorder(recorder):
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+def get_recorder():
+    return _current_recorder.get()
+
+
+@contextmanager
+def stage(name, **fields):
+    """Stage sul recorder attivo; no-op (dict vuoto) se nessun recorder è attivo."""
+    recorder = _current_recorder.get()
+    if recorder is None:
+        yield dict(fields)
+        return
+    with recorder.stage(name, **fields) as info:
+        yield info
+
+
+def annotate(**fields):
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder.annotate(**fields)
+
+
+def instrumented(name, info_fn=None, **defaults):
+    """
+    Decoratore: registra la funzione come stage del recorder attivo.
+    info_fn(result) -> dict permette di estrarre metriche dal risultato.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _current_recorder.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            with recorder.stage(name, **defaults) as info:
+                result = func(*args, **kwargs)
+                if info_fn is not None:
+                    try:
+                        info.update(info_fn(result))
+                    except Exception:
+                        pass
+                return result
+        return wrapper
+    return decorator
+
+
+# ----------------------------------------------------------------------
+# Estrattori specifici dei modelli
+# ----------------------------------------------------------------------
+
+def hmm_fit_info(result):
+    model = result[0]
+    return {
+        'em_iterations': int(model.monitor_.iter),
+        'converged': bool(model.monitor_.converged)
+    }
+
+
+def garch_fit_info(result):
+    res = result[1]
+    opt = getattr(res, 'optimization_result', None)
+    return {
+        'iterations': int(getattr(opt, 'nit', -1)) if opt is not None else None,
+        'converged': res.convergence_flag == 0,
+        'model': getattr(res, 'name', 'GARCH')
+    }
+
+
+# ----------------------------------------------------------------------
+# Lettura storico
+# ----------------------------------------------------------------------
+
+def load_recent_runs(n=None, path=None):
+    """Ultimi n record dal file metriche (più recente per primo)."""
+    n = n or METRICS_CONFIG['history_runs']
+    path = path or METRICS_CONFIG['path']
+    if not os.path.exists(path):
+        return []
+    lines = _tail_lines(path, n)
+    runs = []
+    for line in reversed(lines):
+        try:
+            runs.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return runs
+
+
+def _tail_lines(path, n, block=64 * 1024):
+    """Ultime n righe del file leggendo a blocchi dalla fine (costo indipendente dalla lunghezza)."""
+    with open(path, 'rb') as fh:
+        fh.seek(0, os.SEEK_END)
+        end = pos = fh.tell()
+        data = b''
+        while pos > 0 and data.count(b'\n') <= n:
+            pos = max(0, pos - block)
+            fh.seek(pos)
+            data = fh.read(end - pos)
+    lines = data.decode('utf-8', errors='replace').splitlines()
+    # Con pos > 0 la prima riga può essere parziale
+    return lines[-n:] if pos == 0 else lines[1:][-n:]
@@ -0,0 +1,265 @@
+# market_calendar.py - Calendario di borsa NYSE (festività e chiusure anticipate)
+# Kriterion Volatility Monitor
+#
+# Il cron gira dal lunedì al venerdì, festività comprese, e la freschezza dei
+# dati era decisa confrontando l'ultima barra con "oggi" e una chiusura fissa
+# alle 16:15. Qui le regole NYSE sono calcolate in codice (festività con giorno
+# osservato, Venerdì Santo, Juneteenth dal 2022, chiusure straordinarie) insieme
+# alle chiusure anticipate delle 13:00, e le sedute sono precalcolate in un
+# indice ordinato (datetime64[D]) interrogato con ricerca binaria.
+#
+# Usi principali:
+#   - last_closed_session(): ultima seduta chiusa (probe del job prima di
+#     qualunque download: festivi e run duplicati terminano subito)
+#   - session_complete():    la barra di una data è definitiva?
+#   - is_open():             seduta regolare in corso (nowcast e daemon)
+#
+# Uso:
+#   python market_calendar.py [ANNO]      # festività e chiusure anticipate
+
+import sys
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from config import MARKET_CALENDAR_CONFIG
+
+# Chiusure straordinarie (eventi non ricorrenti)
+SPECIAL_CLOSURES = {
+    date(1994, 4, 27): "Funerali R. Nixon",
+    date(2001, 9, 11): "Attentati 11 settembre",
+    date(2001, 9, 12): "Attentati 11 settembre",
+    date(2001, 9, 13): "Attentati 11 settembre",
+    date(2001, 9, 14): "Attentati 11 settembre",
+    date(2004, 6, 11): "Funerali R. Reagan",
+    date(2007, 1, 2): "Funerali G. Ford",
+    date(2012, 10, 29): "Uragano Sandy",
+    date(2012, 10, 30): "Uragano Sandy",
+    date(2018, 12, 5): "Funerali G.H.W. Bush",
+    date(2025, 1, 9): "Funerali J. Carter",
+}
+
+
+# =============================================================================
+# REGOLE NYSE
+# =============================================================================
+
+def easter(year):
+    """Domenica di Pasqua (calendario gregoriano, algoritmo di Meeus)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    """n-esimo giorno della settimana (0=lunedì) del mese."""
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _last_weekday(year, month, weekday):
+    """Ultimo giorno della settimana (0=lunedì) del mese."""
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    """Festività di sabato anticipata al venerdì, di domenica posticipata al lunedì."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def holidays(year):
+    """
+    Festività NYSE dell'anno.
+
+    Returns:
+    --------
+    dict
+        {data osservata: nome}
+    """
+    days = {}
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:     # Capodanno di sabato non viene recuperato il 31/12
+        days[_observed(new_year)] = "Capodanno"
+    if year >= 1998:
+        days[_nth_weekday(year, 1, 0, 3)] = "Martin Luther King Jr. Day"
+    days[_nth_weekday(year, 2, 0, 3)] = "Presidents' Day"
+    days[easter(year) - timedelta(days=2)] = "Venerdì Santo"
+    days[_last_weekday(year, 5, 0)] = "Memorial Day"
+    if year >= 2022:
+        days[_observed(date(year, 6, 19))] = "Juneteenth"
+    days[_observed(date(year, 7, 4))] = "Independence Day"
+    days[_nth_weekday(year, 9, 0, 1)] = "Labor Day"
+    days[_nth_weekday(year, 11, 3, 4)] = "Thanksgiving"
+    days[_observed(date(year, 12, 25))] = "Natale"
+    days.update({d: name for d, name in SPECIAL_CLOSURES.items() if d.year == year})
+    return days
+
+
+def early_closes(year):
+    """Sedute con chiusura anticipata: 3 luglio, venerdì dopo il Ringraziamento, 24 dicembre."""
+    closed = holidays(year)
+    candidates = [
+        date(year, 7, 3),
+        _nth_weekday(year, 11, 3, 4) + timedelta(days=1),
+        date(year, 12, 24),
+    ]
+    return {d for d in candidates if d.weekday() < 5 and d not in closed}
+
+
+def _parse_time(value):
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def _as_date(value):
+    """Accetta date, datetime, Timestamp o stringa ISO."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return pd.Timestamp(value).date()
+
+
+# =============================================================================
+# CALENDARIO
+# =============================================================================
+
+class MarketCalendar:
+    """Sedute NYSE precalcolate con orari di chiusura (regolare o anticipata)."""
+
+    def __init__(self, first_year=None, last_year=None):
+        cfg = MARKET_CALENDAR_CONFIG
+        self.first_year = first_year or cfg['first_year']
+        self.last_year = last_year or cfg['last_year']
+        self.tz = pytz.timezone(cfg['timezone'])
+        self.open_time = _parse_time(cfg['open'])
+        self.close_time_regular = _parse_time(cfg['close'])
+        self.close_time_early = _parse_time(cfg['early_close'])
+        self.buffer = timedelta(minutes=cfg['close_buffer_minutes'])
+
+        self.holidays = {}
+        self.early_closes = set()
+        for year in range(self.first_year, self.last_year + 1):
+            self.holidays.update(holidays(year))
+            self.early_closes |= early_closes(year)
+
+        # Indice delle sedute: giorni feriali meno le festività
+        days = np.arange(np.datetime64(f'{self.first_year}-01-01'),
+                         np.datetime64(f'{self.last_year + 1}-01-01'), dtype='datetime64[D]')
+        closed = np.array(sorted(self.holidays), dtype='datetime64[D]')
+        self.sessions = days[np.is_busday(days, weekmask='1111100') & ~np.isin(days, closed)]
+
+    def _locate(self, day):
+        day = _as_date(day)
+        if not self.first_year <= day.year <= self.last_year:
+            raise ValueError(f"Data {day} fuori dal calendario ({self.first_year}-{self.last_year})")
+        key = np.datetime64(day, 'D')
+        return key, int(np.searchsorted(self.sessions, key))
+
+    def _session(self, i):
+        return self.sessions[i].astype(object)
+
+    def is_session(self, day):
+        key, i = self._locate(day)
+        return i < len(self.sessions) and self.sessions[i] == key
+
+    def previous_session(self, day):
+        """Ultima seduta strettamente precedente a day."""
+        _, i = self._locate(day)
+        return self._session(i - 1)
+
+    def next_session(self, day):
+        """Prima seduta strettamente successiva a day."""
+        key, i = self._locate(day)
+        if i < len(self.sessions) and self.sessions[i] == key:
+            i += 1
+        return self._session(i)
+
+    def sessions_between(self, start, end):
+        """Sedute nell'intervallo [start, end]."""
+        _, i = self._locate(start)
+        key, j = self._locate(end)
+        if j < len(self.sessions) and self.sessions[j] == key:
+            j += 1
+        return [self._session(k) for k in range(i, j)]
+
+    def holiday_name(self, day):
+        return self.holidays.get(_as_date(day))
+
+    def close_time(self, day):
+        """Orario di chiusura della seduta (13:00 nelle chiusure anticipate)."""
+        return self.close_time_early if _as_date(day) in self.early_closes else self.close_time_regular
+
+    def session_close(self, day):
+        """Chiusura della seduta come datetime localizzato a New York."""
+        day = _as_date(day)
+        return self.tz.localize(datetime.combine(day, self.close_time(day)))
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def _to_local(self, now):
+        if now is None:
+            return self.now()
+        if now.tzinfo is None:
+            return self.tz.localize(now)
+        return now.astimezone(self.tz)
+
+    def is_open(self, now=None):
+        """True durante la seduta regolare (esclusi festivi, chiusura anticipata inclusa)."""
+        now = self._to_local(now)
+        today = now.date()
+        return (self.is_session(today)
+                and self.open_time <= now.time() < self.close_time(today))
+
+    def last_closed_session(self, now=None):
+        """Ultima seduta la cui chiusura (più il buffer di pubblicazione) è già passata."""
+        now = self._to_local(now)
+        today = now.date()
+        if self.is_session(today) and now >= self.session_close(today) + self.buffer:
+            return today
+        return self.previous_session(today)
+
+    def session_complete(self, day, now=None):
+        """True se la barra della data è definitiva (seduta chiusa da almeno il buffer)."""
+        return _as_date(day) <= self.last_closed_session(now)
+
+
+@lru_cache(maxsize=1)
+def get_calendar():
+    """Calendario condiviso (l'indice delle sedute viene calcolato una sola volta)."""
+    return MarketCalendar()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    year = int(argv[0]) if argv else date.today().year
+    cal = get_calendar()
+
+    print(f"📅 Calendario NYSE {year}")
+    for day, name in sorted(holidays(year).items()):
+        print(f"   {day} {day.strftime('%a')}  🚫 {name}")
+    for day in sorted(early_closes(year)):
+        print(f"   {day} {day.strftime('%a')}  🕐 Chiusura anticipata {cal.close_time(day).strftime('%H:%M')}")
+    print(f"   Sedute: {len(cal.sessions_between(date(year, 1, 1), date(year, 12, 31)))}")
+    print(f"   Ultima seduta chiusa: {cal.last_closed_session()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
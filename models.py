@@ -1,10 +1,16 @@
 # models.py
+import multiprocessing
+
 import numpy as np
 import pandas as pd
 from hmmlearn import hmm
-from arch import arch_model
-from sklearn.preprocessing import StandardScaler
-from config import HMM_PARAMS, GARCH_PARAMS, REGIME_LABELS
+from instrumentation import instrumented, annotate, hmm_fit_info, garch_fit_info
+from shared_cache import get_shared_cache, cache_key
+from vol_models import fit_vol_models
+from stages import process_pool
+from fast_vol import realized_variance
+from features import FeaturePipeline
+from config import HMM_PARAMS, HMM_SELECTION_CONFIG, GARCH_PARAMS, REGIME_LABELS
 
 # =============================================================================
 # MONKEY PATCH ROBUSTO
@@ -18,12 +24,143 @@ try:
 except Exception as e:
     print(f"Warning: Impossibile applicare patch hmmlearn: {e}")
 
+# =============================================================================
+# SELEZIONE MODELLO HMM
+# =============================================================================
+
+# Risultati della selezione già calcolati in questo processo (per impronta dei dati)
+_selection_cache = {}
+SELECTION_CACHE_SIZE = 8
+
+
+def _make_hmm(n_states, covariance_type):
+    return hmm.GaussianHMM(
+        n_components=n_states,
+        covariance_type=covariance_type,
+        n_iter=HMM_PARAMS['n_iter'],
+        random_state=HMM_PARAMS['random_state'],
+        init_params='stmc'
+    )
+
+
+def _fit_candidate(X, n_states, covariance_type, n_obs):
+    """Fit di un candidato della griglia sulle prime n_obs osservazioni (worker di processo)."""
+    try:
+        return _make_hmm(n_states, covariance_type).fit(X[:n_obs])
+    except Exception as e:      # Candidato degenerato (es. covarianza singolare): escluso
+        return e
+
+
+def _candidate_grid(X):
+    cfg = HMM_SELECTION_CONFIG
+    cov_types = list(cfg['covariance_types'])
+    if X.shape[1] == 1:
+        # Con una sola feature tutti i tipi di covarianza sono lo stesso modello
+        cov_types = cov_types[:1]
+    return [(n, cov) for n in cfg['n_states'] for cov in cov_types]
+
+
+def _run_selection(X):
+    cfg = HMM_SELECTION_CONFIG
+    grid = _candidate_grid(X)
+    n_train = int(len(X) * (1 - cfg['holdout_fraction']))
+
+    # Ogni candidato richiede due fit indipendenti (campione intero e training
+    # senza la coda di holdout): tutti i fit vanno nello stesso pool
+    tasks = [(n, cov, n_obs) for n, cov in grid for n_obs in (len(X), n_train)]
+    args = [[X] * len(tasks)] + [list(col) for col in zip(*tasks)]
+
+    # Dentro un processo figlio (es. replay parallelo) la griglia resta sequenziale
+    workers = min(cfg['workers'], len(tasks))
+    if workers > 1 and multiprocessing.parent_process() is None:
+        fits = list(process_pool(workers).map(_fit_candidate, *args))
+    else:
+        fits = list(map(_fit_candidate, *args))
+
+    table, models = [], []
+    for (n, cov), full, train in zip(grid, fits[0::2], fits[1::2]):
+        if isinstance(full, Exception) or isinstance(train, Exception):
+            error = full if isinstance(full, Exception) else train
+            print(f"   ⚠️ HMM {n} stati ({cov}) escluso: {error}")
+            continue
+        # Log-likelihood predittiva della coda: log p(x_1..T) - log p(x_1..n_train)
+        holdout_ll = (train.score(X) - train.score(X[:n_train])) / (len(X) - n_train)
+        table.append({
+            'n_states': n,
+            'covariance_type': cov,
+            'log_likelihood': float(full.score(X)),
+            'bic': float(full.bic(X)),
+            'aic': float(full.aic(X)),
+            'holdout_ll': float(holdout_ll),
+            'converged': bool(full.monitor_.converged)
+        })
+        models.append(full)
+
+    if not table:
+        raise RuntimeError("Selezione HMM fallita: nessun candidato valido")
+
+    # BIC/AIC: minimo; holdout: massimo. A parità vince il candidato più semplice (ordine griglia)
+    criterion = cfg['criterion']
+    scores = [-row['holdout_ll'] if criterion == 'holdout' else row[criterion] for row in table]
+    best = int(np.argmin(scores))
+    return {'model': models[best], 'criterion': criterion, 'best': table[best], 'table': table}
+
+
+def clear_selection_cache():
+    """Svuota la cache in processo della selezione (es. per misurare i tempi reali)."""
+    _selection_cache.clear()
+
+
+@instrumented('select_hmm')
+def select_hmm(X):
+    """
+    Sceglie numero di stati e tipo di covarianza dell'HMM sui dati.
+
+    Fitta in parallelo la griglia di HMM_SELECTION_CONFIG e ordina i candidati
+    per BIC, AIC o log-likelihood fuori campione (coda di holdout). Il
+    risultato è in cache per impronta dei dati e configurazione: in processo
+    e, se attiva, nella cache condivisa.
+
+    Parameters:
+    -----------
+    X : np.ndarray
+        Features standardizzate (n_obs x n_features)
+
+    Returns:
+    --------
+    dict
+        model (HMM scelto, fittato su tutto il campione), criterion, best
+        (riga del candidato scelto) e table (punteggi di tutti i candidati)
+    """
+    key = cache_key('hmm_selection', X, HMM_SELECTION_CONFIG, HMM_PARAMS)
+    result = _selection_cache.get(key)
+    hit = result is not None
+    if not hit:
+        result, hit = get_shared_cache().get_or_compute(key, lambda: _run_selection(X))
+        if len(_selection_cache) >= SELECTION_CACHE_SIZE:
+            _selection_cache.pop(next(iter(_selection_cache)))
+        _selection_cache[key] = result
+
+    best = result['best']
+    annotate(cache_hit=hit, n_states=best['n_states'], covariance_type=best['covariance_type'],
+             candidates=len(result['table']))
+    if not hit:
+        print(f"🔎 Selezione HMM ({result['criterion'].upper()}): {best['n_states']} stati, "
+              f"covarianza {best['covariance_type']} su {len(result['table'])} candidati")
+    return result
+
+
 # =============================================================================
 # FUNZIONI MODELLI
 # =============================================================================
 
+@instrumented('train_hmm', info_fn=hmm_fit_info)
 def train_hmm(df):
-    """Addestra il modello HMM sui dati forniti."""
+    """
+    Addestra il modello HMM sui dati forniti.
+    Con HMM_SELECTION_CONFIG['enabled'] il numero di stati e il tipo di
+    covarianza sono scelti dai dati (select_hmm), altrimenti da HMM_PARAMS.
+    """
     
     # Inizializziamo mapping a None per evitare NameError in caso di crash parziale
     mapping = None
@@ -31,25 +168,23 @@ def train_hmm(df):
     # 1. Preparazione Dati
     # MODIFICA: Usiamo la Log-Volatility invece della Volatilità pura.
     # Questo rende la distribuzione più simile a una Gaussiana, aiutando l'HMM.
-    X = df[['Log_Vol']].values
-    
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+    # Le features (Log_Vol di default) sono in HMM_FEATURES_CONFIG: una matrice
+    # contigua dalla pipeline condivisa, standardizzata colonna per colonna
+    pipeline = FeaturePipeline()
+    X = pipeline.matrix(df)
     
-    # 2. Configurazione
-    model = hmm.GaussianHMM(
-        n_components=HMM_PARAMS['n_states'],
-        covariance_type=HMM_PARAMS['covariance_type'],
-        n_iter=HMM_PARAMS['n_iter'],
-        random_state=HMM_PARAMS['random_state'],
-        init_params='stmc'
-    )
+    scaler = pipeline.fit_scaler(X)
+    X_scaled = scaler.transform(X)
     
-    # 3. Training
-    model.fit(X_scaled)
+    # 2. Configurazione e Training
+    if HMM_SELECTION_CONFIG['enabled']:
+        model = select_hmm(X_scaled)['model']
+    else:
+        model = _make_hmm(HMM_PARAMS['n_states'], HMM_PARAMS['covariance_type'])
+        model.fit(X_scaled)
     
-    # 4. Calcolo Mapping (Regime 0=Low, 1=Med, 2=High)
-    means = model.means_.flatten()
+    # 3. Calcolo Mapping (Regime 0=Low ... K-1=High, per volatilità media crescente)
+    means = model.means_[:, scaler.vol_index]
     sorted_idx = np.argsort(means)
     
     # Creazione dizionario mapping
@@ -60,11 +195,12 @@ def train_hmm(df):
     return model, scaler, mapping
 
 
+@instrumented('get_hmm_states')
 def get_hmm_states(df, model, scaler, mapping):
     """Inferenza degli stati HMM."""
     
-    # MODIFICA: Coerenza con il training, usiamo Log_Vol
-    X = df[['Log_Vol']].values
+    # MODIFICA: Coerenza con il training, stesse features del modello addestrato
+    X = FeaturePipeline(scaler.features).matrix(df)
     X_scaled = scaler.transform(X)
     
     hidden_states = model.predict(X_scaled)
@@ -86,25 +222,25 @@ def get_hmm_states(df, model, scaler, mapping):
     return mapped_states, mapped_posteriors
 
 
+def ordered_transmat(model, mapping):
+    """Matrice di transizione con stati riordinati per volatilità crescente (come get_hmm_states)."""
+    order = [orig for orig, _ in sorted(mapping.items(), key=lambda kv: kv[1])]
+    return model.transmat_[np.ix_(order, order)]
+
+
+@instrumented('train_garch', info_fn=garch_fit_info)
 def train_garch(df):
-    """Addestra GARCH(1,1) e fa previsione 1-step ahead."""
+    """
+    Addestra lo zoo di modelli GARCH (vedi vol_models) e fa previsione 1-step ahead.
+    Ritorna la volatilità annualizzata pubblicata e il VolatilityForecast.
+    """
     returns_pct = df['Returns'] * 100
     
     window = GARCH_PARAMS['window_size']
     train_data = returns_pct.iloc[-window:]
+    rv = realized_variance(df).iloc[-window:]
     
-    model = arch_model(
-        train_data,
-        p=GARCH_PARAMS['p'],
-        q=GARCH_PARAMS['q'],
-        dist=GARCH_PARAMS['dist'],
-        vol='Garch'
-    )
-    
-    res = model.fit(disp='off')
-    
-    forecast = res.forecast(horizon=1)
-    var_forecast = forecast.variance.values[-1, 0]
-    vol_forecast_ann = np.sqrt(var_forecast) / 100 * np.sqrt(252)
+    res = fit_vol_models(train_data, rv)
+    vol_forecast_ann = res.vol_ann()
     
     return vol_forecast_ann, res
@@ -1,8 +1,10 @@
 # notifications.py - Sistema di Notifiche Telegram v2.0
 # Kriterion Volatility Monitor
 
-import requests
+import telegram_delivery
+from telegram_delivery import get_chat_ids
 from utils import get_secret
+from instrumentation import instrumented
 from config import SIGNAL_CONFIG, REGIME_LABELS
 
 def format_message(date, price, hmm_probs, garch_vol, regime_label, signal_type, trend_prob):
@@ -99,7 +101,8 @@ def format_message(date, price, hmm_probs, garch_vol, regime_label, signal_type,
 
 
 def format_daily_report(date, price, hmm_probs, garch_vol, regime_label, 
-                        signal_type, trend_prob, daily_return=None):
+                        signal_type, trend_prob, daily_return=None, term_structure=None,
+                        regime_outlook=None, uncertainty=None):
     """
     Formatta un report giornaliero più completo.
     
@@ -108,6 +111,12 @@ def format_daily_report(date, price, hmm_probs, garch_vol, regime_label,
     Stessi di format_message, più:
     daily_return : float, optional
         Rendimento giornaliero
+    term_structure : dict, optional
+        Volatilità media integrata per tenor (vedi VolatilityForecast.term_structure)
+    regime_outlook : dict, optional
+        horizon, p_high_ahead, hit_high, expected_duration (vedi regime_forecast)
+    uncertainty : list of str, optional
+        Bande bootstrap già formattate (vedi bootstrap.format_bands)
         
     Returns:
     --------
@@ -132,6 +141,30 @@ def format_daily_report(date, price, hmm_probs, garch_vol, regime_label,
         ret_str = "N/A"
         ret_icon = "📊"
     
+    # Curva dei forecast per tenor
+    if term_structure:
+        curve = " · ".join(f"{label} {vol*100:.1f}%" for label, vol in term_structure.items())
+        garch_lines = f"├ Vol (1-step): {garch_vol*100:.2f}%\n└ Curva: {curve}"
+    else:
+        garch_lines = f"└ Vol (1-step): {garch_vol*100:.2f}%"
+    
+    # Previsioni dei regimi dalla matrice di transizione
+    if regime_outlook:
+        h = regime_outlook['horizon']
+        hmm_lines = (f"├ Trend: {trend_prob*100:+.1f}%\n"
+                     f"├ P(High) a {h}gg: {regime_outlook['p_high_ahead']*100:.1f}% · "
+                     f"ingresso entro {h}gg: {regime_outlook['hit_high']*100:.1f}%\n"
+                     f"└ Durata residua attesa: {regime_outlook['expected_duration']:.0f} sedute")
+    else:
+        hmm_lines = f"└ Trend: {trend_prob*100:+.1f}%"
+    
+    # Bande di incertezza di stima (bootstrap)
+    if uncertainty:
+        rows = [f"├ {line}" for line in uncertainty[:-1]] + [f"└ {uncertainty[-1]}"]
+        uncertainty_block = "\n<b>🎯 Incertezza (bootstrap 90%)</b>\n" + "\n".join(rows) + "\n"
+    else:
+        uncertainty_block = ""
+    
     # Probabilità dominante
     probs_dict = {'Low': hmm_probs[0], 'Medium': hmm_probs[1], 'High': hmm_probs[2]}
     dominant = max(probs_dict, key=probs_dict.get)
@@ -151,11 +184,11 @@ def format_daily_report(date, price, hmm_probs, garch_vol, regime_label,
 ├ P(Low): {hmm_probs[0]*100:.1f}%
 ├ P(Med): {hmm_probs[1]*100:.1f}%
 ├ P(High): {hmm_probs[2]*100:.1f}%
-└ Trend: {trend_prob*100:+.1f}%
+{hmm_lines}
 
 <b>📉 GARCH Forecast</b>
-└ Vol (1-step): {garch_vol*100:.2f}%
-
+{garch_lines}
+{uncertainty_block}
 <b>💡 Azione</b>
 {action}
 
@@ -169,9 +202,86 @@ def format_daily_report(date, price, hmm_probs, garch_vol, regime_label,
     return msg.strip()
 
 
+def format_change_alert(events):
+    """
+    Intestazione degli alert generati da un cambiamento (vedi alert_policy).
+    
+    Parameters:
+    -----------
+    events : list of str
+        Descrizione dei cambiamenti rispetto al run precedente
+        
+    Returns:
+    --------
+    str
+        Intestazione formattata HTML
+    """
+    
+    lines = "\n".join(f"• {e}" for e in events)
+    msg = f"""
+<b>🔔 CAMBIO DI SCENARIO</b>
+{lines}
+"""
+    
+    return msg.strip()
+
+
+def format_weekly_digest(ticker, runs):
+    """
+    Formatta il riepilogo settimanale dei giorni senza cambiamenti rilevanti.
+    
+    Parameters:
+    -----------
+    ticker : str
+        Ticker monitorato
+    runs : list of dict
+        Run della settimana (formato SignalStore), in ordine cronologico
+        
+    Returns:
+    --------
+    str
+        Digest formattato HTML
+    """
+    
+    last = runs[-1]
+    signal_info = SIGNAL_CONFIG.get(last['signal'], SIGNAL_CONFIG['NEUTRAL'])
+    p_high = [r['p_high'] for r in runs if r.get('p_high') is not None]
+    garch = [r['garch_vol'] for r in runs if r.get('garch_vol') is not None]
+    
+    rows = "\n".join(
+        f"{SIGNAL_CONFIG.get(r['signal'], SIGNAL_CONFIG['NEUTRAL'])['icon']} "
+        f"{r['market_date']}  {r['signal']}  P(High) {r['p_high']*100:.0f}%"
+        for r in runs
+    )
+    
+    msg = f"""
+<b>🗓️ KRITERION WEEKLY DIGEST</b>
+<b>━━━━━━━━━━━━━━━━━━━━━━━━━</b>
+
+📈 {ticker} | {runs[0]['market_date']} → {last['market_date']} ({len(runs)} sedute)
+
+<b>⚡ Segnale attuale: {signal_info['icon']} {last['signal']}</b>
+🤖 Regime: {last['regime']}
+
+<b>📊 Settimana</b>
+{rows}
+
+├ P(High) min/max: {min(p_high)*100:.1f}% / {max(p_high)*100:.1f}%
+└ GARCH Vol min/max: {min(garch)*100:.2f}% / {max(garch)*100:.2f}%
+
+<b>━━━━━━━━━━━━━━━━━━━━━━━━━</b>
+<i>#KriterionQuant #Volatility #Digest</i>
+"""
+    
+    return msg.strip()
+
+
+@instrumented('send_telegram_alert')
 def send_telegram_alert(message, parse_mode='HTML'):
     """
-    Invia il messaggio al canale Telegram configurato.
+    Invia il messaggio a tutte le chat/canali configurati (in parallelo, con
+    rate limit e retry). I messaggi non consegnati restano in outbox e vengono
+    reinviati al run successivo.
     
     Parameters:
     -----------
@@ -183,52 +293,28 @@ def send_telegram_alert(message, parse_mode='HTML'):
     Returns:
     --------
     bool
-        True se invio riuscito, False altrimenti
+        True se il messaggio è stato consegnato a tutti i destinatari
     """
     
-    bot_token = get_secret('TELEGRAM_BOT_TOKEN')
-    chat_id = get_secret('TELEGRAM_CHAT_ID')
+    chat_ids = get_chat_ids()
 
-    if not bot_token or not chat_id:
+    if not get_secret('TELEGRAM_BOT_TOKEN') or not chat_ids:
         print("⚠️ Credenziali Telegram mancanti. Messaggio non inviato.")
-        print("   Configura TELEGRAM_BOT_TOKEN e TELEGRAM_CHAT_ID nei secrets.")
+        print("   Configura TELEGRAM_BOT_TOKEN e TELEGRAM_CHAT_IDS (o TELEGRAM_CHAT_ID) nei secrets.")
         return False
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    
-    payload = {
-        'chat_id': chat_id,
-        'text': message,
-        'parse_mode': parse_mode,
-        'disable_web_page_preview': True
-    }
-
     try:
-        response = requests.post(url, json=payload, timeout=15)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('ok'):
-                print("✅ Notifica Telegram inviata con successo.")
-                return True
-            else:
-                print(f"❌ Errore Telegram API: {result.get('description', 'Unknown error')}")
-                return False
-        else:
-            print(f"❌ Errore HTTP Telegram: {response.status_code}")
-            print(f"   Response: {response.text[:200]}")
-            return False
-            
-    except requests.exceptions.Timeout:
-        print("❌ Timeout durante invio Telegram")
-        return False
-    except requests.exceptions.ConnectionError:
-        print("❌ Errore connessione Telegram")
-        return False
+        delivered, total = telegram_delivery.send(message, parse_mode=parse_mode, chat_ids=chat_ids)
     except Exception as e:
         print(f"❌ Eccezione durante invio Telegram: {e}")
         return False
 
+    if delivered == total:
+        print(f"✅ Notifica Telegram inviata con successo ({delivered} destinatari).")
+        return True
+    print(f"⚠️ Notifica Telegram consegnata a {delivered}/{total} destinatari.")
+    return False
+
 
 def send_error_alert(error_message, context=""):
     """
@@ -0,0 +1,298 @@
+# nowcast.py - Nowcast intraday sulla barra parziale della seduta in corso
+# Kriterion Volatility Monitor
+#
+# Il job giornaliero lavora solo su sedute chiuse, quindi durante la giornata
+# il segnale è sempre in ritardo di una seduta. Dopo ogni run il job salva lo
+# stato dei modelli (HMM con scaler e mapping, ultima probabilità filtrata,
+# parametri e ultima varianza GARCH, stato delle EMA e coda delle features). Il
+# nowcast legge periodicamente la barra parziale e fa avanzare di un passo il
+# filtro forward dell'HMM e la ricorsione GARCH, senza riaddestrare nulla:
+# ogni aggiornamento costa pochi millisecondi. Il risultato è un regime e un
+# segnale PROVVISORI, pubblicati in un file JSON e, se segnalano rischio,
+# con un avviso Telegram (una sola volta per seduta e segnale).
+#
+# Uso:
+#   python nowcast.py               # polling fino alla chiusura del mercato
+#   python nowcast.py --once        # un solo aggiornamento
+#   python nowcast.py --interval 30
+
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from data_loader import fetch_partial_bar, advance_features
+from market_calendar import get_calendar
+from vol_models import nowcast_variance
+from fast_vol import bar_realized_variance
+from signals import generate_signal
+from regime_forecast import regime_forecaster
+from features import FeaturePipeline
+from config import TICKER, THRESHOLDS, SIGNAL_CONFIG, NOWCAST_CONFIG, regime_labels
+
+
+def _atomic_write(path, data, mode='wb'):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, mode) as fh:
+        if mode == 'wb':
+            pickle.dump(data, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            json.dump(data, fh, indent=1, default=str)
+    os.replace(tmp_path, path)
+
+
+# =============================================================================
+# STATO DEI MODELLI (scritto dal job giornaliero)
+# =============================================================================
+
+def build_model_state(df, model, scaler, mapping, posteriors, garch_result, signal, ticker=None):
+    """
+    Raccoglie tutto ciò che serve per far avanzare i modelli di un passo.
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Features della pipeline (ultima riga = ultima seduta chiusa)
+    model, scaler, mapping :
+        HMM addestrato (vedi models.train_hmm)
+    posteriors : np.ndarray
+        Probabilità HMM rimappate [Low, Medium, High]
+    garch_result : vol_models.VolatilityForecast or None
+        Forecast dello zoo GARCH (None se il job ha usato il fallback sulla vol realizzata)
+    signal : str
+        Segnale ufficiale della seduta
+    ticker : str, optional
+        Default: TICKER di config
+    """
+
+    # Probabilità filtrata dell'ultima seduta nell'ordine originale degli stati
+    # (all'ultimo istante smoothing e filtering coincidono)
+    last_mapped = posteriors[-1]
+    alpha_last = np.array([last_mapped[mapping[k]] for k in range(len(mapping))])
+
+    # Parametri, ultimi ε/σ² e σ² prevista per T+1 di ogni modello pubblicato dallo zoo
+    garch = garch_result.nowcast_state() if garch_result is not None else None
+
+    return {
+        'ticker': ticker or TICKER,
+        'market_date': df.index[-1].strftime('%Y-%m-%d'),
+        'saved_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'last_close': float(df['Close'].iloc[-1]),
+        'last_gk_vol': float(df['GK_Vol'].iloc[-1]),
+        'gk_vol': df['GK_Vol'].values.copy(),
+        'feature_tail': FeaturePipeline(scaler.features).tail(df),
+        'model': model,
+        'scaler': scaler,
+        'mapping': dict(mapping),
+        'alpha_last': alpha_last,
+        'posteriors_tail': np.asarray(posteriors[-THRESHOLDS['trend_window']:]),
+        'garch': garch,
+        'signal': signal
+    }
+
+
+def save_model_state(df, model, scaler, mapping, posteriors, garch_result, signal, path=None):
+    """Salva lo stato dei modelli (vedi build_model_state) per il nowcast. Ritorna il percorso."""
+    path = path or NOWCAST_CONFIG['state_path']
+    _atomic_write(path, build_model_state(df, model, scaler, mapping, posteriors, garch_result, signal))
+    return path
+
+
+class Nowcaster:
+    """Avanza di un passo HMM e GARCH sulla barra parziale, senza riaddestramento."""
+
+    def __init__(self, state):
+        self.state = state
+        model = state['model']
+        self.transmat = model.transmat_
+        self.means = model.means_
+        # Precalcolo inverse e determinanti delle covarianze (qualsiasi covariance_type)
+        covars = model.covars_
+        self.inv_covars = np.linalg.inv(covars)
+        self.log_norm = -0.5 * (self.means.shape[1] * np.log(2 * np.pi) + np.linalg.slogdet(covars)[1])
+        self.order = [k for k, _ in sorted(state['mapping'].items(), key=lambda kv: kv[1])]
+        self.gk_vol = pd.Series(state['gk_vol'])
+        self.pipeline = FeaturePipeline(state['scaler'].features)
+        # Matrice di transizione decomposta una volta per fit (previsioni dei regimi nel segnale)
+        self.forecaster = regime_forecaster(model, state['mapping'])
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or NOWCAST_CONFIG['state_path']
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Stato modelli non trovato ({path}): esegui prima il job giornaliero")
+        with open(path, 'rb') as fh:
+            return cls(pickle.load(fh))
+
+    def _log_emission(self, x):
+        diff = x - self.means
+        maha = np.einsum('ki,kij,kj->k', diff, self.inv_covars, diff)
+        return self.log_norm - 0.5 * maha
+
+    def forward_step(self, features):
+        """Un passo del filtro forward: P(stato | osservazioni fino alla barra parziale)."""
+        x = self.state['scaler'].transform(np.atleast_1d(features))
+        prior = self.state['alpha_last'] @ self.transmat
+        log_b = self._log_emission(x)
+        post = prior * np.exp(log_b - log_b.max())
+        post /= post.sum()
+        return post[self.order]     # regimi per volatilità crescente (Low ... High)
+
+    def garch_step(self, bar):
+        """Forecast (annualizzato) per la seduta successiva dato il rendimento parziale."""
+        r = np.log(bar['Close'] / self.state['last_close']) * 100
+        rv = bar_realized_variance(bar, self.state['last_close'], self.state['ticker'])
+        var = nowcast_variance(self.state['garch'], r, rv)
+        return float(np.sqrt(var) / 100 * np.sqrt(252))
+
+    def update(self, bar):
+        """Nowcast completo sulla barra parziale. Ritorna il dict pubblicato."""
+        t0 = time.perf_counter()
+        gk_vol, log_vol = advance_features(self.state['last_gk_vol'], bar, ticker=self.state['ticker'])
+        features = self.pipeline.advance(self.state['feature_tail'], bar, log_vol, self.state['last_close'])
+        probs = self.forward_step(features)
+        garch_vol = self.garch_step(bar) if self.state['garch'] else gk_vol
+
+        posteriors = np.vstack([self.state['posteriors_tail'], probs])
+        gk_series = pd.concat([self.gk_vol, pd.Series([gk_vol])], ignore_index=True)
+        sig = generate_signal(posteriors, garch_vol, gk_series, forecaster=self.forecaster)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+
+        return {
+            'provisional': True,
+            'ticker': self.state['ticker'],
+            'session': pd.Timestamp(bar['Date']).strftime('%Y-%m-%d'),
+            'as_of': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'base_date': self.state['market_date'],
+            'official_signal': self.state['signal'],
+            'signal': sig['signal'],
+            'regime': regime_labels(len(probs))[int(np.argmax(probs))],
+            'p_low': float(sig['p_low']),
+            'p_medium': float(sig['p_medium']),
+            'p_high': float(sig['p_high']),
+            'trend_p_high': float(sig['trend_p_high']),
+            'hit_high': sig['hit_high'],
+            'garch_vol': garch_vol,
+            'gk_vol': float(gk_vol),
+            'close': float(bar['Close']),
+            'compute_ms': round(elapsed_ms, 3)
+        }
+
+
+# =============================================================================
+# PUBBLICAZIONE
+# =============================================================================
+
+def format_nowcast_alert(nowcast):
+    info = SIGNAL_CONFIG.get(nowcast['signal'], SIGNAL_CONFIG['NEUTRAL'])
+    msg = f"""
+<b>⏳ KRITERION NOWCAST (PROVVISORIO)</b>
+<b>━━━━━━━━━━━━━━━━━━━━━━━━━</b>
+
+📅 Seduta in corso {nowcast['session']} | {nowcast['ticker']} {nowcast['close']:.2f}
+
+<b>⚡ Segnale provvisorio: {info['icon']} {nowcast['signal']}</b>
+<i>Ufficiale ({nowcast['base_date']}): {nowcast['official_signal']}</i>
+
+├ Regime: {nowcast['regime']}
+├ P(High): {nowcast['p_high']*100:.1f}%
+└ GARCH Vol: {nowcast['garch_vol']*100:.2f}%
+
+<b>💡 Azione</b>
+{info['action']}
+
+<i>Stima su barra parziale: verrà confermata o smentita dalla chiusura.</i>
+"""
+    return msg.strip()
+
+
+def write_nowcast(nowcast, output_path=None):
+    """Scrive l'ultimo nowcast nel file JSON letto da dashboard e servizi esterni."""
+    _atomic_write(output_path or NOWCAST_CONFIG['output_path'], nowcast, mode='w')
+
+
+def alert_key(nowcast, alerted):
+    """
+    Chiave 'seduta:segnale' se il nowcast va notificato, altrimenti None: il
+    segnale provvisorio è di rischio (NOWCAST_CONFIG['alert_signals']), diverso
+    da quello ufficiale e non ancora notificato nella seduta (alerted).
+    """
+    key = f"{nowcast['session']}:{nowcast['signal']}"
+    if (nowcast['signal'] in NOWCAST_CONFIG['alert_signals']
+            and nowcast['signal'] != nowcast['official_signal']
+            and key not in alerted):
+        return key
+    return None
+
+
+def publish(nowcast, alerted, output_path=None):
+    """
+    Scrive il nowcast nel file JSON e invia un avviso Telegram se il segnale
+    provvisorio è di rischio e diverso da quello ufficiale (una volta per seduta).
+    """
+    key = alert_key(nowcast, alerted)
+    if key is not None:
+        # Import locale: il modulo resta usabile senza credenziali Telegram
+        from notifications import send_telegram_alert
+        send_telegram_alert(format_nowcast_alert(nowcast))
+        alerted.add(key)
+    nowcast['alert_sent'] = f"{nowcast['session']}:{nowcast['signal']}" in alerted
+
+    write_nowcast(nowcast, output_path)
+
+
+def market_open(now_ny=None):
+    """True durante la seduta regolare (calendario NYSE: festivi e chiusure anticipate)."""
+    return get_calendar().is_open(now_ny)
+
+
+def run(interval=None, once=False):
+    interval = interval or NOWCAST_CONFIG['poll_interval']
+    nowcaster = Nowcaster.load()
+    alerted = set()
+
+    print(f"⏳ Nowcast {nowcaster.state['ticker']} su modelli del {nowcaster.state['market_date']} "
+          f"(segnale ufficiale {nowcaster.state['signal']})")
+
+    while True:
+        if not once and not market_open():
+            print("🌑 Mercato chiuso: nowcast terminato.")
+            return
+
+        try:
+            bar = fetch_partial_bar()
+            if pd.Timestamp(bar['Date']).strftime('%Y-%m-%d') <= nowcaster.state['market_date']:
+                print("ℹ️ Nessuna nuova seduta rispetto allo stato dei modelli.")
+            else:
+                nowcast = nowcaster.update(bar)
+                publish(nowcast, alerted)
+                print(f"   {nowcast['as_of']} {nowcast['signal']:<16} P(High) {nowcast['p_high']*100:5.1f}% "
+                      f"GARCH {nowcast['garch_vol']*100:6.2f}% ({nowcast['compute_ms']:.2f} ms)")
+        except Exception as e:
+            print(f"⚠️ Nowcast non aggiornato: {e}")
+
+        if once:
+            return
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Nowcast intraday Kriterion (segnale provvisorio)")
+    parser.add_argument('--interval', type=float, help="Secondi tra due aggiornamenti")
+    parser.add_argument('--once', action='store_true', help="Un solo aggiornamento")
+    args = parser.parse_args(argv)
+    run(interval=args.interval, once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# pipeline.py - Pipeline completa dati + modelli per la Dashboard
+# Kriterion Volatility Monitor
+
+import time
+
+from data_loader import fetch_data, calculate_features
+from models import train_hmm, get_hmm_states, train_garch, ordered_transmat
+from regime_forecast import regime_forecaster
+from simulation import garch_engine, regime_engine, simulate_paths
+from data_providers import get_provider
+from shared_cache import get_shared_cache, cache_key
+from instrumentation import MetricsRecorder, use_recorder, stage
+from signals import collapse_posteriors
+from config import (TICKER, START_DATE, HMM_PARAMS, HMM_SELECTION_CONFIG, HMM_FEATURES_CONFIG,
+                    GARCH_PARAMS, VOL_MODELS_CONFIG, FAST_VOL_CONFIG, TERM_STRUCTURE_CONFIG, SIMULATION_CONFIG,
+                    REGIME_FORECAST_CONFIG, VIX_COMPANIONS_CONFIG, CACHE_CONFIG)
+
+
+def _fit_models(df):
+    """Addestra HMM e GARCH e ritorna gli artefatti da mettere in cache."""
+    model_hmm, scaler_hmm, state_mapping = train_hmm(df)
+    states, posteriors = get_hmm_states(df, model_hmm, scaler_hmm, state_mapping)
+
+    # GARCH: Calcoliamo sempre, ma interpretiamo diversamente
+    garch_vol_ann, garch_res = train_garch(df)
+
+    return {
+        'states': states,
+        'posteriors': posteriors,
+        'transmat': ordered_transmat(model_hmm, state_mapping),
+        'forecaster': regime_forecaster(model_hmm, state_mapping),
+        'garch_vol': garch_vol_ann,
+        'garch_res': garch_res
+    }
+
+
+def _simulate(df, fitted):
+    """Percorsi Monte Carlo dei due motori (GARCH solo se il forecast è disponibile)."""
+    out = {'regime': simulate_paths(regime_engine(df, fitted['states'], fitted['posteriors'], fitted['transmat']))}
+    if fitted['garch_res'] is not None:
+        out['garch'] = simulate_paths(garch_engine(fitted['garch_res']))
+    return out
+
+
+def compute_snapshot():
+    """
+    Esegue l'intera pipeline (download, features, HMM, GARCH) senza cache di processo.
+
+    Se è configurata una cache condivisa, OHLCV, features e modelli vengono letti
+    da lì (chiavi per hash del contenuto), così tutte le repliche riusano lo
+    stesso calcolo e mostrano lo stesso segnale.
+
+    Returns:
+    --------
+    dict
+        Snapshot immutabile con DataFrame arricchito (stati e probabilità HMM),
+        forecast GARCH e computed_at (istante del download dei dati, anche se letti dalla cache).
+    """
+    recorder = MetricsRecorder('dashboard')
+    with use_recorder(recorder):
+        snapshot = _compute_snapshot()
+    snapshot['metrics'] = recorder.save()
+    return snapshot
+
+
+def _compute_snapshot():
+    cache = get_shared_cache()
+
+    # I dati grezzi non hanno un contenuto noto a priori: la chiave è la finestra TTL.
+    # L'istante del download viaggia con i dati: è l'età dello snapshot (SnapshotRefresher)
+    ttl_bucket = int(time.time() // CACHE_CONFIG['ttl'])
+    with stage('load_ohlcv') as info:
+        (fetched_at, df_raw), info['cache_hit'] = cache.get_or_compute(
+            cache_key('ohlcv', get_provider().name, TICKER, START_DATE, VIX_COMPANIONS_CONFIG, ttl_bucket),
+            lambda: (time.time(), fetch_data())
+        )
+    with stage('features') as info:
+        df, info['cache_hit'] = cache.get_or_compute(
+            cache_key('features', TICKER, df_raw), lambda: calculate_features(df_raw)
+        )
+    with stage('models') as info:
+        fitted, info['cache_hit'] = cache.get_or_compute(
+            cache_key('models', df, HMM_PARAMS, HMM_SELECTION_CONFIG, HMM_FEATURES_CONFIG, GARCH_PARAMS,
+                      VOL_MODELS_CONFIG, FAST_VOL_CONFIG, TERM_STRUCTURE_CONFIG, REGIME_FORECAST_CONFIG),
+            lambda: _fit_models(df)
+        )
+
+    with stage('simulation') as info:
+        simulation, info['cache_hit'] = cache.get_or_compute(
+            cache_key('simulation', df, HMM_PARAMS, HMM_SELECTION_CONFIG, HMM_FEATURES_CONFIG, GARCH_PARAMS,
+                      VOL_MODELS_CONFIG, FAST_VOL_CONFIG, SIMULATION_CONFIG), lambda: _simulate(df, fitted)
+        )
+
+    df = df.copy()
+    posteriors = fitted['posteriors']
+    n_states = posteriors.shape[1]
+    df['HMM_State'] = fitted['states']
+    for k in range(n_states):
+        df[f'P_State_{k}'] = posteriors[:, k]
+    collapsed = collapse_posteriors(posteriors)
+    df['P_Low'] = collapsed[:, 0]
+    df['P_Medium'] = collapsed[:, 1]
+    df['P_High'] = collapsed[:, 2]
+    # Previsioni dei regimi a signal_horizon sedute per ogni data (un solo passo vettoriale)
+    forecaster = fitted['forecaster']
+    ahead = forecaster.history(posteriors, index=df.index)
+    for col in ahead.columns:
+        df[col] = ahead[col]
+
+    return {
+        'df': df,
+        'n_states': n_states,
+        'garch_vol': fitted['garch_vol'],
+        'garch_res': fitted['garch_res'],
+        'posteriors': posteriors,
+        'forecaster': forecaster,
+        'regime_forecast': forecaster.forecast(posteriors[-1]),
+        'simulation': simulation,
+        'computed_at': fetched_at
+    }
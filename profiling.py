@@ -0,0 +1,250 @@
+# profiling.py - Profilazione del job con cProfile, tracemalloc e campionamento stack
+# Kriterion Volatility Monitor
+#
+# Produce in una cartella per run (timestamp_commit):
+#   - job.pstats          dump cProfile (snakeviz, pstats, gprof2dot)
+#   - functions.txt       top-N funzioni per tempo cumulativo
+#   - allocations.txt     top-N righe di codice per memoria ancora allocata a fine job (tracemalloc)
+#   - job.collapsed       stack campionati in formato "collapsed" (flamegraph.pl, speedscope)
+#   - summary.json        metadati e metriche principali per il confronto tra commit
+#
+# cProfile fino a Python 3.11 strumenta solo il thread che lo attiva: gli stage
+# del job in modalità thread (stages.run_stages) e le selezioni/fit lanciati da
+# quei thread hanno un profilatore per thread (ThreadProfilers), unito al dump
+# principale. Dal 3.12 cProfile usa sys.monitoring e vede già tutti i thread.
+# I processi figli (pool di stages.process_pool: selezione HMM, zoo di modelli,
+# simulazioni, bootstrap) NON sono profilati né campionati: il loro tempo
+# compare solo come attesa nel processo principale. summary.json riporta quanti
+# processi figli erano attivi; per profilarne il lavoro impostare workers=1 nelle
+# configurazioni corrispondenti.
+#
+# Nomi di file e funzioni sono normalizzati (percorsi relativi al repo o al
+# package di site-packages, senza numeri di riga negli stack) così gli output
+# di commit diversi restano confrontabili.
+
+import os
+import sys
+import json
+import time
+import multiprocessing
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+
+from utils import get_git_commit
+from config import PROFILING_CONFIG
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _short_path(filename):
+    """Percorso stabile: relativo al repo, oppure a partire dal package installato."""
+    if filename.startswith(REPO_ROOT):
+        return os.path.relpath(filename, REPO_ROOT)
+    for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    if filename.startswith('<'):
+        return filename
+    return os.path.basename(filename)
+
+
+class StackSampler(threading.Thread):
+    """Campiona periodicamente gli stack di tutti i thread (formato collapsed)."""
+
+    def __init__(self, interval):
+        super().__init__(name='kriterion-stack-sampler', daemon=True)
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        # Massimo della memoria tracciata osservato dai campioni: le metriche per stage
+        # del job resettano il picco di tracemalloc, quindi non basta leggerlo alla fine
+        self.max_traced = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{_short_path(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, 'thread'))
+                self.counts[';'.join(reversed(stack))] += 1
+            if tracemalloc.is_tracing():
+                self.max_traced = max(self.max_traced, tracemalloc.get_traced_memory()[1])
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ThreadProfilers:
+    """
+    Un cProfile per ogni thread avviato durante il job (threading.setprofile).
+
+    L'hook installato da threading.setprofile è chiamato al primo evento del
+    nuovo thread: crea il profilatore e lo attiva, sostituendo l'hook stesso
+    per quel thread. I dati dei thread già terminati si leggono in sicurezza;
+    i thread ancora vivi a fine job (es. worker di pool inattivi) vanno fermati
+    prima di leggerli, quindi stop() va chiamato dopo la fine del lavoro.
+    """
+
+    # Dal 3.12 un solo cProfile attivo per interprete, e vede già tutti i thread
+    supported = sys.version_info < (3, 12)
+
+    def __init__(self, exclude=()):
+        self.exclude = set(exclude)
+        self.profilers = []
+        self._lock = threading.Lock()
+
+    def _hook(self, frame, event, arg):
+        sys.setprofile(None)
+        if threading.get_ident() in self.exclude:
+            return
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+
+    def start(self):
+        if self.supported:
+            threading.setprofile(self._hook)
+
+    def stop(self):
+        if self.supported:
+            threading.setprofile(None)
+
+    def add_to(self, stats):
+        """Unisce i profili dei thread a stats (pstats.Stats) e ritorna quanti sono."""
+        with self._lock:
+            profilers = list(self.profilers)
+        for profiler in profilers:
+            profiler.create_stats()
+            stats.add(profiler)
+        return len(profilers)
+
+
+def _write_functions_report(stats, path, top_n, children=0):
+    rows = []
+    for (filename, lineno, func), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append((ct, tt, nc, f"{_short_path(filename)}:{func}"))
+    rows.sort(reverse=True)
+
+    with open(path, 'w') as fh:
+        if children:
+            fh.write(f"# {children} processi figli attivi non profilati: il loro lavoro "
+                     f"compare come attesa sui pool\n")
+        fh.write(f"{'cumtime(s)':>11} {'tottime(s)':>11} {'ncalls':>9}  funzione\n")
+        for ct, tt, nc, name in rows[:top_n]:
+            fh.write(f"{ct:>11.4f} {tt:>11.4f} {nc:>9}  {name}\n")
+    return [{'function': name, 'cumtime_s': round(ct, 4), 'tottime_s': round(tt, 4), 'ncalls': nc}
+            for ct, tt, nc, name in rows[:top_n]]
+
+
+def _write_allocations_report(snapshot, path, top_n):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    stats = snapshot.statistics('lineno')
+
+    with open(path, 'w') as fh:
+        fh.write(f"{'size(KiB)':>11} {'blocchi':>9}  posizione\n")
+        for stat in stats[:top_n]:
+            frame = stat.traceback[0]
+            fh.write(f"{stat.size / 1024:>11.1f} {stat.count:>9}  "
+                     f"{_short_path(frame.filename)}:{frame.lineno}\n")
+    return [{'location': f"{_short_path(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+             'size_kib': round(s.size / 1024, 1)} for s in stats[:top_n]]
+
+
+def profile_call(func, out_dir=None, top_n=None, sample_interval=None):
+    """
+    Esegue func() sotto cProfile, tracemalloc e campionatore di stack,
+    scrive gli artefatti e ritorna (risultato, cartella artefatti).
+
+    Gli artefatti vengono scritti anche se func termina con sys.exit o eccezione.
+    """
+    out_dir = out_dir or PROFILING_CONFIG['artifacts_dir']
+    top_n = top_n or PROFILING_CONFIG['top_n']
+    sample_interval = sample_interval or PROFILING_CONFIG['sample_interval']
+
+    commit = get_git_commit()
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    run_dir = os.path.join(out_dir, f"{stamp}_{commit}")
+    os.makedirs(run_dir, exist_ok=True)
+
+    tracemalloc.start(PROFILING_CONFIG['tracemalloc_frames'])
+    sampler = StackSampler(sample_interval)
+    profiler = cProfile.Profile()
+
+    status = 'ok'
+    result = None
+    pending = None
+    t0 = time.perf_counter()
+    sampler.start()
+    threads = ThreadProfilers(exclude=[sampler.ident])
+    threads.start()
+    profiler.enable()
+    try:
+        result = func()
+    except BaseException as e:     # include SystemExit dei rami di errore del job
+        status = f"{type(e).__name__}: {e}"
+        pending = e
+    finally:
+        profiler.disable()
+        threads.stop()
+        wall = time.perf_counter() - t0
+        sampler.stop()
+        children = len(multiprocessing.active_children())
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    # Profilo unico: thread principale più i thread degli stage
+    stats = pstats.Stats(profiler)
+    profiled_threads = 1 + threads.add_to(stats)
+    stats.dump_stats(os.path.join(run_dir, 'job.pstats'))
+    top_functions = _write_functions_report(
+        stats, os.path.join(run_dir, 'functions.txt'), top_n, children
+    )
+    top_allocations = _write_allocations_report(
+        snapshot, os.path.join(run_dir, 'allocations.txt'), top_n
+    )
+    with open(os.path.join(run_dir, 'job.collapsed'), 'w') as fh:
+        for stack, count in sorted(sampler.counts.items()):
+            fh.write(f"{stack} {count}\n")
+
+    summary = {
+        'commit': commit,
+        'timestamp': stamp,
+        'status': status,
+        'wall_s': round(wall, 4),
+        'peak_traced_mb': round(max(peak, sampler.max_traced) / 1024 ** 2, 2),
+        'stack_samples': sampler.samples,
+        'profiled_threads': profiled_threads,
+        'child_processes_not_profiled': children,
+        'sample_interval_s': sample_interval,
+        'python': sys.version.split()[0],
+        'top_functions': top_functions,
+        'top_allocations': top_allocations
+    }
+    with open(os.path.join(run_dir, 'summary.json'), 'w') as fh:
+        json.dump(summary, fh, indent=2)
+
+    print(f"\n🔬 Profilo salvato in {run_dir} ({wall:.2f}s, picco {summary['peak_traced_mb']:.1f} MB)")
+
+    if pending is not None:
+        raise pending
+    return result, run_dir
@@ -0,0 +1,168 @@
+# regime_forecast.py - Previsioni dei regimi HMM a n passi dalla matrice di transizione
+# Kriterion Volatility Monitor
+#
+# Il segnale guardava solo le probabilità correnti e la matrice di transizione
+# stimata dall'HMM restava inutilizzata. Qui A viene decomposta una volta per
+# fit (A = V Λ V⁻¹) e da lì, senza altre moltiplicazioni di matrici:
+#   - P(regime a t+h) = p(t) V Λ^h V⁻¹ per qualunque orizzonte
+#   - durata residua attesa del regime corrente (geometrica: a_ii / (1 - a_ii))
+#   - first passage: P(ingresso in High Vol entro h sedute), dalla catena con
+#     High reso assorbente, e tempo atteso di ingresso
+# Tutto è vettoriale su orizzonti e date storiche (einsum su n x H x K).
+#
+# Se V è mal condizionata (matrice quasi difettiva) le potenze sono calcolate
+# direttamente con matrix_power: stesso risultato, costo O(H·K³).
+
+import numpy as np
+import pandas as pd
+
+from models import ordered_transmat
+from instrumentation import instrumented
+from config import REGIME_FORECAST_CONFIG, regime_labels
+
+
+class MatrixPowers:
+    """p·M^h per più vettori p e orizzonti h, con M diagonalizzata una sola volta."""
+
+    def __init__(self, matrix, max_condition=None):
+        self.matrix = np.asarray(matrix, dtype=float)
+        max_condition = max_condition or REGIME_FORECAST_CONFIG['max_condition']
+        eigvals, eigvecs = np.linalg.eig(self.matrix)
+        self.diagonal = np.linalg.cond(eigvecs) < max_condition
+        if self.diagonal:
+            self.eigvals = eigvals
+            self.eigvecs = eigvecs
+            self.eigvecs_inv = np.linalg.inv(eigvecs)
+
+    def apply(self, p, horizons):
+        """
+        Parameters:
+        -----------
+        p : np.ndarray
+            Distribuzioni (K,) o (n, K)
+        horizons : array-like
+            Orizzonti h >= 0
+
+        Returns:
+        --------
+        np.ndarray
+            (H, K) o (n, H, K): p·M^h per ogni orizzonte
+        """
+        p = np.asarray(p, dtype=float)
+        horizons = np.asarray(horizons, dtype=int)
+        single = p.ndim == 1
+        p = np.atleast_2d(p)
+
+        if self.diagonal:
+            scaled = self.eigvals[None, :] ** horizons[:, None]            # (H, K)
+            out = np.einsum('nj,hj,jk->nhk', p @ self.eigvecs, scaled, self.eigvecs_inv).real
+        else:
+            powers = np.stack([np.linalg.matrix_power(self.matrix, h) for h in horizons])
+            out = np.einsum('nj,hjk->nhk', p, powers)
+
+        out = np.clip(out, 0.0, 1.0)    # Errori di arrotondamento degli autovalori complessi
+        return out[0] if single else out
+
+
+class RegimeForecaster:
+    """
+    Previsioni dei regimi da una matrice di transizione ordinata per volatilità
+    crescente (models.ordered_transmat): il regime target (default High Vol,
+    l'ultimo) è quello per il first passage.
+    """
+
+    def __init__(self, transmat, target=None):
+        self.transmat = np.asarray(transmat, dtype=float)
+        self.n_states = len(self.transmat)
+        self.target = self.n_states - 1 if target is None else target
+        self.powers = MatrixPowers(self.transmat)
+
+        # Catena con il target assorbente: P(target entro h) = massa assorbita
+        absorbing = self.transmat.copy()
+        absorbing[self.target] = np.eye(self.n_states)[self.target]
+        self.absorbing = MatrixPowers(absorbing)
+
+        self.stay = np.diag(self.transmat)
+        self.hitting_steps = self._hitting_steps()
+
+    def _hitting_steps(self):
+        """Sedute attese fino alla prima visita del target dopo t, per regime di partenza (inf se irraggiungibile)."""
+        others = [k for k in range(self.n_states) if k != self.target]
+        m = np.zeros(self.n_states)
+        if others:
+            Q = self.transmat[np.ix_(others, others)]
+            try:
+                m[others] = np.linalg.solve(np.eye(len(others)) - Q, np.ones(len(others)))
+            except np.linalg.LinAlgError:
+                m[others] = np.inf
+        # Un passo obbligato, poi il tempo dal regime raggiunto (0 se è il target)
+        with np.errstate(invalid='ignore'):
+            return 1 + self.transmat @ m
+
+    def probabilities(self, p, horizons):
+        """P(regime a t+h) per ogni orizzonte: (H, K) o (n, H, K)."""
+        return self.powers.apply(p, horizons)
+
+    def first_passage(self, p, horizons):
+        """P(almeno una seduta nel target tra t+1 e t+h): (H,) o (n, H)."""
+        p_next = np.asarray(p, dtype=float) @ self.transmat
+        steps = np.asarray(horizons, dtype=int) - 1
+        return self.absorbing.apply(p_next, steps)[..., self.target]
+
+    def expected_duration(self, p):
+        """Sedute attese di permanenza nel regime corrente dopo t (pesate per le probabilità)."""
+        with np.errstate(divide='ignore'):
+            remaining = np.where(self.stay < 1, self.stay / (1 - self.stay), np.inf)
+        return np.asarray(p, dtype=float) @ remaining
+
+    def expected_hitting_time(self, p):
+        """Sedute attese fino al primo ingresso nel target."""
+        return np.asarray(p, dtype=float) @ self.hitting_steps
+
+    @instrumented('regime_forecast')
+    def forecast(self, p, horizons=None):
+        """
+        Riepilogo per la seduta corrente.
+
+        Returns:
+        --------
+        dict
+            probabilities (DataFrame orizzonte x regime), first_passage (Series
+            per orizzonte), expected_duration, expected_hitting_time, durations
+            (durata media di ogni regime, 1 / (1 - a_ii))
+        """
+        horizons = list(horizons or REGIME_FORECAST_CONFIG['horizons'])
+        labels = regime_labels(self.n_states)
+        index = pd.Index(horizons, name='horizon')
+        with np.errstate(divide='ignore'):
+            durations = np.where(self.stay < 1, 1 / (1 - self.stay), np.inf)
+        return {
+            'probabilities': pd.DataFrame(self.probabilities(p, horizons), index=index,
+                                          columns=[labels[k] for k in range(self.n_states)]),
+            'first_passage': pd.Series(self.first_passage(p, horizons), index=index),
+            'expected_duration': float(self.expected_duration(p)),
+            'expected_hitting_time': float(self.expected_hitting_time(p)),
+            'durations': {labels[k]: float(d) for k, d in enumerate(durations)}
+        }
+
+    def history(self, posteriors, index=None, horizon=None):
+        """
+        Previsioni a horizon sedute per ogni data storica in un solo passo vettoriale.
+
+        Returns:
+        --------
+        pd.DataFrame
+            P_High_Ahead (P(target a t+h)), Hit_High (ingresso nel target
+            entro h), Expected_Duration
+        """
+        horizon = horizon or REGIME_FORECAST_CONFIG['signal_horizon']
+        return pd.DataFrame({
+            'P_High_Ahead': self.probabilities(posteriors, [horizon])[:, 0, self.target],
+            'Hit_High': self.first_passage(posteriors, [horizon])[:, 0],
+            'Expected_Duration': self.expected_duration(posteriors)
+        }, index=index)
+
+
+def regime_forecaster(model, mapping):
+    """Forecaster dall'HMM addestrato (stati nell'ordine di get_hmm_states)."""
+    return RegimeForecaster(ordered_transmat(model, mapping))
@@ -4,79 +4,218 @@
 import pandas as pd
 import numpy as np
 import sys
+import json
+import argparse
 from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import io
+import os
 
 # Import moduli locali
-from data_loader import download_data, calculate_features
+from data_loader import download_data, calculate_features, save_history_snapshot, load_history_snapshot
 from models import train_hmm, get_hmm_states, train_garch
-from notifications import send_telegram_alert, format_daily_report, send_error_alert
-from config import THRESHOLDS, REGIME_LABELS, SIGNAL_CONFIG
+from notifications import format_daily_report, send_error_alert
+from alert_policy import dispatch_alerts
+from telegram_delivery import flush_outbox
+from signals import generate_signal
+from regime_forecast import regime_forecaster
+from bootstrap import cached_bootstrap, format_bands
+from stages import Stage, run_stages, process_context
+from instrumentation import start_run
+from signal_store import SignalStore, save_regime_history
+from nowcast import save_model_state
+from forecast_eval import update_log, evaluate_log, format_summary
+from market_calendar import get_calendar
+from utils import content_hash
+from config import (TICKER, HMM_PARAMS, HMM_FEATURES_CONFIG, GARCH_PARAMS, VOL_MODELS_CONFIG, FAST_VOL_CONFIG,
+                    regime_labels, SIGNAL_CONFIG, PROFILING_CONFIG, REPLAY_CONFIG, REGIME_FORECAST_CONFIG, BOOTSTRAP_CONFIG,
+                    SIGNAL_STORE_CONFIG)
 
-def job():
+def _load_data(as_of=None):
+    """
+    Stage 1: download e calcolo features.
+    Con as_of usa lo snapshot locale troncato a quella data (nessun accesso rete).
+    """
+    if as_of is not None:
+        df_raw = load_history_snapshot(as_of=as_of)
+    else:
+        df_raw = download_data()
+        save_history_snapshot(df_raw)
+    return calculate_features(df_raw)
+
+
+def _fit_hmm(data):
+    """Stage 2: training HMM e inferenza degli stati."""
+    model_hmm, scaler_hmm, state_mapping = train_hmm(data)
+    states, posteriors = get_hmm_states(data, model_hmm, scaler_hmm, state_mapping)
+    return model_hmm, scaler_hmm, state_mapping, states, posteriors
+
+
+def _fit_garch(data):
+    """Stage 3: training zoo GARCH e forecast 1-step."""
+    return train_garch(data)
+
+
+def job(force=False, record=True, as_of=None, notify=True, bootstrap=None):
     """
     Job principale eseguito giornalmente.
     Scarica dati, esegue modelli, genera segnale e invia notifica.
+    
+    Prima di qualunque download il job confronta l'ultima seduta chiusa del
+    calendario NYSE con il registro segnali: nei festivi e nei run duplicati
+    termina subito. Se il registro contiene già un run per la stessa data di
+    mercato e gli stessi dati, il job termina senza ricalcolare né notificare
+    (salvo force=True). Con record=False il run non viene registrato.
+    
+    Con as_of (data 'YYYY-MM-DD') il job gira in modalità replay: usa lo
+    snapshot storico locale troncato a quella data, non invia notifiche, non
+    scrive nel registro segnali e solleva eccezioni invece di terminare.
+    
+    Le notifiche seguono ALERT_POLICY_CONFIG (solo cambiamenti + digest
+    settimanale); con notify=False il messaggio viene solo stampato.
+    
+    Le bande bootstrap sono calcolate con bootstrap=True (default
+    BOOTSTRAP_CONFIG['enabled'], disattivato perché costoso).
     """
     
+    replay = as_of is not None
+    recorder = start_run('replay' if replay else 'daily_job')
+    # Replay e run di test (record=False) non finiscono nelle metriche di produzione
+    metrics_path = None if record and not replay else os.path.join(REPLAY_CONFIG['output_dir'], 'metrics.jsonl')
+    
+    def abort(error_msg, context):
+        print(f"   ❌ {error_msg}")
+        recorder.save(status='error', path=metrics_path)
+        if replay:
+            raise RuntimeError(error_msg)
+        send_error_alert(error_msg, context=context)
+        sys.exit(1)
+    
     print("=" * 60)
     print("🚀 KRITERION DAILY VOLATILITY CHECK")
-    print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}")
+    if replay:
+        print(f"⏪ REPLAY AS-OF {as_of} (dati locali, nessuna notifica)")
+    else:
+        print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}")
     print("=" * 60)
     
+    def skipped(previous):
+        # Eventuali alert rimasti in outbox da run precedenti vengono comunque reinviati
+        flush_outbox()
+        recorder.meta.update({'market_date': previous['market_date'], 'signal': previous['signal']})
+        recorder.save(status='skipped', path=metrics_path)
+        return {
+            'date': previous['market_date'],
+            'signal': previous['signal'],
+            'confidence': previous['confidence'],
+            'p_high': previous['p_high'],
+            'garch_vol': previous['garch_vol'],
+            'regime': previous['regime']
+        }
+    
+    # Stato persistente non ripristinato (es. CI senza branch 'state'): un registro
+    # vuoto romperebbe l'idempotenza e rinotificherebbe "Primo segnale registrato"
+    store_path = SIGNAL_STORE_CONFIG['path']
+    if (not replay and record and SIGNAL_STORE_CONFIG['require_existing']
+            and not os.path.exists(store_path)):
+        abort(f"Registro segnali {store_path} assente: stato persistente non ripristinato",
+              context="Ripristino stato")
+    
+    # Probe sul calendario di borsa: se l'ultima seduta chiusa è già nel
+    # registro (festivo, weekend, run duplicato) non serve scaricare né ricalcolare
+    store = SignalStore()
+    if not replay and not force:
+        calendar = get_calendar()
+        expected = calendar.last_closed_session().isoformat()
+        latest = store.latest(TICKER)
+        if latest is not None and latest['market_date'] >= expected:
+            today = calendar.now().date()
+            holiday = calendar.holiday_name(today)
+            reason = (f"oggi festivo ({holiday})" if holiday
+                      else "mercato chiuso" if not calendar.is_session(today)
+                      else "run già registrato")
+            print(f"\n♻️ Nessuna nuova seduta chiusa dopo il {latest['market_date']}: {reason}.")
+            print(f"   Segnale in vigore {latest['signal']}. Nessun download né notifica. Usa --force per rieseguire.")
+            return skipped(latest)
+    
+    stage_results = run_stages([Stage('data', partial(_load_data, as_of=as_of))])
+    
     # =========================================================================
     # 1. CARICAMENTO DATI
     # =========================================================================
     print("\n📊 [1/5] Caricamento dati da EODHD...")
     
-    try:
-        df_raw = download_data()
-        df = calculate_features(df_raw)
+    res = stage_results['data']
+    if res.ok:
+        df = res.value
         
         last_date = df.index[-1].strftime('%Y-%m-%d')
-        print(f"   ✅ Dati scaricati: {len(df):,} osservazioni")
+        print(f"   ✅ Dati scaricati: {len(df):,} osservazioni ({res.wall_s:.1f}s)")
         print(f"   📅 Ultima data disponibile: {last_date}")
         
-    except Exception as e:
-        error_msg = f"Errore critico download dati: {str(e)}"
-        print(f"   ❌ {error_msg}")
-        send_error_alert(error_msg, context="Download Dati EODHD")
-        sys.exit(1)
+    else:
+        abort(f"Errore critico download dati: {str(res.error)}", context="Download Dati EODHD")
+    
+    # Idempotenza: stesso giorno di mercato e stessi dati -> nulla da rifare
+    data_fingerprint = content_hash(df)
+    previous = None if replay else store.find_run(last_date, TICKER, data_fingerprint)
+    
+    if previous is not None and not force:
+        print(f"\n♻️ Run già registrato per {last_date} con gli stessi dati "
+              f"(segnale {previous['signal']}, {previous['created_at']}).")
+        print("   Nessun ricalcolo né notifica. Usa --force per rieseguire.")
+        return skipped(previous)
+    
+    # Stage 2 || 3: HMM e GARCH dipendono solo dal DataFrame e girano in parallelo
+    stage_results = run_stages([
+        Stage('hmm', _fit_hmm, deps=['data']),
+        Stage('garch', _fit_garch, deps=['data']),
+    ], inputs={'data': df})
     
     # =========================================================================
     # 2. TRAINING HMM
     # =========================================================================
     print("\n🤖 [2/5] Training Hidden Markov Model...")
     
-    try:
-        model_hmm, scaler_hmm, state_mapping = train_hmm(df)
-        states, posteriors = get_hmm_states(df, model_hmm, scaler_hmm, state_mapping)
+    res = stage_results['hmm']
+    if res.ok:
+        model_hmm, scaler_hmm, state_mapping, states, posteriors = res.value
         
-        print(f"   ✅ HMM addestrato su {len(df)} osservazioni")
+        print(f"   ✅ HMM addestrato su {len(df)} osservazioni ({res.wall_s:.1f}s)")
         print(f"   📊 Stati: {len(set(states))} regimi identificati")
+        # Matrice di transizione decomposta una volta: previsioni dei regimi a n passi
+        forecaster = regime_forecaster(model_hmm, state_mapping)
         
-    except Exception as e:
-        error_msg = f"Errore training HMM: {str(e)}"
-        print(f"   ❌ {error_msg}")
-        send_error_alert(error_msg, context="Training HMM")
-        sys.exit(1)
+    else:
+        abort(f"Errore training HMM: {str(res.error)}", context="Training HMM")
     
     # =========================================================================
     # 3. TRAINING GARCH
     # =========================================================================
-    print("\n📉 [3/5] Training GARCH(1,1)...")
+    print("\n📉 [3/5] Training modelli GARCH...")
     
-    try:
-        garch_vol_ann, garch_result = train_garch(df)
+    res = stage_results['garch']
+    if res.ok:
+        garch_vol_ann, garch_result = res.value
         
-        print(f"   ✅ GARCH addestrato")
+        print(f"   ✅ GARCH addestrato ({res.wall_s:.1f}s): {garch_result.name}")
+        for row in garch_result.table[:3]:
+            if row['qlike'] is not None:
+                print(f"      {row['model']:<14} QLIKE {row['qlike']:.4f}  peso {row['weight']:.0%}")
         print(f"   📈 Forecast volatilità: {garch_vol_ann*100:.2f}%")
+        _, tenors = garch_result.term_structure()
+        print("   📐 Curva (vol media integrata): " + " · ".join(f"{k} {v*100:.2f}%" for k, v in tenors.items()))
         
-    except Exception as e:
-        error_msg = f"Errore training GARCH: {str(e)}"
+    else:
+        error_msg = f"Errore training GARCH: {str(res.error)}"
         print(f"   ❌ {error_msg}")
         # GARCH non è critico, continua con warning
         garch_vol_ann = df['GK_Vol'].iloc[-1]
         print(f"   ⚠️ Usando volatilità realizzata come fallback: {garch_vol_ann*100:.2f}%")
+        garch_result = None
+        tenors = None
     
     # =========================================================================
     # 4. ANALISI E GENERAZIONE SEGNALE
@@ -86,42 +225,13 @@ def job():
     # Estrai dati ultimo giorno
     last_row = df.iloc[-1]
     last_state = states[-1]
-    curr_probs = posteriors[-1]  # [Low, Medium, High]
+    labels = regime_labels(posteriors.shape[1])
     
-    p_low = curr_probs[0]
-    p_medium = curr_probs[1]
-    p_high = curr_probs[2]
-    
-    # Calcolo trend P(High Vol)
-    if len(posteriors) > THRESHOLDS['trend_window']:
-        prev_prob = posteriors[-THRESHOLDS['trend_window']][2]
-        trend_p_high = p_high - prev_prob
-    else:
-        trend_p_high = 0.0
-    
-    # Confidenza (probabilità massima)
-    confidence = max(p_low, p_medium, p_high)
-    
-    # Logica generazione segnale
-    signal_type = "NEUTRAL"
-    
-    if p_high > THRESHOLDS['high_vol']:
-        signal_type = "RISK_OFF"
-        
-        # Check GARCH percentile per STRONG_RISK_OFF
-        garch_threshold = df['GK_Vol'].quantile(THRESHOLDS['garch_percentile'])
-        if garch_vol_ann > garch_threshold:
-            signal_type = "STRONG_RISK_OFF"
-            
-    elif trend_p_high > THRESHOLDS['alert_change']:
-        signal_type = "ALERT"
-        
-    elif p_low > THRESHOLDS['low_vol']:
-        signal_type = "RISK_ON"
-    
-    # Se confidenza bassa, segnala WATCH
-    if confidence < THRESHOLDS.get('confidence_min', 0.70) and signal_type == "NEUTRAL":
-        signal_type = "WATCH"
+    sig = generate_signal(posteriors, garch_vol_ann, df['GK_Vol'], forecaster=forecaster)
+    signal_type = sig['signal']
+    p_low, p_medium, p_high = sig['p_low'], sig['p_medium'], sig['p_high']
+    trend_p_high = sig['trend_p_high']
+    confidence = sig['confidence']
     
     # Report segnale
     sig_info = SIGNAL_CONFIG.get(signal_type, SIGNAL_CONFIG['NEUTRAL'])
@@ -129,21 +239,41 @@ def job():
     print(f"\n   {'='*50}")
     print(f"   {sig_info['icon']} SEGNALE: {signal_type}")
     print(f"   {'='*50}")
-    print(f"   📊 Regime HMM: {REGIME_LABELS[last_state]}")
+    print(f"   📊 Regime HMM: {labels[last_state]} ({len(labels)} regimi)")
     print(f"   🎯 Confidenza: {confidence*100:.1f}%")
     print(f"   📈 P(Low Vol):    {p_low*100:.1f}%")
     print(f"   📊 P(Medium Vol): {p_medium*100:.1f}%")
     print(f"   📉 P(High Vol):   {p_high*100:.1f}%")
     print(f"   📈 Trend (5gg):   {trend_p_high*100:+.1f}%")
+    horizon = REGIME_FORECAST_CONFIG['signal_horizon']
+    print(f"   🔭 P(High) a {horizon}gg:  {sig['p_high_ahead']*100:.1f}%")
+    print(f"   🚪 Ingresso High entro {horizon}gg: {sig['hit_high']*100:.1f}%")
+    print(f"   ⏳ Durata residua attesa del regime: {sig['expected_duration']:.1f} sedute")
     print(f"   📉 GARCH Vol:     {garch_vol_ann*100:.2f}%")
     print(f"   💰 SPY Close:     ${last_row['Close']:.2f}")
     print(f"   📌 Azione: {sig_info['action']}")
     
+    # Incertezza di stima: block bootstrap in parallelo, salvato per impronta dei dati
+    # (stessi dati = nessun refit; la dashboard legge il risultato salvato)
+    uncertainty = None
+    bootstrap = BOOTSTRAP_CONFIG['enabled'] if bootstrap is None else bootstrap
+    if bootstrap and not replay:
+        try:
+            boot, hit = cached_bootstrap(df, model_hmm, scaler_hmm, state_mapping, garch_result)
+            uncertainty = format_bands(boot)
+            print(f"\n   🎯 Bande bootstrap 90% ({boot['n_ok']}/{boot['n_boot']} replicati, "
+                  f"{boot['garch_model']}{', da cache' if hit else ''}):")
+            for line in uncertainty:
+                print(f"      {line}")
+        except Exception as e:
+            print(f"   ⚠️ Bootstrap non calcolato: {e}")
+    
     # =========================================================================
     # 5. INVIO NOTIFICA TELEGRAM
     # =========================================================================
     print("\n📱 [5/5] Invio notifica Telegram...")
     
+    notified = False
     try:
         # Calcola rendimento giornaliero
         daily_return = last_row['Returns'] if 'Returns' in last_row else None
@@ -152,20 +282,29 @@ def job():
         message = format_daily_report(
             date=last_row.name.strftime('%Y-%m-%d'),
             price=last_row['Close'],
-            hmm_probs=curr_probs.tolist(),
+            hmm_probs=[p_low, p_medium, p_high],
             garch_vol=garch_vol_ann,
-            regime_label=REGIME_LABELS[last_state],
+            regime_label=labels[last_state],
             signal_type=signal_type,
             trend_prob=trend_p_high,
-            daily_return=daily_return
+            daily_return=daily_return,
+            term_structure=tenors,
+            regime_outlook={'horizon': horizon, 'p_high_ahead': sig['p_high_ahead'],
+                            'hit_high': sig['hit_high'], 'expected_duration': sig['expected_duration']},
+            uncertainty=uncertainty
         )
         
-        success = send_telegram_alert(message)
-        
-        if success:
-            print("   ✅ Notifica inviata con successo!")
+        if replay or not notify:
+            print(f"   🔇 Notifica disattivata. Anteprima:\n{message}")
         else:
-            print("   ⚠️ Notifica non inviata (controlla credenziali)")
+            current_run = {
+                'market_date': last_row.name.strftime('%Y-%m-%d'),
+                'signal': signal_type,
+                'regime': labels[last_state],
+                'p_high': float(p_high),
+                'garch_vol': float(garch_vol_ann)
+            }
+            notified = dispatch_alerts(current_run, message, store, TICKER)
             
     except Exception as e:
         print(f"   ❌ Errore invio notifica: {e}")
@@ -173,43 +312,152 @@ def job():
     # =========================================================================
     # COMPLETAMENTO
     # =========================================================================
-    print("\n" + "=" * 60)
-    print("🏁 JOB COMPLETATO")
-    print("=" * 60)
-    
-    # Return del segnale per eventuali test
-    return {
+    result = {
         'date': last_row.name.strftime('%Y-%m-%d'),
         'signal': signal_type,
         'confidence': confidence,
         'p_high': p_high,
         'garch_vol': garch_vol_ann,
-        'regime': REGIME_LABELS[last_state]
+        'regime': labels[last_state]
     }
+    
+    recorder.meta.update({'market_date': result['date'], 'signal': signal_type})
+    metrics = recorder.save(path=metrics_path)
+    
+    if record and not replay:
+        store.record_run(
+            market_date=result['date'],
+            ticker=TICKER,
+            data_fingerprint=data_fingerprint,
+            signal=signal_type,
+            regime=result['regime'],
+            p_low=float(p_low),
+            p_medium=float(p_medium),
+            p_high=float(p_high),
+            confidence=float(confidence),
+            trend_p_high=float(trend_p_high),
+            garch_vol=float(garch_vol_ann),
+            model_fingerprint=content_hash(
+                HMM_PARAMS, HMM_FEATURES_CONFIG, GARCH_PARAMS, VOL_MODELS_CONFIG, FAST_VOL_CONFIG,
+                model_hmm.transmat_, model_hmm.means_,
+                garch_result.name if garch_result is not None else None,
+                garch_result.params.values if garch_result is not None else None
+            ),
+            timings={s['stage']: s['wall_s'] for s in metrics['stages'] if s['depth'] == 0},
+            notified=notified
+        )
+        save_regime_history(df, states, posteriors)
+        print(f"\n🗄️ Segnale registrato nello storico ({store.path})")
+        
+        # Stato dei modelli per il nowcast intraday della prossima seduta
+        try:
+            path = save_model_state(df, model_hmm, scaler_hmm, state_mapping, posteriors,
+                                    garch_result, signal_type)
+            print(f"💾 Stato modelli per il nowcast salvato ({path})")
+        except Exception as e:
+            print(f"⚠️ Stato modelli per il nowcast non salvato: {e}")
+        
+        # Registro dei forecast 1-step per la valutazione fuori campione
+        if garch_result is not None:
+            try:
+                info = update_log(df, garch_result)
+                print(f"📏 Registro forecast aggiornato: +{info['added']} forecast, "
+                      f"{info['realized']} esiti (prossima seduta {info['target_date']})")
+                evaluation = evaluate_log()
+                if evaluation is not None:
+                    print(f"   Fuori campione ({evaluation['n_obs']} sedute):")
+                    for line in format_summary(evaluation, top=3):
+                        print(f"   {line}")
+            except Exception as e:
+                print(f"⚠️ Registro forecast non aggiornato: {e}")
+    
+    print("\n⏱️ Tempi per stage:")
+    for line in recorder.summary_lines():
+        print(f"   {line}")
+    print(f"\nMETRICS_JSON {json.dumps(metrics, default=str)}")
+    
+    print("\n" + "=" * 60)
+    print("🏁 JOB COMPLETATO")
+    print("=" * 60)
+    
+    # Return del segnale per eventuali test
+    return result
 
 
-def test_run():
+def test_run(bootstrap=None):
     """
     Funzione di test per verificare il funzionamento senza invio Telegram.
     """
     print("\n⚠️ MODALITÀ TEST - Telegram disabilitato\n")
     
-    # Temporaneamente disabilita Telegram
-    import notifications
-    original_send = notifications.send_telegram_alert
-    notifications.send_telegram_alert = lambda msg: print(f"[TEST] Messaggio:\n{msg[:500]}...")
+    return job(force=True, record=False, notify=False, bootstrap=bootstrap)
+
+
+def _replay_worker(as_of):
+    """Esegue un singolo replay in un processo separato, con output silenziato."""
+    with redirect_stdout(io.StringIO()):
+        try:
+            return job(as_of=as_of)
+        except Exception as e:
+            return {'date': as_of, 'signal': 'ERROR', 'error': str(e)}
+
+
+def replay_range(start, end, workers=None):
+    """
+    Rigioca il job per ogni giorno di borsa in [start, end] presente nello
+    snapshot locale, distribuendo le date su più processi.
+    Ritorna un DataFrame (una riga per data) e lo salva in REPLAY_CONFIG['output_dir'].
+    """
+    history = load_history_snapshot()
+    dates = history.loc[start:end].index.strftime('%Y-%m-%d').tolist()
+    if not dates:
+        raise ValueError(f"Nessuna data nello snapshot tra {start} e {end}")
+    
+    workers = workers or REPLAY_CONFIG['workers']
+    print(f"⏪ Replay di {len(dates)} sedute ({dates[0]} -> {dates[-1]}) su {workers} processi...")
     
-    result = job()
+    # Pool dedicato (job interi per processo) ma con lo stesso contesto fork-free di stages
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as pool:
+        results = list(pool.map(_replay_worker, dates))
     
-    # Ripristina
-    notifications.send_telegram_alert = original_send
+    replay_df = pd.DataFrame(results).set_index('date')
+    os.makedirs(REPLAY_CONFIG['output_dir'], exist_ok=True)
+    out_path = os.path.join(REPLAY_CONFIG['output_dir'], f"replay_{TICKER}_{dates[0]}_{dates[-1]}.csv")
+    replay_df.to_csv(out_path)
     
-    return result
+    print(replay_df.to_string())
+    print(f"\n💾 Replay salvato in {out_path}")
+    return replay_df
 
 
 if __name__ == "__main__":
-    # Check argomenti
-    if len(sys.argv) > 1 and sys.argv[1] == '--test':
-        test_run()
+    parser = argparse.ArgumentParser(description="Kriterion Daily Volatility Check")
+    parser.add_argument('--test', action='store_true',
+                        help="Esegue il job senza inviare notifiche Telegram")
+    parser.add_argument('--force', action='store_true',
+                        help="Riesegue il job anche se esiste già un run per gli stessi dati")
+    parser.add_argument('--as-of', metavar='DATE',
+                        help="Replay offline del job alla data indicata (YYYY-MM-DD) dallo snapshot locale")
+    parser.add_argument('--replay-range', nargs=2, metavar=('START', 'END'),
+                        help="Replay offline di tutte le sedute tra START e END in parallelo")
+    parser.add_argument('--workers', type=int, help="Processi per --replay-range")
+    parser.add_argument('--bootstrap', action='store_true', default=None,
+                        help="Calcola le bande bootstrap anche se BOOTSTRAP_CONFIG['enabled'] è False")
+    parser.add_argument('--profile', nargs='?', const=PROFILING_CONFIG['artifacts_dir'], metavar='DIR',
+                        help="Profila il job (cProfile, tracemalloc, stack campionati) e salva gli artefatti in DIR")
+    args = parser.parse_args()
+    
+    if args.replay_range:
+        run = partial(replay_range, *args.replay_range, workers=args.workers)
+    elif args.as_of:
+        run = partial(job, as_of=args.as_of)
+    elif args.test:
+        run = partial(test_run, bootstrap=args.bootstrap)
+    else:
+        run = partial(job, force=args.force, bootstrap=args.bootstrap)
+    
+    if args.profile:
+        from profiling import profile_call
+        profile_call(run, out_dir=args.profile)
     else:
-        job()
+        run()
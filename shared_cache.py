@@ -0,0 +1,356 @@
+# shared_cache.py - Cache condivisa tra processi per deploy multi-replica
+# Kriterion Volatility Monitor
+#
+# st.cache_data vive nel singolo processo: con più repliche Streamlit ognuna
+# scaricherebbe i dati e addestrerebbe i propri modelli. Questo modulo offre un
+# backend condiviso (SQLite o directory su volume comune) indicizzato per hash
+# del contenuto, con eviction LRU limitata in dimensione. La semantica è
+# "first writer wins": se due repliche calcolano la stessa chiave, tutte
+# adottano il valore scritto per primo e mostrano quindi lo stesso segnale.
+# Su un miss una sola replica calcola: le altre attendono il valore sotto un
+# lease per chiave (scade dopo lease_timeout se la replica che calcola muore).
+
+import os
+import time
+import pickle
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+from utils import get_secret, content_hash
+from config import SHARED_CACHE_CONFIG
+
+
+class CacheBackend:
+    """Interfaccia base: tutte le implementazioni devono essere process-safe."""
+
+    name = 'base'
+
+    def get(self, key):
+        """Ritorna (hit, valore)."""
+        raise NotImplementedError
+
+    def add(self, key, value):
+        """Salva il valore se la chiave è assente. Ritorna il valore effettivamente in cache."""
+        raise NotImplementedError
+
+    def acquire_lease(self, key, timeout):
+        """Prenota il calcolo della chiave per timeout secondi. False se un'altra replica la sta calcolando."""
+        return True
+
+    def release_lease(self, key):
+        pass
+
+    def get_or_compute(self, key, compute_fn, lease_timeout=None, poll=0.2):
+        """
+        Ritorna (valore, hit). In caso di miss calcola e salva il valore,
+        una sola replica alla volta: le altre attendono che compaia in cache.
+        Se il lease scade (replica bloccata o terminata) il valore viene calcolato qui.
+        """
+        hit, value = self.get(key)
+        if hit:
+            return value, True
+
+        lease_timeout = lease_timeout or SHARED_CACHE_CONFIG['lease_timeout']
+        deadline = time.time() + lease_timeout
+        while not self.acquire_lease(key, lease_timeout):
+            time.sleep(poll)
+            hit, value = self.get(key)
+            if hit:
+                return value, True
+            if time.time() > deadline:
+                return self.add(key, compute_fn()), False
+        try:
+            # Un'altra replica può aver completato il calcolo tra il miss e il lease
+            hit, value = self.get(key)
+            if hit:
+                return value, True
+            return self.add(key, compute_fn()), False
+        finally:
+            self.release_lease(key)
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    """Backend disattivato: ogni richiesta è un miss, nulla viene salvato."""
+
+    name = 'none'
+
+    def get(self, key):
+        return False, None
+
+    def add(self, key, value):
+        return value
+
+    def clear(self):
+        pass
+
+
+class SQLiteCache(CacheBackend):
+    """Cache su singolo file SQLite (WAL), adatta a un volume condiviso locale."""
+
+    name = 'sqlite'
+
+    def __init__(self, path, max_bytes, lock_timeout=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+        self._owner = f"{os.getpid()}-{id(self)}"
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.lock_timeout)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False, None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return True, pickle.loads(row[0])
+
+    def add(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time())
+            )
+            stored = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()[0]
+            self._evict(conn, keep=key)
+        return value if stored == blob else pickle.loads(stored)
+
+    def acquire_lease(self, key, timeout):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leases WHERE key = ? AND expires_at < ?", (key, now))
+            cur = conn.execute("INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                               (key, self._owner, now + timeout))
+        return cur.rowcount == 1
+
+    def release_lease(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self._owner))
+
+    def _evict(self, conn, keep):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute(
+            "SELECT key, size FROM entries WHERE key != ? ORDER BY last_access ASC", (keep,)
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM leases")
+
+
+def _try_lock(fh):
+    """Lock esclusivo non bloccante sul file (flock su Unix, msvcrt su Windows)."""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        try:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _unlock(fh):
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        return
+    fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class FileCache(CacheBackend):
+    """Cache su directory (un file pickle per chiave) protetta da file lock."""
+
+    name = 'file'
+
+    def __init__(self, directory, max_bytes, lock_timeout=30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, '.lock')
+
+    @contextmanager
+    def _locked(self):
+        deadline = time.time() + self.lock_timeout
+        with open(self._lock_path, 'a') as fh:
+            while not _try_lock(fh):
+                if time.time() > deadline:
+                    raise TimeoutError(f"Lock cache non ottenuto entro {self.lock_timeout}s")
+                time.sleep(0.05)
+            try:
+                yield
+            finally:
+                _unlock(fh)
+
+    def _lease_path(self, key):
+        return os.path.join(self.directory, f"{key}.lease")
+
+    def acquire_lease(self, key, timeout):
+        path = self._lease_path(key)
+        try:
+            # Lease scaduto (replica terminata durante il calcolo): viene rimosso
+            if time.time() - os.path.getmtime(path) > timeout:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def release_lease(self, key):
+        try:
+            os.remove(self._lease_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                value = pickle.load(fh)
+        except FileNotFoundError:
+            return False, None
+        # mtime come timestamp di ultimo accesso per l'LRU
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return True, value
+
+    def add(self, key, value):
+        path = self._path(key)
+        with self._locked():
+            if os.path.exists(path):
+                hit, stored = self.get(key)
+                if hit:
+                    return stored
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._evict(keep=path)
+        return value
+
+    def _evict(self, keep):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self._locked():
+            for name in os.listdir(self.directory):
+                if name.endswith(('.pkl', '.lease')):
+                    os.remove(os.path.join(self.directory, name))
+
+
+BACKENDS = {
+    'none': NullCache,
+    'sqlite': SQLiteCache,
+    'file': FileCache,
+}
+
+_instance = None
+
+
+def get_shared_cache():
+    """Ritorna il backend configurato (singleton per processo)."""
+    global _instance
+    if _instance is not None:
+        return _instance
+
+    backend = (get_secret('KRITERION_CACHE_BACKEND') or SHARED_CACHE_CONFIG['backend']).lower()
+    path = get_secret('KRITERION_CACHE_PATH') or SHARED_CACHE_CONFIG['path']
+
+    if backend not in BACKENDS:
+        print(f"⚠️ Backend cache '{backend}' sconosciuto. Cache condivisa disattivata.")
+        backend = 'none'
+
+    if backend == 'none':
+        _instance = NullCache()
+    else:
+        _instance = BACKENDS[backend](
+            path,
+            max_bytes=SHARED_CACHE_CONFIG['max_bytes'],
+            lock_timeout=SHARED_CACHE_CONFIG['lock_timeout']
+        )
+        print(f"🗄️ Cache condivisa attiva: {backend} ({path})")
+    return _instance
+
+
+def cache_key(namespace, *parts):
+    """Chiave di cache: namespace leggibile + hash del contenuto."""
+    return f"{namespace}-{content_hash(*parts)}"
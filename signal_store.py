@@ -0,0 +1,179 @@
+# signal_store.py - Registro persistente (append-only) dei segnali giornalieri
+# Kriterion Volatility Monitor
+#
+# Ogni esecuzione del job aggiunge una riga con data di mercato, impronta dei
+# dati, segnale, probabilità, vol GARCH, impronta del modello e tempi per
+# stage. Le righe non vengono mai modificate: il registro è lo storico
+# auditabile dei segnali e permette al job di riconoscere un run già fatto
+# sugli stessi dati (rilanci via workflow_dispatch quasi gratuiti).
+
+import os
+import json
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from signals import collapse_posteriors
+from config import SIGNAL_STORE_CONFIG, regime_labels
+
+COLUMNS = [
+    'market_date', 'ticker', 'data_fingerprint', 'signal', 'regime',
+    'p_low', 'p_medium', 'p_high', 'confidence', 'trend_p_high', 'garch_vol',
+    'model_fingerprint', 'timings', 'notified', 'created_at'
+]
+
+
+class SignalStore:
+    """Registro SQLite dei segnali. Solo INSERT e SELECT."""
+
+    def __init__(self, path=None):
+        self.path = path or SIGNAL_STORE_CONFIG['path']
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS signals (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    market_date TEXT NOT NULL,
+                    ticker TEXT NOT NULL,
+                    data_fingerprint TEXT NOT NULL,
+                    signal TEXT NOT NULL,
+                    regime TEXT,
+                    p_low REAL,
+                    p_medium REAL,
+                    p_high REAL,
+                    confidence REAL,
+                    trend_p_high REAL,
+                    garch_vol REAL,
+                    model_fingerprint TEXT,
+                    timings TEXT,
+                    notified INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    UNIQUE (market_date, ticker, data_fingerprint)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_signals_date ON signals(ticker, market_date)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        record = dict(row)
+        record['timings'] = json.loads(record['timings']) if record.get('timings') else {}
+        record['notified'] = bool(record['notified'])
+        return record
+
+    def find_run(self, market_date, ticker, data_fingerprint):
+        """Run già registrato per data di mercato e impronta dati, oppure None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM signals WHERE market_date = ? AND ticker = ? AND data_fingerprint = ?",
+                (market_date, ticker, data_fingerprint)
+            ).fetchone()
+        return self._to_dict(row)
+
+    def record_run(self, **fields):
+        """
+        Aggiunge un run al registro. Ritorna False se era già presente
+        (stessa data, ticker e impronta dati), True altrimenti.
+        """
+        fields = dict(fields)
+        fields['timings'] = json.dumps(fields.get('timings') or {})
+        fields['notified'] = int(bool(fields.get('notified')))
+        fields.setdefault('created_at', datetime.now(timezone.utc).isoformat(timespec='seconds'))
+        values = [fields.get(c) for c in COLUMNS]
+
+        with self._connect() as conn:
+            cur = conn.execute(
+                f"INSERT OR IGNORE INTO signals ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+                values
+            )
+            return cur.rowcount == 1
+
+    def latest(self, ticker):
+        """Ultimo run registrato per il ticker."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM signals WHERE ticker = ? ORDER BY market_date DESC, id DESC LIMIT 1",
+                (ticker,)
+            ).fetchone()
+        return self._to_dict(row)
+
+    def previous(self, ticker, market_date):
+        """Ultimo run registrato per il ticker con data di mercato precedente a market_date."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM signals WHERE ticker = ? AND market_date < ? "
+                "ORDER BY market_date DESC, id DESC LIMIT 1",
+                (ticker, market_date)
+            ).fetchone()
+        return self._to_dict(row)
+
+    def history(self, ticker, start=None, end=None):
+        """Run registrati nell'intervallo [start, end] (date ISO), in ordine cronologico."""
+        query = "SELECT * FROM signals WHERE ticker = ?"
+        params = [ticker]
+        if start:
+            query += " AND market_date >= ?"
+            params.append(start)
+        if end:
+            query += " AND market_date <= ?"
+            params.append(end)
+        query += " ORDER BY market_date ASC, id ASC"
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+
+# ----------------------------------------------------------------------
+# Storico regimi (riscritto ad ogni run: i modelli vengono riaddestrati
+# sull'intero storico, quindi le probabilità passate cambiano)
+# ----------------------------------------------------------------------
+
+def save_regime_history(df, states, posteriors, path=None):
+    """
+    Salva regime e probabilità HMM di ogni seduta (CSV, scrittura atomica).
+    Con K regimi le probabilità sono ridotte a Low/Medium/High (collapse_posteriors).
+    """
+    path = path or SIGNAL_STORE_CONFIG['regime_history_path']
+    labels = regime_labels(posteriors.shape[1])
+    collapsed = collapse_posteriors(posteriors)
+    history = pd.DataFrame({
+        'Close': df['Close'].values,
+        'GK_Vol': df['GK_Vol'].values,
+        'State': states,
+        'Regime': [labels[s] for s in states],
+        'P_Low': collapsed[:, 0],
+        'P_Medium': collapsed[:, 1],
+        'P_High': collapsed[:, 2]
+    }, index=df.index.strftime('%Y-%m-%d'))
+    history.index.name = 'Date'
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as fh:
+        history.to_csv(fh)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_regime_history(path=None):
+    """Storico regimi salvato dall'ultimo run (indice = data ISO), o None se assente."""
+    path = path or SIGNAL_STORE_CONFIG['regime_history_path']
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, index_col='Date')
@@ -0,0 +1,100 @@
+# signals.py - Logica di generazione del segnale operativo
+# Kriterion Volatility Monitor
+
+import numpy as np
+
+from instrumentation import instrumented
+from config import THRESHOLDS, REGIME_FORECAST_CONFIG
+
+
+def collapse_posteriors(posteriors):
+    """
+    Riduce le probabilità di K regimi (ordinati per volatilità crescente) a
+    [Low, Medium, High]: Low è il primo regime, High l'ultimo, Medium la somma
+    dei regimi intermedi (0 con K=2). Accetta un vettore o una matrice n x K.
+    """
+    p = np.asarray(posteriors)
+    return np.stack([p[..., 0], p[..., 1:-1].sum(axis=-1), p[..., -1]], axis=-1)
+
+
+@instrumented('generate_signal')
+def generate_signal(posteriors, garch_vol, gk_vol, forecaster=None):
+    """
+    Genera il segnale operativo dalle probabilità HMM e dal forecast GARCH.
+
+    Parameters:
+    -----------
+    posteriors : np.ndarray
+        Probabilità posteriori HMM (n_obs x K), regimi per volatilità crescente
+    garch_vol : float
+        Previsione volatilità annualizzata GARCH (1-step)
+    gk_vol : pd.Series
+        Storico volatilità realizzata (per la soglia percentile GARCH)
+    forecaster : regime_forecast.RegimeForecaster, optional
+        Previsioni dei regimi dalla matrice di transizione: aggiunge il first
+        passage in High Vol entro signal_horizon sedute (regola ALERT se
+        REGIME_FORECAST_CONFIG['alert_on_hit_high']) e la durata residua
+        attesa del regime
+
+    Returns:
+    --------
+    dict
+        signal, probabilità correnti, trend P(High), confidenza e, con il
+        forecaster, p_high_ahead, hit_high ed expected_duration
+    """
+    p_low, p_medium, p_high = collapse_posteriors(posteriors[-1])  # [Low, Medium, High]
+
+    # Calcolo trend P(High Vol)
+    if len(posteriors) > THRESHOLDS['trend_window']:
+        prev_prob = posteriors[-THRESHOLDS['trend_window']][-1]
+        trend_p_high = p_high - prev_prob
+    else:
+        trend_p_high = 0.0
+
+    # Confidenza (probabilità massima del regime più probabile)
+    confidence = max(posteriors[-1])
+
+    # Previsioni a signal_horizon sedute (None senza forecaster)
+    ahead = {'p_high_ahead': None, 'hit_high': None, 'expected_duration': None}
+    if forecaster is not None:
+        h = REGIME_FORECAST_CONFIG['signal_horizon']
+        ahead = {
+            'p_high_ahead': float(forecaster.probabilities(posteriors[-1], [h])[0, -1]),
+            'hit_high': float(forecaster.first_passage(posteriors[-1], [h])[0]),
+            'expected_duration': float(forecaster.expected_duration(posteriors[-1]))
+        }
+
+    # Logica generazione segnale
+    signal_type = "NEUTRAL"
+
+    if p_high > THRESHOLDS['high_vol']:
+        signal_type = "RISK_OFF"
+
+        # Check GARCH percentile per STRONG_RISK_OFF
+        garch_threshold = gk_vol.quantile(THRESHOLDS['garch_percentile'])
+        if garch_vol > garch_threshold:
+            signal_type = "STRONG_RISK_OFF"
+
+    elif trend_p_high > THRESHOLDS['alert_change']:
+        signal_type = "ALERT"
+
+    elif (REGIME_FORECAST_CONFIG['alert_on_hit_high'] and ahead['hit_high'] is not None
+          and ahead['hit_high'] > THRESHOLDS['hit_high']):
+        signal_type = "ALERT"
+
+    elif p_low > THRESHOLDS['low_vol']:
+        signal_type = "RISK_ON"
+
+    # Se confidenza bassa, segnala WATCH
+    if confidence < THRESHOLDS.get('confidence_min', 0.70) and signal_type == "NEUTRAL":
+        signal_type = "WATCH"
+
+    return {
+        'signal': signal_type,
+        'p_low': p_low,
+        'p_medium': p_medium,
+        'p_high': p_high,
+        'trend_p_high': trend_p_high,
+        'confidence': confidence,
+        **ahead
+    }
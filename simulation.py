@@ -0,0 +1,361 @@
+# simulation.py - Simulazione Monte Carlo di percorsi di volatilità e rendimenti
+# Kriterion Volatility Monitor
+#
+# La dashboard mostrava un solo punto di forecast. Qui decine di migliaia di
+# percorsi futuri, con due motori:
+#   - GARCH:  ricorsione del forecast pubblicato (tutti i componenti dello zoo
+#             avanzati con lo stesso rendimento simulato, varianza combinata con
+#             i pesi QLIKE, come nel nowcast), innovazioni dalla distribuzione
+#             stimata del componente principale
+#   - regime: catena di Markov sulla matrice di transizione HMM a partire dalle
+#             probabilità filtrate correnti, rendimenti con media e deviazione
+#             standard storiche del regime
+# I percorsi sono vettoriali (una riga per percorso, un ciclo sugli orizzonti)
+# e processati a blocchi di chunk_size: ogni blocco viene ridotto subito a
+# istogrammi su griglie fisse per orizzonte, che si sommano tra blocchi, quindi
+# la memoria non dipende da n_paths. Ogni blocco ha il proprio generatore
+# (SeedSequence.spawn): a parità di seed e chunk_size il risultato è identico
+# sia in sequenziale sia distribuendo i blocchi su più processi.
+#
+# Output: quantili per orizzonte (fan chart) di volatilità e rendimento
+# cumulato, VaR/ES sul rendimento cumulato e probabilità che la volatilità
+# tocchi un livello entro N sedute.
+#
+# Unità: rendimenti in % (log) e varianze in %² giornaliere, come per vol_models.
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import arch.univariate
+
+from vol_models import _next_variance
+from fast_vol import FAST_MODELS
+from instrumentation import instrumented, annotate
+from stages import process_pool
+from config import SIMULATION_CONFIG
+
+# Semiampiezza della griglia dei rendimenti cumulati, in deviazioni standard di riferimento per √h
+RETURN_GRID_WIDTH = 12
+# Estremo superiore della griglia della volatilità, in multipli della volatilità di riferimento
+VOL_GRID_WIDTH = 6
+
+
+# =============================================================================
+# MOTORI
+# =============================================================================
+
+class GarchPathEngine:
+    """
+    Percorsi dal forecast pubblicato dello zoo (stato di VolatilityForecast.nowcast_state).
+
+    A ogni passo: σ²(t) = Σ w_k σ²_k(t), r(t) = μ + σ(t)·z(t); ogni componente
+    aggiorna la propria ricorsione con r(t). Il primo passo coincide con il
+    forecast pubblicato a una seduta.
+    """
+
+    name = 'GARCH'
+
+    def __init__(self, state, scale):
+        self.components = state['components']
+        self.scale = float(scale)       # Deviazione standard giornaliera di riferimento (%) per le griglie
+        self.mu = sum(c['weight'] * c['mu'] for c in self.components)
+
+        # Innovazioni standardizzate dalla distribuzione del componente arch con peso maggiore
+        parametric = [c for c in self.components if 'dist' in c]
+        top = max(parametric, key=lambda c: c['weight']) if parametric else None
+        self.dist = top['dist'] if top else 'Normal'
+        self.dist_params = np.array(top['dist_params'] if top else [])
+
+    def _innovations(self, rng):
+        dist = getattr(arch.univariate, self.dist)(seed=rng)
+        return dist.simulate(self.dist_params)
+
+    def simulate(self, n_paths, horizon, rng):
+        """Ritorna (rendimenti %, volatilità giornaliere %) di forma (n_paths, horizon)."""
+        draw = self._innovations(rng)
+        states = [_initial_state(c, n_paths) for c in self.components]
+        returns = np.empty((n_paths, horizon))
+        sigma = np.empty((n_paths, horizon))
+
+        for t in range(horizon):
+            var = sum(c['weight'] * s['next_sigma2'] for c, s in zip(self.components, states))
+            sigma[:, t] = np.sqrt(var)
+            returns[:, t] = self.mu + sigma[:, t] * draw(n_paths)
+            for c, s in zip(self.components, states):
+                _advance(c, s, returns[:, t])
+        return returns, sigma
+
+
+def _initial_state(c, n_paths):
+    """Stato per percorso di un componente: buffer (liste di array, ordine cronologico) e σ² prevista."""
+    state = {'next_sigma2': np.full(n_paths, c['next_sigma2'])}
+    if c['vol'] == 'HAR':
+        state['rv'] = np.tile(np.asarray(c['rv'], dtype=float), (n_paths, 1))
+    elif c['vol'] not in FAST_MODELS:
+        state['resid'] = [np.full(n_paths, e) for e in c['resid']]
+        state['sigma2'] = [np.full(n_paths, v) for v in c['sigma2']]
+    return state
+
+
+def _advance(c, state, r):
+    """Aggiorna in place lo stato di un componente con i rendimenti simulati r (un valore per percorso)."""
+    if c['vol'] == 'EWMA':
+        state['next_sigma2'] = c['lam'] * state['next_sigma2'] + (1 - c['lam']) * (r - c['mu']) ** 2
+    elif c['vol'] == 'HAR':
+        # Varianza realizzata non osservata: proxy (r - μ)² riportato sulla scala di RV
+        hist = np.column_stack([state['rv'][:, 1:], (r - c['mu']) ** 2 / c['scale']])
+        pred = c['coef'][0] + sum(b * hist[:, -lag:].mean(axis=1) for b, lag in zip(c['coef'][1:], c['lags']))
+        state['rv'] = hist
+        state['next_sigma2'] = c['scale'] * np.maximum(pred, c['floor'])
+    else:
+        state['resid'] = state['resid'][1:] + [r - c['mu']]
+        state['sigma2'] = state['sigma2'][1:] + [state['next_sigma2']]
+        state['next_sigma2'] = _next_variance(c, state['resid'], state['sigma2'])
+
+
+class RegimePathEngine:
+    """
+    Percorsi a cambi di regime dall'HMM: il regime della seduta successiva è
+    estratto da p(T)·A, poi la catena evolve con la matrice di transizione A.
+    Rendimenti e volatilità di ogni regime sono quelli storici (sedute decodificate).
+    """
+
+    name = 'Regimi HMM'
+
+    def __init__(self, transmat, probs, means, stds):
+        self.transmat = np.asarray(transmat, dtype=float)
+        self.probs = np.asarray(probs, dtype=float)
+        self.means = np.asarray(means, dtype=float)
+        self.stds = np.asarray(stds, dtype=float)
+        self.scale = float(self.stds.max())
+
+    def simulate(self, n_paths, horizon, rng):
+        """Ritorna (rendimenti %, volatilità giornaliere %) di forma (n_paths, horizon)."""
+        cum = np.cumsum(self.transmat, axis=1)
+        cum[:, -1] = 1.0
+        first = np.cumsum(self.probs @ self.transmat)
+        first[-1] = 1.0
+
+        regimes = np.empty((n_paths, horizon), dtype=int)
+        regimes[:, 0] = np.searchsorted(first, rng.random(n_paths), side='right')
+        for t in range(1, horizon):
+            # Inversione della CDF della riga del regime corrente, un'estrazione per percorso
+            u = rng.random(n_paths)
+            regimes[:, t] = (u[:, None] >= cum[regimes[:, t - 1]]).sum(axis=1)
+
+        sigma = self.stds[regimes]
+        returns = self.means[regimes] + sigma * rng.standard_normal((n_paths, horizon))
+        return returns, sigma
+
+
+def garch_engine(garch_result, horizon=None):
+    """Motore GARCH dal VolatilityForecast pubblicato."""
+    horizon = horizon or SIMULATION_CONFIG['horizon']
+    scale = np.sqrt(np.max(garch_result.variance(horizon)))
+    return GarchPathEngine(garch_result.nowcast_state(), scale)
+
+
+def regime_engine(df, states, posteriors, transmat):
+    """
+    Motore a regimi dall'HMM.
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Features con Returns (rendimenti log giornalieri)
+    states : np.ndarray
+        Stati decodificati (ordinati per volatilità crescente)
+    posteriors : np.ndarray
+        Probabilità filtrate (n, n_states), l'ultima riga è il punto di partenza
+    transmat : np.ndarray
+        Matrice di transizione nello stesso ordine degli stati (models.ordered_transmat)
+    """
+    returns = df['Returns'].values * 100
+    n_states = posteriors.shape[1]
+    means, stds = np.zeros(n_states), np.full(n_states, returns.std())
+    for k in range(n_states):
+        r = returns[states == k]
+        if len(r) > 1:      # Regime mai visitato: media nulla e deviazione standard complessiva
+            means[k], stds[k] = r.mean(), r.std()
+    return RegimePathEngine(transmat, posteriors[-1], means, stds)
+
+
+# =============================================================================
+# ACCUMULO A BLOCCHI
+# =============================================================================
+
+def _grids(engine, horizon, bins):
+    """Griglie fisse per orizzonte (identiche in ogni blocco): estremi inferiori e ampiezze dei bin."""
+    steps = np.arange(1, horizon + 1)
+    half = RETURN_GRID_WIDTH * engine.scale * np.sqrt(steps)
+    vol_top = VOL_GRID_WIDTH * engine.scale * np.sqrt(252) / 100
+    return {
+        'ret_lo': -half, 'ret_width': 2 * half / bins,
+        'vol_lo': np.zeros(horizon), 'vol_width': np.full(horizon, vol_top / bins),
+        'bins': bins
+    }
+
+
+def _histogram(x, lo, width, bins):
+    """Conteggi e somme per orizzonte su griglia fissa (valori fuori griglia nei bin estremi)."""
+    horizon = x.shape[1]
+    idx = np.clip(((x - lo) / width).astype(int), 0, bins - 1)
+    flat = (idx + np.arange(horizon) * bins).ravel()
+    counts = np.bincount(flat, minlength=horizon * bins).reshape(horizon, bins)
+    sums = np.bincount(flat, weights=x.ravel(), minlength=horizon * bins).reshape(horizon, bins)
+    return counts, sums
+
+
+def _simulate_chunk(engine, n_paths, horizon, seed, grids, levels):
+    """Simula un blocco e lo riduce ad accumulatori additivi (dimensione indipendente da n_paths)."""
+    rng = np.random.default_rng(seed)
+    returns, sigma = engine.simulate(n_paths, horizon, rng)
+    cum_returns = np.cumsum(returns, axis=1)
+    vol = sigma * np.sqrt(252) / 100
+
+    ret_counts, ret_sums = _histogram(cum_returns, grids['ret_lo'], grids['ret_width'], grids['bins'])
+    vol_counts, vol_sums = _histogram(vol, grids['vol_lo'], grids['vol_width'], grids['bins'])
+
+    # Prima seduta in cui la volatilità tocca ogni livello (horizon = mai)
+    hits = np.empty((len(levels), horizon + 1), dtype=np.int64)
+    running_max = np.maximum.accumulate(vol, axis=1)
+    for i, level in enumerate(levels):
+        first = np.where(running_max[:, -1] >= level, np.argmax(running_max >= level, axis=1), horizon)
+        hits[i] = np.bincount(first, minlength=horizon + 1)
+
+    return {'ret_counts': ret_counts, 'ret_sums': ret_sums,
+            'vol_counts': vol_counts, 'vol_sums': vol_sums, 'hits': hits}
+
+
+def _merge(acc, chunk):
+    if acc is None:
+        return chunk
+    return {key: acc[key] + chunk[key] for key in acc}
+
+
+# =============================================================================
+# STATISTICHE DAGLI ISTOGRAMMI
+# =============================================================================
+
+def _quantile(counts, lo, width, q):
+    """Quantile q per orizzonte, interpolazione lineare all'interno del bin."""
+    n = counts.sum(axis=1)
+    cdf = np.cumsum(counts, axis=1)
+    k = np.argmax(cdf >= q * n[:, None], axis=1)
+    rows = np.arange(len(counts))
+    before = cdf[rows, k] - counts[rows, k]
+    frac = (q * n - before) / np.maximum(counts[rows, k], 1)
+    return lo + (k + frac) * width
+
+
+def _expected_shortfall(counts, sums, tail, threshold_bin):
+    """Media della coda inferiore di probabilità tail: bin interi sotto la soglia più la quota del bin di soglia."""
+    n = counts.sum()
+    target = tail * n
+    below = counts[:threshold_bin].sum()
+    partial = (target - below) / max(counts[threshold_bin], 1)
+    total = sums[:threshold_bin].sum() + partial * sums[threshold_bin]
+    return total / target
+
+
+def _summarize(acc, grids, n_paths, horizon, levels, ref_vol, cfg):
+    steps = np.arange(1, horizon + 1)
+    quantiles = cfg['quantiles']
+
+    def fan(counts, sums, lo, width):
+        out = pd.DataFrame({q: _quantile(counts, lo, width, q) for q in quantiles}, index=steps)
+        out['mean'] = sums.sum(axis=1) / n_paths
+        out.index.name = 'horizon'
+        return out
+
+    fan_returns = fan(acc['ret_counts'], acc['ret_sums'], grids['ret_lo'], grids['ret_width'])
+    fan_vol = fan(acc['vol_counts'], acc['vol_sums'], grids['vol_lo'], grids['vol_width'])
+
+    # VaR/ES sul rendimento cumulato (perdite positive, in %)
+    risk = []
+    for h in [h for h in cfg['risk_horizons'] if h <= horizon]:
+        counts, sums = acc['ret_counts'][h - 1], acc['ret_sums'][h - 1]
+        for conf in cfg['confidence']:
+            tail = 1 - conf
+            q = _quantile(counts[None, :], grids['ret_lo'][h - 1], grids['ret_width'][h - 1], tail)[0]
+            k = int(np.argmax(np.cumsum(counts) >= tail * n_paths))
+            risk.append({'horizon': h, 'confidence': conf, 'var': -q,
+                         'es': -_expected_shortfall(counts, sums, tail, k)})
+
+    # P(volatilità ≥ livello entro N sedute)
+    check = sorted({h for h in cfg['risk_horizons'] if h <= horizon} | {horizon})
+    within = np.cumsum(acc['hits'][:, :horizon], axis=1) / n_paths
+    hit_prob = pd.DataFrame(within[:, [h - 1 for h in check]], columns=check,
+                            index=pd.Index(np.round(levels, 4), name='vol_level'))
+    hit_prob.insert(0, 'multiple', np.round(np.asarray(levels) / ref_vol, 2))
+
+    return {
+        'fan_returns': fan_returns,
+        'fan_vol': fan_vol,
+        'risk': pd.DataFrame(risk),
+        'hit_prob': hit_prob
+    }
+
+
+@instrumented('simulate_paths')
+def simulate_paths(engine, n_paths=None, horizon=None, chunk_size=None, seed=None, workers=None, levels=None):
+    """
+    Simulazione Monte Carlo a blocchi.
+
+    Parameters:
+    -----------
+    engine : GarchPathEngine o RegimePathEngine
+        Motore dei percorsi (vedi garch_engine, regime_engine)
+    n_paths, horizon, chunk_size, seed, workers : int, optional
+        Default da SIMULATION_CONFIG
+    levels : list, optional
+        Livelli di volatilità annualizzata (decimale) per le probabilità di
+        superamento; default: hit_levels × volatilità prevista a una seduta
+
+    Returns:
+    --------
+    dict
+        engine, n_paths, horizon, chunks, ref_vol, fan_returns (rendimento
+        cumulato %), fan_vol (volatilità annualizzata), risk (VaR/ES in %),
+        hit_prob (probabilità entro N sedute per livello)
+    """
+    cfg = SIMULATION_CONFIG
+    n_paths = n_paths or cfg['n_paths']
+    horizon = horizon or cfg['horizon']
+    chunk_size = min(chunk_size or cfg['chunk_size'], n_paths)
+    seed = cfg['seed'] if seed is None else seed
+    workers = workers or cfg['workers']
+
+    # Volatilità di riferimento: mediana della prima seduta da un blocco pilota (deterministica nel seed)
+    _, pilot_sigma = engine.simulate(min(chunk_size, 1000), 1, np.random.default_rng(seed))
+    ref_vol = float(np.median(pilot_sigma)) * np.sqrt(252) / 100
+    levels = list(levels) if levels is not None else [m * ref_vol for m in cfg['hit_levels']]
+
+    grids = _grids(engine, horizon, cfg['bins'])
+    sizes = [chunk_size] * (n_paths // chunk_size)
+    if n_paths % chunk_size:
+        sizes.append(n_paths % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [[engine] * len(sizes), sizes, [horizon] * len(sizes), seeds,
+            [grids] * len(sizes), [levels] * len(sizes)]
+
+    # Dentro un processo figlio (es. replay parallelo) i blocchi restano sequenziali
+    workers = min(workers, len(sizes))
+    acc = None
+    if workers > 1 and multiprocessing.parent_process() is None:
+        for chunk in process_pool(workers).map(_simulate_chunk, *args):
+            acc = _merge(acc, chunk)
+    else:
+        for chunk in map(_simulate_chunk, *args):
+            acc = _merge(acc, chunk)
+    annotate(engine=engine.name, n_paths=n_paths, chunks=len(sizes), workers=workers)
+
+    return {
+        'engine': engine.name,
+        'n_paths': n_paths,
+        'horizon': horizon,
+        'chunks': len(sizes),
+        'ref_vol': ref_vol,
+        **_summarize(acc, grids, n_paths, horizon, levels, ref_vol, cfg)
+    }
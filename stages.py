@@ -0,0 +1,200 @@
+# stages.py - Esecutore di stage con dipendenze, concorrenza e timeout
+# Kriterion Volatility Monitor
+#
+# Ogni Stage dichiara da quali stage dipende: appena le dipendenze sono
+# completate viene sottomesso al pool (thread o processi), così stage
+# indipendenti (es. HMM e GARCH, che usano solo il DataFrame) girano in
+# parallelo. Uno stage che fallisce o supera il timeout non blocca gli altri;
+# i suoi dipendenti vengono saltati. La gestione degli errori (alert, exit,
+# fallback) resta al chiamante, che riceve un StageResult per ogni stage.
+#
+# Timeout: lo stage scaduto è marcato come fallito e il job prosegue, ma il
+# suo worker NON viene interrotto (Python non può fermare un thread). In modo
+# 'thread' l'interprete attende comunque la fine di quel thread all'uscita; in
+# modo 'process' il worker resta occupato nel pool finché non termina.
+#
+# Pool di processi (process_pool): creati con start method forkserver (spawn
+# dove non disponibile), mai fork. Gli stage in thread possono a loro volta
+# aprire pool di processi (selezione HMM, zoo GARCH): un fork con altri thread
+# in esecuzione copia lock già acquisiti e può bloccare il figlio. I pool sono
+# persistenti per dimensione: i worker restano caldi tra una chiamata e l'altra
+# (moduli importati una volta sola) e vengono chiusi all'uscita del processo.
+
+import time
+import atexit
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from config import PIPELINE_CONFIG
+
+
+class StageTimeoutError(TimeoutError):
+    """Lo stage non si è concluso entro il timeout configurato."""
+
+
+class UpstreamError(RuntimeError):
+    """Lo stage è stato saltato perché una sua dipendenza è fallita."""
+
+
+class Stage:
+    """
+    Unità di lavoro del job.
+
+    timeout marca lo stage come fallito allo scadere, senza interromperlo
+    (vedi note in testa al modulo).
+    func riceve come keyword argument i risultati delle dipendenze
+    (nome dello stage -> valore ritornato).
+    """
+
+    def __init__(self, name, func, deps=(), timeout=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout if timeout is not None else PIPELINE_CONFIG['stage_timeouts'].get(name)
+
+
+class StageResult:
+    def __init__(self, name, value=None, error=None, wall_s=0.0):
+        self.name = name
+        self.value = value
+        self.error = error
+        self.wall_s = wall_s
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+_process_pools = {}
+_pools_lock = threading.Lock()
+
+
+def process_context():
+    """Contesto multiprocessing dei pool: forkserver se disponibile, altrimenti spawn."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def process_pool(max_workers):
+    """Pool di processi persistente con max_workers worker (ricreato se un worker è morto)."""
+    with _pools_lock:
+        pool = _process_pools.get(max_workers)
+        if pool is None or getattr(pool, '_broken', False):
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=process_context())
+            _process_pools[max_workers] = pool
+        return pool
+
+
+@atexit.register
+def shutdown_process_pools():
+    with _pools_lock:
+        for pool in _process_pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _process_pools.clear()
+
+
+def _run_in_context(ctx, func, kwargs):
+    # I thread del pool non ereditano le contextvars (es. il MetricsRecorder attivo)
+    return ctx.run(func, **kwargs)
+
+
+def run_stages(stages, mode=None, max_workers=None, inputs=None):
+    """
+    Esegue il grafo di stage e ritorna {nome: StageResult}.
+
+    Parameters:
+    -----------
+    stages : list of Stage
+        Stage da eseguire (le dipendenze devono essere nella lista o in inputs)
+    mode : str
+        'thread' (default da PIPELINE_CONFIG) o 'process'
+    max_workers : int
+        Dimensione del pool
+    inputs : dict, optional
+        Valori già calcolati (nome -> valore) usabili come dipendenze
+    """
+    mode = mode or PIPELINE_CONFIG['executor']
+    max_workers = max_workers or PIPELINE_CONFIG['max_workers']
+    by_name = {s.name: s for s in stages}
+    inputs = inputs or {}
+    for s in stages:
+        missing = [d for d in s.deps if d not in by_name and d not in inputs]
+        if missing:
+            raise ValueError(f"Stage '{s.name}': dipendenze sconosciute {missing}")
+
+    results = {name: StageResult(name, value=value) for name, value in inputs.items()}
+    running = {}    # future -> (stage, start, deadline)
+    pending = list(stages)
+
+    pool = process_pool(max_workers) if mode == 'process' else ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or running:
+            # 1. Sottometti gli stage con tutte le dipendenze risolte. Uno stage
+            # saltato per dipendenza fallita può risolvere altri stage già
+            # esaminati: si ripete finché un passaggio non cambia nulla
+            progress = True
+            while progress:
+                progress = False
+                for stage in list(pending):
+                    if not all(d in results for d in stage.deps):
+                        continue
+                    pending.remove(stage)
+                    progress = True
+
+                    failed = [d for d in stage.deps if not results[d].ok]
+                    if failed:
+                        results[stage.name] = StageResult(
+                            stage.name, error=UpstreamError(f"dipendenza fallita: {', '.join(failed)}")
+                        )
+                        continue
+
+                    kwargs = {d: results[d].value for d in stage.deps}
+                    if mode == 'process':
+                        future = pool.submit(stage.func, **kwargs)
+                    else:
+                        future = pool.submit(_run_in_context, contextvars.copy_context(), stage.func, kwargs)
+                    start = time.perf_counter()
+                    deadline = start + stage.timeout if stage.timeout else None
+                    running[future] = (stage, start, deadline)
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Dipendenze cicliche tra gli stage: {[s.name for s in pending]}")
+                continue
+
+            # 2. Attendi il primo completamento o la prima scadenza
+            deadlines = [d for _, _, d in running.values() if d is not None]
+            wait_s = max(min(deadlines) - time.perf_counter(), 0) if deadlines else None
+            done, _ = wait(list(running), timeout=wait_s, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage, start, _ = running.pop(future)
+                wall = time.perf_counter() - start
+                try:
+                    results[stage.name] = StageResult(stage.name, value=future.result(), wall_s=wall)
+                except Exception as e:
+                    results[stage.name] = StageResult(stage.name, error=e, wall_s=wall)
+
+            # 3. Stage scaduti: marcati come falliti (il worker non può essere interrotto)
+            now = time.perf_counter()
+            for future, (stage, start, deadline) in list(running.items()):
+                if deadline is not None and now >= deadline and not future.done():
+                    future.cancel()
+                    running.pop(future)
+                    results[stage.name] = StageResult(
+                        stage.name,
+                        error=StageTimeoutError(f"timeout dopo {stage.timeout}s"),
+                        wall_s=now - start
+                    )
+    finally:
+        # Non attendiamo eventuali worker bloccati oltre il timeout; il pool di
+        # processi è condiviso: si annullano solo gli stage non ancora partiti
+        if mode == 'process':
+            for future in running:
+                future.cancel()
+        else:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return {name: r for name, r in results.items() if name in by_name}
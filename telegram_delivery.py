@@ -0,0 +1,272 @@
+# telegram_delivery.py - Consegna asincrona dei messaggi Telegram a più destinatari
+# Kriterion Volatility Monitor
+#
+# I messaggi vengono inviati in parallelo (asyncio) a tutte le chat/canali
+# configurati, rispettando i limiti di Telegram con due token bucket: uno
+# globale per il bot e uno per ogni chat. Dentro una chat l'invio è
+# sequenziale, così i messaggi arrivano nell'ordine di coda. Le risposte 429 (rispettando
+# retry_after), 5xx, timeout ed errori di rete vengono ritentate con backoff
+# esponenziale; i messaggi ancora non consegnati finiscono in una outbox JSON
+# e vengono reinviati al run successivo, così un disservizio di Telegram non
+# fa perdere gli alert. Gli errori definitivi (chat inesistente, bot bloccato)
+# vengono solo loggati.
+
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import tempfile
+from datetime import datetime, timezone, timedelta
+
+import requests
+
+from utils import get_secret
+from config import TELEGRAM_CONFIG
+
+API_URL = "https://api.telegram.org/bot{token}/sendMessage"
+
+# Esiti della consegna di un singolo messaggio
+DELIVERED = 'delivered'
+RETRY = 'retry'         # Errore temporaneo: il messaggio resta in outbox
+FAILED = 'failed'       # Errore definitivo: il messaggio viene scartato
+
+
+def get_subscribers():
+    """
+    Destinatari configurati: TELEGRAM_CHAT_IDS (lista separata da virgole)
+    oppure, per compatibilità, il singolo TELEGRAM_CHAT_ID.
+    Ogni voce può indicare la modalità di notifica ("123:changes").
+    Ritorna {chat_id: modalità o None}, nell'ordine di configurazione.
+    """
+    raw = get_secret('TELEGRAM_CHAT_IDS') or get_secret('TELEGRAM_CHAT_ID') or ''
+    subscribers = {}
+    for entry in str(raw).split(','):
+        chat_id, _, mode = entry.strip().partition(':')
+        if chat_id and chat_id not in subscribers:
+            subscribers[chat_id] = mode.strip() or None
+    return subscribers
+
+
+def get_chat_ids():
+    """Lista dei chat_id configurati (senza modalità)."""
+    return list(get_subscribers())
+
+
+class TokenBucket:
+    """Rate limiter asincrono: `rate` token al secondo, fino a `capacity` accumulabili."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Outbox:
+    """Coda persistente (file JSON) dei messaggi non ancora consegnati."""
+
+    def __init__(self, path=None, max_age_hours=None):
+        self.path = path or TELEGRAM_CONFIG['outbox_path']
+        self.max_age = timedelta(hours=max_age_hours or TELEGRAM_CONFIG['outbox_max_age_hours'])
+
+    def load(self):
+        """Messaggi in attesa, esclusi quelli più vecchi di max_age (alert ormai superati)."""
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path) as fh:
+                items = json.load(fh)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ Outbox Telegram illeggibile ({e}): ignorata.")
+            return []
+
+        cutoff = datetime.now(timezone.utc) - self.max_age
+        fresh = [m for m in items if datetime.fromisoformat(m['queued_at']) >= cutoff]
+        if len(fresh) < len(items):
+            print(f"🗑️ Outbox Telegram: scartati {len(items) - len(fresh)} messaggi scaduti.")
+        return fresh
+
+    def save(self, items):
+        """Riscrive l'outbox in modo atomico (rimuove il file se vuota)."""
+        if not items:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(items, fh, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def _message_id(chat_id, text):
+    return hashlib.sha256(f"{chat_id}\n{text}".encode()).hexdigest()[:16]
+
+
+def make_messages(text, chat_ids, parse_mode='HTML'):
+    """Un messaggio per destinatario, nel formato usato dalla outbox."""
+    queued_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    return [{
+        'id': _message_id(chat_id, text),
+        'chat_id': chat_id,
+        'text': text,
+        'parse_mode': parse_mode,
+        'attempts': 0,
+        'queued_at': queued_at
+    } for chat_id in chat_ids]
+
+
+def _post(url, payload, timeout):
+    """Invio sincrono (eseguito in un thread). Ritorna (status HTTP, corpo JSON)."""
+    response = requests.post(url, json=payload, timeout=timeout)
+    try:
+        body = response.json()
+    except ValueError:
+        body = {'description': response.text[:200]}
+    return response.status_code, body
+
+
+async def _send_one(message, url, global_bucket, chat_buckets, cfg):
+    """Consegna un messaggio con retry. Ritorna DELIVERED, RETRY o FAILED."""
+    payload = {
+        'chat_id': message['chat_id'],
+        'text': message['text'],
+        'parse_mode': message['parse_mode'],
+        'disable_web_page_preview': True
+    }
+    chat_bucket = chat_buckets[message['chat_id']]
+
+    for attempt in range(cfg['max_retries'] + 1):
+        await chat_bucket.acquire()
+        await global_bucket.acquire()
+        message['attempts'] += 1
+
+        try:
+            status, body = await asyncio.to_thread(_post, url, payload, cfg['timeout'])
+        except requests.exceptions.RequestException as e:
+            status, body, reason = None, {}, type(e).__name__
+        else:
+            reason = body.get('description', f"HTTP {status}")
+
+        if status == 200 and body.get('ok'):
+            return DELIVERED
+
+        if status == 429:
+            # Telegram indica quanto attendere prima di riprovare
+            delay = float(body.get('parameters', {}).get('retry_after', cfg['backoff_base']))
+        elif status is None or status >= 500:
+            delay = cfg['backoff_base'] * 2 ** attempt * (1 + random.random() * 0.25)
+        else:
+            print(f"❌ Telegram chat {message['chat_id']}: {reason} (scartato)")
+            return FAILED
+
+        if attempt < cfg['max_retries']:
+            await asyncio.sleep(min(delay, cfg['max_backoff']))
+
+    print(f"⚠️ Telegram chat {message['chat_id']}: {reason}, rinvio al prossimo run")
+    return RETRY
+
+
+async def _send_chat(queue, url, global_bucket, chat_buckets, cfg):
+    """
+    Consegna in sequenza i messaggi di una chat. Dopo un RETRY i successivi
+    restano in outbox senza essere inviati, per non superare quello in attesa.
+    """
+    outcomes = {}
+    for message in queue:
+        if RETRY in outcomes.values():
+            outcomes[message['id']] = RETRY
+        else:
+            outcomes[message['id']] = await _send_one(message, url, global_bucket, chat_buckets, cfg)
+    return outcomes
+
+
+async def deliver(messages, bot_token, config=None):
+    """
+    Invia i messaggi rispettando i rate limit: le chat in parallelo, i
+    messaggi di ciascuna chat in ordine (prima la outbox, poi i nuovi).
+    Ritorna {id messaggio: esito}.
+    """
+    cfg = {**TELEGRAM_CONFIG, **(config or {})}
+    url = API_URL.format(token=bot_token)
+    global_bucket = TokenBucket(cfg['global_rate'])
+    queues = {}
+    for m in messages:
+        queues.setdefault(m['chat_id'], []).append(m)
+    chat_buckets = {chat_id: TokenBucket(cfg['per_chat_rate'], capacity=1) for chat_id in queues}
+
+    results = await asyncio.gather(
+        *(_send_chat(queue, url, global_bucket, chat_buckets, cfg) for queue in queues.values())
+    )
+    return {message_id: outcome for chat in results for message_id, outcome in chat.items()}
+
+
+async def send_messages_async(new, outbox=None):
+    """
+    Consegna i messaggi `new` (vedi make_messages) insieme a quelli rimasti
+    in outbox. Ritorna {id messaggio: esito} per i nuovi messaggi.
+    """
+    bot_token = get_secret('TELEGRAM_BOT_TOKEN')
+    outbox = outbox or Outbox()
+
+    pending = outbox.load()
+    queued_ids = {m['id'] for m in pending}
+    messages = pending + [m for m in new if m['id'] not in queued_ids]
+
+    if not messages:
+        return {}
+    if not bot_token:
+        outbox.save(messages)
+        print(f"⚠️ TELEGRAM_BOT_TOKEN mancante: {len(messages)} messaggi lasciati in outbox.")
+        return {m['id']: RETRY for m in new}
+
+    if pending:
+        print(f"📬 Outbox Telegram: reinvio di {len(pending)} messaggi in attesa...")
+    outcomes = await deliver(messages, bot_token)
+    outbox.save([m for m in messages if outcomes[m['id']] == RETRY])
+    return {m['id']: outcomes[m['id']] for m in new}
+
+
+async def send_async(text, parse_mode='HTML', chat_ids=None, outbox=None):
+    """
+    Consegna `text` a tutti i destinatari (più l'eventuale outbox).
+    Ritorna (consegnati, totale destinatari).
+    """
+    chat_ids = chat_ids if chat_ids is not None else get_chat_ids()
+    new = make_messages(text, chat_ids, parse_mode) if text else []
+    outcomes = await send_messages_async(new, outbox)
+    return sum(o == DELIVERED for o in outcomes.values()), len(new)
+
+
+def send_messages(new, outbox=None):
+    """Versione sincrona di send_messages_async (da usare fuori da un event loop)."""
+    return asyncio.run(send_messages_async(new, outbox))
+
+
+def send(text, parse_mode='HTML', chat_ids=None, outbox=None):
+    """Versione sincrona di send_async (da usare fuori da un event loop)."""
+    return asyncio.run(send_async(text, parse_mode, chat_ids, outbox))
+
+
+def flush_outbox(outbox=None):
+    """Reinvia i messaggi rimasti in outbox dai run precedenti. Ritorna quanti restano."""
+    outbox = outbox or Outbox()
+    if not outbox.load():
+        return 0
+    asyncio.run(send_async(None, outbox=outbox))
+    return len(outbox.load())
@@ -1,5 +1,10 @@
 # utils.py
 import os
+import json
+import hashlib
+import subprocess
+import numpy as np
+import pandas as pd
 import streamlit as st
 
 def get_secret(key_name):
@@ -19,3 +24,38 @@ def get_secret(key_name):
         pass
         
     return None
+
+
+def content_hash(*parts):
+    """
+    Calcola un'impronta SHA-256 stabile degli oggetti forniti.
+    DataFrame/Series vengono hashati sul contenuto (indice incluso), gli array
+    numpy sui byte, tutto il resto sulla rappresentazione JSON ordinata.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            h.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+            if isinstance(part, pd.DataFrame):
+                h.update(repr(list(part.columns)).encode())
+        elif isinstance(part, np.ndarray):
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def get_git_commit():
+    """Hash breve del commit corrente ('unknown' fuori da un repository git)."""
+    # Su GitHub Actions il checkout può non avere .git completo: usiamo la variabile d'ambiente
+    if os.environ.get('GITHUB_SHA'):
+        return os.environ['GITHUB_SHA'][:7]
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode().strip()
+    except Exception:
+        return 'unknown'
@@ -0,0 +1,454 @@
+# vol_models.py - Zoo di modelli di volatilità (famiglia GARCH) con combinazione
+# Kriterion Volatility Monitor
+#
+# Un GARCH(1,1) gaussiano ignora l'effetto leva e le code spesse dei rendimenti
+# (azionari e del log-VIX). Qui ogni modello dello zoo (GARCH, GJR-GARCH ed
+# EGARCH con errori normali, t o skew-t, vedi VOL_MODELS_CONFIG) è stimato con
+# lo stesso schema:
+#   1. QLIKE rolling fuori campione: la finestra di valutazione è divisa in
+#      blocchi di refit_every sedute; all'inizio di ogni blocco il modello è
+#      ri-stimato sulle sedute precedenti (partendo dai parametri del blocco
+#      prima) e il blocco è previsto 1-step a parametri congelati
+#   2. fit finale su tutto il campione partendo dai parametri dell'ultimo blocco
+# I modelli sono ordinati per QLIKE fuori campione e il forecast pubblicato è
+# quello del migliore o una combinazione con pesi exp(-n/2 · ΔQLIKE), cioè
+# pesi da quasi-verosimiglianza gaussiana sulla finestra di valutazione.
+# Lo zoo include anche EWMA e HAR-RV (fast_vol.py), valutati con lo stesso
+# schema; se nessun modello arch converge si pubblica FAST_VOL_CONFIG['fallback'].
+#
+# Costo: ogni modello arch richiede (blocchi + 1) stime contro l'unica del
+# GARCH(1,1) di base (~0.02s su 1000 sedute); con lo zoo di default e 4 blocchi
+# il totale sequenziale è ~0.4s. Con più core i modelli girano nel pool di
+# processi persistente (stages.process_pool) e il tempo di parete si riduce a
+# circa quello del modello più lento; con un solo core lo zoo resta nel
+# processo corrente (il pool aggiungerebbe solo serializzazione).
+
+import os
+import warnings
+import multiprocessing
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from arch import arch_model
+from arch.utility.exceptions import StartingValueWarning
+
+from stages import Stage, run_stages
+from instrumentation import instrumented, annotate
+from fast_vol import FastForecaster, FAST_MODELS, next_variance as fast_next_variance
+from config import GARCH_PARAMS, VOL_MODELS_CONFIG, FAST_VOL_CONFIG, TERM_STRUCTURE_CONFIG
+
+# E|z| usato da arch nella ricorsione EGARCH (indipendente dalla distribuzione)
+EGARCH_ABS_MEAN = np.sqrt(2 / np.pi)
+# Simulazioni per i forecast multi-step dei modelli senza forma analitica (EGARCH)
+FORECAST_SIMULATIONS = 2000
+FORECAST_SEED = 42
+
+
+def baseline_spec():
+    """Il modello storico del monitor: GARCH(p,q) simmetrico con GARCH_PARAMS['dist']."""
+    return {'vol': 'GARCH', 'o': 0, 'dist': GARCH_PARAMS['dist']}
+
+
+def make_model(returns, spec):
+    return arch_model(returns, p=GARCH_PARAMS['p'], o=spec.get('o', 0), q=GARCH_PARAMS['q'],
+                      dist=spec['dist'], vol=spec['vol'])
+
+
+def qlike(variance, resid):
+    """Perdita QLIKE media log σ² + ε²/σ² (robusta all'uso di ε² come proxy della varianza)."""
+    variance = np.asarray(variance, dtype=float)
+    return float(np.mean(np.log(variance) + np.asarray(resid, dtype=float) ** 2 / variance))
+
+
+def forecast_variance(res, horizon=1):
+    """Varianza prevista (%²) per gli orizzonti 1..horizon di un fit arch o di un FastForecaster."""
+    if isinstance(res, FastForecaster):
+        return res.forecast_variance(horizon)
+    if horizon == 1 or res.model.volatility.name != 'EGARCH':
+        forecast = res.forecast(horizon=horizon, reindex=False)
+    else:
+        # L'EGARCH non ha forecast analitico oltre il primo passo
+        rng = np.random.default_rng(FORECAST_SEED)
+        forecast = res.forecast(horizon=horizon, method='simulation', simulations=FORECAST_SIMULATIONS,
+                                rng=lambda size: rng.standard_normal(size), reindex=False)
+    return forecast.variance.values[-1]
+
+
+def term_structure_variance(res, horizon):
+    """
+    Varianza prevista (%²) per gli orizzonti 1..horizon in un solo passo vettoriale.
+
+    GARCH/GJR(1,1) in forma chiusa: σ²(h) = σ̄² + φ^(h-1)·(σ²(1) - σ̄²), con
+    φ la persistenza e σ̄² = ω/(1-φ). EGARCH e ordini superiori usano arch,
+    EWMA e HAR-RV le proprie ricorsioni.
+    """
+    if isinstance(res, FastForecaster):
+        return res.forecast_variance(horizon)
+    vol = res.model.volatility
+    if vol.name != 'GARCH' or max(vol.p, vol.o, vol.q) > 1:
+        return forecast_variance(res, horizon)
+
+    c = _recursion_state(res)
+    var1 = _next_variance(c, c['resid'], c['sigma2'])
+    phi = persistence(res)
+    steps = np.arange(horizon)
+    if phi >= 1:
+        # Varianza integrata (IGARCH): nessun livello di lungo periodo, crescita lineare in ω
+        return var1 + c['omega'] * steps
+    long_run = c['omega'] / (1 - phi)
+    return long_run + phi ** steps * (var1 - long_run)
+
+
+def persistence(res):
+    """Persistenza della varianza: β (EGARCH) o α + β + γ/2 (GARCH/GJR, innovazioni simmetriche)."""
+    if isinstance(res, FastForecaster):
+        return res.persistence()
+    params = res.params
+    beta = sum(v for k, v in params.items() if k.startswith('beta['))
+    if res.model.volatility.name == 'EGARCH':
+        return float(beta)
+    alpha = sum(v for k, v in params.items() if k.startswith('alpha['))
+    gamma = sum(v for k, v in params.items() if k.startswith('gamma['))
+    return float(alpha + beta + 0.5 * gamma)
+
+
+def oos_blocks(n_obs, oos_window, refit_every=None):
+    """Blocchi (inizio, fine) della finestra di valutazione, uno per ri-stima."""
+    refit_every = VOL_MODELS_CONFIG['refit_every'] if refit_every is None else refit_every
+    start = n_obs - oos_window
+    step = refit_every or oos_window     # 0: un solo blocco a parametri congelati
+    return [(b, min(b + step, n_obs)) for b in range(start, n_obs, step)]
+
+
+def _fit_from(model, starting_values, **kwargs):
+    with warnings.catch_warnings():
+        # Se i parametri di partenza violano i vincoli arch riparte dai propri valori iniziali
+        warnings.simplefilter('ignore', StartingValueWarning)
+        return model.fit(starting_values=starting_values, disp='off', **kwargs)
+
+
+def fit_spec(returns, spec, oos_window, rv=None, refit_every=None):
+    """
+    Stima un modello dello zoo e ne misura la QLIKE rolling fuori campione (worker di processo).
+
+    Returns:
+    --------
+    dict
+        result (fit finale su tutto il campione), qlike e oos_sigma2 (σ² 1-step
+        fuori campione sulla finestra di valutazione, %²); None se oos_window=0
+    """
+    if spec['vol'] in FAST_MODELS:
+        return _fit_fast(returns, rv, spec, oos_window, refit_every)
+
+    model = make_model(returns, spec)
+    if not oos_window:
+        return {'result': model.fit(disp='off'), 'qlike': None, 'oos_sigma2': None}
+
+    sigma2, resid, params = [], [], None
+    for start, end in oos_blocks(len(returns), oos_window, refit_every):
+        train = _fit_from(model, params, last_obs=start)
+        params = train.params.values
+        # Con parametri fissi la varianza condizionale di t usa solo informazione fino a t-1
+        fixed = model.fix(train.params)
+        sigma2.append(fixed.conditional_volatility[start:end] ** 2)
+        resid.append(fixed.resid[start:end])
+    return {'result': _fit_from(model, params), **_oos_result(returns, sigma2, resid)}
+
+
+def _fit_fast(returns, rv, spec, oos_window, refit_every=None):
+    """Come fit_spec per EWMA/HAR: fit(last_obs) calcola già la coda a parametri fissi."""
+    cls = FAST_MODELS[spec['vol']]
+    if not oos_window:
+        return {'result': cls(returns, rv).fit(), 'qlike': None, 'oos_sigma2': None}
+    sigma2, resid = [], []
+    for start, end in oos_blocks(len(returns), oos_window, refit_every):
+        train = cls(returns, rv).fit(last_obs=start)
+        sigma2.append(train.sigma2[start:end])
+        resid.append(train.resid.values[start:end])
+    return {'result': cls(returns, rv).fit(), **_oos_result(returns, sigma2, resid)}
+
+
+def _oos_result(returns, sigma2, resid):
+    """QLIKE e serie delle σ² fuori campione (blocchi concatenati, indice delle sedute previste)."""
+    sigma2 = np.concatenate(sigma2)
+    return {'qlike': qlike(sigma2, np.concatenate(resid)),
+            'oos_sigma2': pd.Series(sigma2, index=returns.index[len(returns) - len(sigma2):])}
+
+
+def combination_weights(losses, n_obs, mode=None, min_weight=None):
+    """
+    Pesi dei modelli dalla QLIKE media fuori campione.
+
+    'best' assegna tutto al migliore; 'weighted' usa exp(-n_obs/2 · ΔQLIKE)
+    (rapporto di quasi-verosimiglianza gaussiana) ed esclude i pesi sotto min_weight.
+    """
+    mode = mode or VOL_MODELS_CONFIG['combination']
+    min_weight = VOL_MODELS_CONFIG['min_weight'] if min_weight is None else min_weight
+    losses = np.asarray(losses, dtype=float)
+    if mode == 'best':
+        weights = np.zeros(len(losses))
+        weights[np.argmin(losses)] = 1.0
+        return weights
+
+    weights = np.exp(-0.5 * n_obs * (losses - losses.min()))
+    weights /= weights.sum()
+    weights[weights < min_weight] = 0.0
+    return weights / weights.sum()
+
+
+class VolatilityForecast:
+    """
+    Forecast pubblicato dallo zoo: modello migliore o combinazione pesata.
+
+    Gli attributi usati dal resto della pipeline (params, resid,
+    convergence_flag, optimization_result) si riferiscono al modello con il
+    peso maggiore; conditional_volatility e variance combinano i componenti.
+    """
+
+    def __init__(self, components, table, forecasts=None, horizon=None):
+        self.components = components    # [{'name', 'result', 'weight'}] in ordine di peso decrescente
+        self.table = table              # Classifica completa dello zoo
+        self.forecasts = forecasts or {}    # Per modello: varianza 1-step in campione e prossima (forecast_eval)
+        # Curva combinata 1..horizon calcolata una volta al fit: viaggia in cache con il modello
+        self.term_variance = self._combine(horizon or TERM_STRUCTURE_CONFIG['max_horizon'])
+
+    def _combine(self, horizon):
+        return sum(c['weight'] * term_structure_variance(c['result'], horizon) for c in self.components)
+
+    @property
+    def best(self):
+        return self.components[0]['result']
+
+    @property
+    def name(self):
+        if len(self.components) == 1:
+            return self.components[0]['name']
+        return ' + '.join(f"{c['name']} {c['weight']:.0%}" for c in self.components)
+
+    @property
+    def params(self):
+        return self.best.params
+
+    @property
+    def resid(self):
+        return self.best.resid
+
+    @property
+    def convergence_flag(self):
+        return self.best.convergence_flag
+
+    @property
+    def optimization_result(self):
+        return getattr(self.best, 'optimization_result', None)
+
+    @property
+    def conditional_volatility(self):
+        """Volatilità condizionale in campione (%), combinata sulle varianze."""
+        return np.sqrt(sum(c['weight'] * c['result'].conditional_volatility ** 2 for c in self.components))
+
+    def variance(self, horizon=1):
+        """Varianza prevista combinata (%²) per gli orizzonti 1..horizon."""
+        if horizon <= len(self.term_variance):
+            return self.term_variance[:horizon]
+        return self._combine(horizon)
+
+    def oos_variance(self):
+        """
+        σ² 1-step fuori campione della combinazione sulla finestra di valutazione
+        (None senza finestra). I pesi sono stimati sulla stessa finestra.
+        """
+        parts = [(c['weight'], self.forecasts.get(c['name'], {}).get('oos_sigma2')) for c in self.components]
+        if not parts or any(sigma2 is None for _, sigma2 in parts):
+            return None
+        return sum(w * sigma2 for w, sigma2 in parts)
+
+    def vol_ann(self, horizon=1):
+        """Volatilità annualizzata (decimale) prevista per la seduta a distanza horizon."""
+        return float(np.sqrt(self.variance(horizon)[horizon - 1]) / 100 * np.sqrt(252))
+
+    def term_structure(self, tenors=None):
+        """
+        Struttura a termine del forecast, senza nuovi fit.
+
+        Returns:
+        --------
+        tuple
+            (DataFrame horizon, vol_ann puntuale e avg_vol_ann media integrata su 1..h;
+             dict tenor -> volatilità media integrata annualizzata)
+        """
+        horizons = np.arange(1, len(self.term_variance) + 1)
+        avg_variance = np.cumsum(self.term_variance) / horizons
+        curve = pd.DataFrame({
+            'horizon': horizons,
+            'vol_ann': np.sqrt(self.term_variance * 252) / 100,
+            'avg_vol_ann': np.sqrt(avg_variance * 252) / 100
+        })
+        tenors = tenors or TERM_STRUCTURE_CONFIG['tenors']
+        return curve, {label: float(curve['avg_vol_ann'].iloc[min(n, len(curve)) - 1]) for label, n in tenors.items()}
+
+    def nowcast_state(self):
+        """Stato minimo dei componenti per avanzare la ricorsione di un passo (vedi nowcast_variance)."""
+        return {'components': [_component_state(c['result'], c['weight']) for c in self.components]}
+
+
+# =============================================================================
+# RICORSIONE A UN PASSO (NOWCAST)
+# =============================================================================
+
+def _component_state(res, weight):
+    if isinstance(res, FastForecaster):
+        return {**res.nowcast_state(), 'weight': float(weight)}
+    return {**_recursion_state(res), 'weight': float(weight),
+            'next_sigma2': float(forecast_variance(res, 1)[0])}    # σ² prevista per T+1 (%²)
+
+
+def _recursion_state(res):
+    """Parametri e ultimi ε, σ² (in %, ordine cronologico) di un fit arch per la ricorsione a un passo."""
+    params = res.params
+    vol = res.model.volatility
+    dist = res.model.distribution
+    m = max(vol.p, vol.o, vol.q, 1)
+    return {
+        'vol': vol.name,
+        # Distribuzione delle innovazioni (classe arch.univariate e parametri) per la simulazione
+        'dist': type(dist).__name__,
+        'dist_params': [float(params[name]) for name in dist.parameter_names()],
+        'mu': float(params.get('mu', 0.0)),
+        'omega': float(params['omega']),
+        'alpha': [float(params[f'alpha[{i}]']) for i in range(1, vol.p + 1)],
+        'gamma': [float(params[f'gamma[{i}]']) for i in range(1, vol.o + 1)],
+        'beta': [float(params[f'beta[{i}]']) for i in range(1, vol.q + 1)],
+        # ε e σ² fino alla seduta T
+        'resid': res.resid.values[-m:].tolist(),
+        'sigma2': (res.conditional_volatility.values[-m:] ** 2).tolist()
+    }
+
+
+def _next_variance(c, resid, sigma2):
+    """
+    σ² del periodo successivo a partire da ε e σ² in ordine cronologico.
+    Gli elementi possono essere scalari o array (un valore per percorso, vedi simulation.py).
+    """
+    eps, s2 = resid[::-1], sigma2[::-1]     # il più recente per primo
+    if c['vol'] == 'EGARCH':
+        z = [e / np.sqrt(s) for e, s in zip(eps, s2)]
+        log_var = (c['omega']
+                   + sum(a * (np.abs(zi) - EGARCH_ABS_MEAN) for a, zi in zip(c['alpha'], z))
+                   + sum(g * zi for g, zi in zip(c['gamma'], z))
+                   + sum(b * np.log(s) for b, s in zip(c['beta'], s2)))
+        return np.exp(log_var)
+    return (c['omega']
+            + sum(a * e ** 2 for a, e in zip(c['alpha'], eps))
+            + sum(g * e ** 2 * (e < 0) for g, e in zip(c['gamma'], eps))
+            + sum(b * s for b, s in zip(c['beta'], s2)))
+
+
+def nowcast_variance(state, r, rv=None):
+    """
+    Varianza combinata (%²) per la seduta successiva dato il rendimento (%) della
+    seduta in corso e, per HAR-RV, la sua varianza realizzata (%², default r²).
+    """
+    total = 0.0
+    for c in state['components']:
+        if c['vol'] in FAST_MODELS:
+            total += c['weight'] * fast_next_variance(c, r, rv)
+            continue
+        resid = c['resid'] + [r - c['mu']]
+        sigma2 = c['sigma2'] + [c['next_sigma2']]
+        total += c['weight'] * _next_variance(c, resid, sigma2)
+    return float(total)
+
+
+# =============================================================================
+# STIMA DELLO ZOO
+# =============================================================================
+
+@instrumented('fit_vol_models')
+def fit_vol_models(returns, rv=None):
+    """
+    Stima lo zoo in parallelo e costruisce il forecast pubblicato.
+
+    Parameters:
+    -----------
+    returns : pd.Series
+        Rendimenti in percentuale (finestra di stima)
+    rv : pd.Series, optional
+        Varianza realizzata (%²) allineata ai rendimenti, per HAR-RV (default: r²)
+
+    Returns:
+    --------
+    VolatilityForecast
+    """
+    cfg = VOL_MODELS_CONFIG
+    specs = cfg['models'] if cfg['enabled'] else {'GARCH': baseline_spec()}
+    oos_window = min(cfg['oos_window'], len(returns) // 4) if len(specs) > 1 else 0
+
+    # Dentro un processo figlio (es. replay parallelo) o con un solo core lo zoo
+    # resta nel processo corrente
+    nested = multiprocessing.parent_process() is not None
+    workers = 1 if nested or len(specs) == 1 else min(cfg['workers'], len(specs), os.cpu_count() or 1)
+    results = run_stages(
+        [Stage(name, partial(fit_spec, spec=spec, oos_window=oos_window), deps=['returns', 'rv'])
+         for name, spec in specs.items()],
+        mode='thread' if workers == 1 else 'process',
+        max_workers=workers,
+        inputs={'returns': returns, 'rv': rv}
+    )
+
+    fitted, table = [], []
+    for name in specs:
+        res = results[name]
+        if not res.ok:
+            print(f"   ⚠️ Modello di volatilità {name} escluso: {res.error}")
+            table.append({'model': name, 'qlike': None, 'weight': 0.0, 'error': str(res.error)})
+            continue
+        if res.value['result'].convergence_flag != 0:
+            # Stima arch non a convergenza: in classifica ma fuori dalla combinazione
+            print(f"   ⚠️ Modello di volatilità {name} non a convergenza: escluso dalla combinazione")
+            table.append(_table_row(name, res.value, 0.0))
+            continue
+        fitted.append((name, res.value))
+    if not fitted:
+        # Nessun modello arch utilizzabile: forecaster a costo costante senza ottimizzatore
+        name = FAST_VOL_CONFIG['fallback']
+        print(f"   ⚠️ Nessun modello di volatilità a convergenza: fallback {name}")
+        fitted = [(name, fit_spec(returns, {'vol': name}, 0, rv=rv))]
+
+    losses = [v['qlike'] if v['qlike'] is not None else 0.0 for _, v in fitted]
+    weights = combination_weights(losses, oos_window) if oos_window and len(fitted) > 1 else np.ones(1)
+
+    components, forecasts = [], {}
+    for (name, value), weight in zip(fitted, weights):
+        table.append(_table_row(name, value, weight))
+        forecasts[name] = _model_forecasts(value)
+        if weight > 0:
+            components.append({'name': name, 'result': value['result'], 'weight': float(weight)})
+
+    components.sort(key=lambda c: -c['weight'])
+    table.sort(key=lambda row: (row['qlike'] is None, row['qlike'] if row['qlike'] is not None else 0.0))
+    forecast = VolatilityForecast(components, table, forecasts)
+    annotate(models=len(fitted), published=forecast.name)
+    return forecast
+
+
+def _model_forecasts(value):
+    """
+    Varianza condizionale in campione (σ² di t noto a t-1), σ² 1-step fuori
+    campione della finestra di valutazione e forecast per la seduta successiva, in %².
+    """
+    res = value['result']
+    return {'sigma2': res.conditional_volatility ** 2, 'oos_sigma2': value.get('oos_sigma2'),
+            'next': float(forecast_variance(res, 1)[0])}
+
+
+def _table_row(name, value, weight):
+    result = value['result']
+    return {
+        'model': name,
+        'qlike': value['qlike'],
+        'weight': float(weight),
+        'persistence': persistence(result),
+        'log_likelihood': float(result.loglikelihood),
+        'converged': result.convergence_flag == 0
+    }